@@ -16,6 +16,7 @@ from optparse import OptionParser
 import logging
 import os
 import sys
+import signal
 from thrive.cleanup_handler import CleanupHandler
 from thrive.rollback_handler import RollbackHandler
 from thrive.setup_handler import SetupHandler
@@ -23,6 +24,9 @@ from thrive.prepare_handler import PrepareHandler
 from thrive.load_handler import LoadHandler
 from thrive.monitor_handler import MonitorHandler
 from thrive.replay_handler import ReplayHandler
+from thrive.repair_handler import RepairHandler
+from thrive.migrate_handler import MigrateHandler
+from thrive.load_daemon import LoadDaemon
 from thrive.utils import init_logging, logkv
 from thrive.exceptions import ThriveBaseException
 
@@ -55,6 +59,17 @@ def add_options(_parser):
     _parser.add_option("--replay-dirs", dest="replaydirs_file", action="store",
                        help="[only if phase=replay] Path to replay-dirs file")
 
+    _parser.add_option("--migrations", dest="migrations_dir", action="store",
+                       default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                            "utils", "metadata", "migrations"),
+                       help="[only if phase=migrate] Path to the metadata migrations "
+                            "directory")
+
+    _parser.add_option("--daemon", dest="daemon", action="store_true", default=False,
+                       help="[only if phase=load] Keep loading the datasets in a "
+                            "long-running process. --data-config may then be a "
+                            "comma-separated list of config files")
+
 
 def check_options(_parser, _options):
     """
@@ -93,6 +108,9 @@ def check_options(_parser, _options):
     if (_options.phase == "replay") and (not _options.replaydirs_file):
         opterr, errmsg = True, "Workflow option \"replay-dirs\" is required for phase \"replay\""
 
+    if _options.daemon and (_options.phase != "load"):
+        opterr, errmsg = True, "Workflow option \"daemon\" is only valid for phase \"load\""
+
     if opterr:
         _parser.print_help()
         _parser.error(errmsg)
@@ -114,8 +132,10 @@ def main():
                                 [--resources=<path/to/resources_file>]
                                 [--partitions=<path/to/partitions_file>]
                                 [--replay-dirs=<path/to/replaydirs_file>]
+                                [--migrations=<path/to/migrations_dir>]
+                                [--daemon]
 
-           'phase' = [cleanup | setup | load | rollback | monitor | replay]
+           'phase' = [cleanup | setup | load | rollback | monitor | replay | repair | migrate]
         """
 
     # Instantiate parser
@@ -128,16 +148,31 @@ def main():
     # Check options for any errors
     check_options(parser, options)
 
+    # In daemon mode, several datasets can be loaded by the same process
+    if options.daemon:
+        datacfg_files = options.datacfg_file.split(",")
+    else:
+        datacfg_files = [options.datacfg_file]
+
     # Exit if config files dont exist
-    for cfgfile in [options.envcfg_file, options.datacfg_file]:
+    for cfgfile in [options.envcfg_file] + datacfg_files:
         if not os.path.exists(cfgfile):
             sys.stderr.write("Config file %s does not exist\n" % cfgfile)
             sys.exit(1)
 
-    # Initialize logger
-    init_logging(options.datacfg_file)
+    # Initialize logger. The load daemon logs each load to the log of its dataset.
+    init_logging(datacfg_files[0])
     logger = logging.getLogger(__name__)
 
+    # Run the load daemon until it is terminated
+    if options.daemon:
+        daemon = LoadDaemon([(datacfg_file, options.envcfg_file)
+                             for datacfg_file in datacfg_files])
+        signal.signal(signal.SIGTERM, daemon.stop)
+        signal.signal(signal.SIGINT, daemon.stop)
+        daemon.run()
+        return
+
     # Run Thrive
     try:
         if options.phase == "cleanup":
@@ -167,6 +202,15 @@ def main():
                                     envcfg_file=options.envcfg_file,
                                     replaydirs_file=options.replaydirs_file)
 
+        elif options.phase == "repair":
+            handler = RepairHandler(datacfg_file=options.datacfg_file,
+                                    envcfg_file=options.envcfg_file)
+
+        elif options.phase == "migrate":
+            handler = MigrateHandler(datacfg_file=options.datacfg_file,
+                                     envcfg_file=options.envcfg_file,
+                                     migrations_dir=options.migrations_dir)
+
         elif options.phase == "monitor":
             handler = MonitorHandler(datacfg_file=options.datacfg_file,
                                      envcfg_file=options.envcfg_file)
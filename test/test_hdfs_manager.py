@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import unittest
 import mock
 import thrive.hdfs_manager as thm
@@ -79,6 +80,39 @@ class TestHdfsManager(unittest.TestCase):
         mock_safe_execute.side_effect = tse.ShellException()
         self.assertFalse(self.hm.path_exists(self.hdfspath))
 
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_path_exists_cached(self, mock_safe_execute):
+        mock_safe_execute.side_effect = tse.ShellException()
+        tse.command_cache.enable()
+        try:
+            self.assertFalse(self.hm.path_exists("/foo/bar/0"))
+            self.assertFalse(self.hm.path_exists("/foo/bar/0"))
+            self.assertEqual(mock_safe_execute.call_count, 1)
+
+            # Writing to a parent invalidates the cached result
+            mock_safe_execute.side_effect = None
+            self.hm.makedir("/foo/bar")
+            self.assertTrue(self.hm.path_exists("/foo/bar/0"))
+            self.assertEqual(mock_safe_execute.call_count, 3)
+        finally:
+            tse.command_cache.disable()
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute_batch")
+    def test_paths_exist(self, mock_execute_batch):
+        paths = ["/foo/bar", "/foo/baz"]
+        mock_execute_batch.return_value = [tse.ShellResult(0, "", ""),
+                                           tse.ShellResult(1, "", "")]
+        exist = self.hm.paths_exist(paths)
+        mock_execute_batch.assert_called_with(["hadoop fs -test -e %s" % p for p in paths],
+                                              splitcmd=False, as_shell=True)
+        self.assertDictEqual(exist, {"/foo/bar": True, "/foo/baz": False})
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute_batch")
+    def test_paths_exist_exception(self, mock_execute_batch):
+        mock_execute_batch.side_effect = tse.ShellException()
+        with self.assertRaises(thex.HdfsManagerException):
+            self.hm.paths_exist(["/foo/bar"])
+
     @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
     def test_decompress(self, mock_safe_execute):
         srcpath = "/srcfoo/srcbar"
@@ -96,6 +130,29 @@ class TestHdfsManager(unittest.TestCase):
         with self.assertRaises(thex.HdfsManagerException):
             self.hm.decompress(srcpath, dstpath)
 
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute_batch")
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_decompress_parts(self, mock_stream, mock_batch):
+        mock_stream.return_value = iter([
+            "Found 3 items",
+            "-rw-r--r--   3 foo bar          0 2016-08-12 14:10 /src/_SUCCESS",
+            "-rw-r--r--   3 foo bar       1234 2016-08-12 14:10 /src/part-00000.bz2",
+            "-rw-r--r--   3 foo bar       1234 2016-08-12 14:10 /src/part-00001.bz2"])
+        dstfiles = self.hm.decompress_parts("/src", "/dst", workers=2)
+        self.assertListEqual(dstfiles, ["/dst/part-00000.txt", "/dst/part-00001.txt"])
+        mock_batch.assert_called_with(
+            ["hadoop fs -text /src/part-00000.bz2 | hadoop fs -put - /dst/part-00000.txt",
+             "hadoop fs -text /src/part-00001.bz2 | hadoop fs -put - /dst/part-00001.txt"],
+            2, as_shell=True, splitcmd=False, verbose=False)
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute_batch")
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_decompress_parts_exception(self, mock_stream, mock_batch):
+        mock_stream.return_value = iter(["-rw-r--r--   3 foo bar 1 2016-08-12 14:10 /src/part-0"])
+        mock_batch.side_effect = tse.ShellBatchException(["foo"])
+        with self.assertRaises(thex.HdfsManagerException):
+            self.hm.decompress_parts("/src", "/dst")
+
     @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
     def test_grantall(self, mock_safe_execute):
         perms = "rwx"
@@ -111,99 +168,261 @@ class TestHdfsManager(unittest.TestCase):
             self.hm.grantall(perms, self.hdfspath)
 
     @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
-    def test_get_newdirs_shell(self, mock_safe_execute):
-        mock_safe_execute.return_value = tse.ShellResult(0, self.returned_dirs, "")
+    def test_grant(self, mock_safe_execute):
+        self.hm.grant("rx", ["/foo", "/foo/bar"])
+        mock_safe_execute.assert_called_with("hadoop fs -chmod a+rx /foo /foo/bar")
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_grant_exception(self, mock_safe_execute):
+        mock_safe_execute.side_effect = tse.ShellException()
+        with self.assertRaises(thex.HdfsManagerException):
+            self.hm.grant("rx", ["/foo"])
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_grant_partition(self, mock_safe_execute):
+        granted = set()
+        self.hm.grant_partition("rx", "/foo/2016/08/12/14/0", "/foo", granted)
+        mock_safe_execute.assert_has_calls([
+            mock.call("hadoop fs -chmod a+rx /foo /foo/2016 /foo/2016/08 "
+                      "/foo/2016/08/12 /foo/2016/08/12/14"),
+            mock.call("hadoop fs -chmod -R a+rx /foo/2016/08/12/14/0")])
+        self.assertSetEqual(granted, set(["/foo", "/foo/2016", "/foo/2016/08",
+                                          "/foo/2016/08/12", "/foo/2016/08/12/14"]))
+
+        # Ancestors granted already are skipped
+        self.hm.grant_partition("rx", "/foo/2016/08/12/15/0", "/foo", granted)
+        mock_safe_execute.assert_has_calls([
+            mock.call("hadoop fs -chmod a+rx /foo/2016/08/12/15"),
+            mock.call("hadoop fs -chmod -R a+rx /foo/2016/08/12/15/0")])
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_newdirs_shell(self, mock_stream):
+        mock_stream.return_value = iter(self.returned_dirs.splitlines())
         _ = self.hm.get_newdirs(self.hdfspath, self.lastdir, self.loadts,
                                 self.process_delay_hrs)
-        mock_safe_execute.assert_called_with("hadoop fs -ls %s" % self.hdfspath)
+        mock_stream.assert_called_with("hadoop fs -ls %s" % self.hdfspath)
 
-    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
-    def test_get_newdirs_return_val_no_lastdir(self, mock_safe_execute):
-        mock_safe_execute.return_value = tse.ShellResult(0, self.returned_dirs, "")
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_newdirs_return_val_no_lastdir(self, mock_stream):
+        mock_stream.return_value = iter(self.returned_dirs.splitlines())
         newdirs = self.hm.get_newdirs(self.hdfspath, None, self.loadts,
                                       self.process_delay_hrs)
         self.assertListEqual(newdirs, self.returned_dirs.split("\n"))
 
-    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
-    def test_get_newdirs_return_val_with_lastdir(self, mock_safe_execute):
-        mock_safe_execute.return_value = tse.ShellResult(0, self.returned_dirs, "")
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_newdirs_return_val_with_lastdir(self, mock_stream):
+        mock_stream.return_value = iter(self.returned_dirs.splitlines())
         newdirs = self.hm.get_newdirs(self.hdfspath, self.lastdir, self.loadts,
                                       self.process_delay_hrs)
         self.assertListEqual(newdirs, self.returned_dirs.split("\n")[1:])
 
-    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
-    def test_get_newdirs_delay(self, mock_safe_execute):
-        mock_safe_execute.return_value = tse.ShellResult(0, self.returned_dirs, "")
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_newdirs_delay(self, mock_stream):
+        mock_stream.return_value = iter(self.returned_dirs.splitlines())
         loadts = self.loadts - dt.timedelta(hours=8)
         newdirs = self.hm.get_newdirs(self.hdfspath, self.lastdir, loadts,
                                       self.process_delay_hrs)
         self.assertListEqual(newdirs, [])
 
-    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
-    def test_get_newdirs_exception(self, mock_safe_execute):
-        mock_safe_execute.side_effect = tse.ShellException()
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_newdirs_lastdir_not_found(self, mock_stream):
+        mock_stream.return_value = iter(self.returned_dirs.splitlines()[1:])
         with self.assertRaises(thex.HdfsManagerException):
             _ = self.hm.get_newdirs(self.hdfspath, self.lastdir, self.loadts,
                                     self.process_delay_hrs)
 
-    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
-    def test_get_subdirs_shell(self, mock_safe_execute):
-        mock_safe_execute.return_value = tse.ShellResult(0, "", "")
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_newdirs_exception(self, mock_stream):
+        mock_stream.side_effect = tse.ShellException()
+        with self.assertRaises(thex.HdfsManagerException):
+            _ = self.hm.get_newdirs(self.hdfspath, self.lastdir, self.loadts,
+                                    self.process_delay_hrs)
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute")
+    def test_ls_sourcedirs(self, mock_execute):
+        mock_execute.return_value = tse.ShellResult(0, self.returned_dirs, "")
+        days = [dt.date(2016, 8, 12), dt.date(2016, 8, 13)]
+        dirs = self.hm.ls_sourcedirs(self.hdfspath, days)
+        mock_execute.assert_called_with("hadoop fs -ls -d %s/d_{20160812,20160813}-*"
+                                        % self.hdfspath)
+        self.assertListEqual(dirs, self.returned_dirs.split("\n"))
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute")
+    def test_ls_sourcedirs_single_day(self, mock_execute):
+        mock_execute.return_value = tse.ShellResult(0, "", "")
+        self.hm.ls_sourcedirs(self.hdfspath, [dt.date(2016, 8, 12)])
+        mock_execute.assert_called_with("hadoop fs -ls -d %s/d_20160812-*" % self.hdfspath)
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute")
+    def test_ls_sourcedirs_no_match(self, mock_execute):
+        mock_execute.return_value = tse.ShellResult(
+            1, "", "ls: `hdfsfoo/hdfsbar/d_20160812-*': No such file or directory")
+        self.assertListEqual(self.hm.ls_sourcedirs(self.hdfspath, [dt.date(2016, 8, 12)]), [])
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute")
+    def test_ls_sourcedirs_exception(self, mock_execute):
+        mock_execute.return_value = tse.ShellResult(1, "", "Permission denied")
+        with self.assertRaises(tse.ShellException):
+            self.hm.ls_sourcedirs(self.hdfspath, [dt.date(2016, 8, 12)])
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_refresh_index_empty(self, mock_stream):
+        mock_stream.return_value = iter(self.returned_dirs.splitlines())
+        index = mock.MagicMock()
+        index.latest.return_value = None
+        self.hm.refresh_index(self.hdfspath, index, self.loadts)
+        mock_stream.assert_called_with("hadoop fs -ls %s" % self.hdfspath)
+        self.assertListEqual(list(index.add.call_args[0][0]),
+                             self.returned_dirs.split("\n"))
+        index.save.assert_called_with()
+
+    @mock.patch("thrive.hdfs_manager.HdfsManager.ls_sourcedirs")
+    def test_refresh_index_incremental(self, mock_ls_sourcedirs):
+        index = mock.MagicMock()
+        index.latest.return_value = "d_20160810-2350"
+        self.hm.refresh_index(self.hdfspath, index, self.loadts)
+        days = [dt.date(2016, 8, d) for d in range(10, 14)]
+        mock_ls_sourcedirs.assert_called_with(self.hdfspath, days)
+        index.add.assert_called_with(mock_ls_sourcedirs.return_value)
+        index.save.assert_called_with()
+
+    @mock.patch("thrive.hdfs_manager.HdfsManager.refresh_index")
+    def test_get_newdirs_index(self, mock_refresh_index):
+        index = mock.MagicMock()
+        index.after.return_value = self.returned_dirs.split("\n")[1:]
+        newdirs = self.hm.get_newdirs(self.hdfspath, self.lastdir, self.loadts,
+                                      self.process_delay_hrs, index=index)
+        mock_refresh_index.assert_called_with(self.hdfspath, index, self.loadts)
+        index.after.assert_called_with(self.lastdir)
+        self.assertListEqual(newdirs, self.returned_dirs.split("\n")[1:])
+
+    @mock.patch("thrive.hdfs_manager.HdfsManager.refresh_index")
+    def test_get_newdirs_index_exception(self, mock_refresh_index):
+        mock_refresh_index.side_effect = IOError()
+        with self.assertRaises(thex.HdfsManagerException):
+            self.hm.get_newdirs(self.hdfspath, self.lastdir, self.loadts,
+                                self.process_delay_hrs, index=mock.MagicMock())
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_subdirs_shell(self, mock_stream):
+        mock_stream.return_value = iter([])
         _ = self.hm.get_subdirs(self.hdfspath)
-        mock_safe_execute.assert_called_with("hadoop fs -ls %s" % self.hdfspath)
+        mock_stream.assert_called_with("hadoop fs -ls %s" % self.hdfspath)
 
-    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
-    def test_get_subdirs_return_val(self, mock_safe_execute):
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_subdirs_return_val(self, mock_stream):
         ptns = map(str, range(15))
         hdfsdirs = ["%s/%s" % (self.hdfspath, p) for p in ptns]
         ls_output= "\n".join(hdfsdirs)
-        mock_safe_execute.return_value = tse.ShellResult(0, ls_output, "")
+        mock_stream.return_value = iter(ls_output.splitlines())
         subdirs = self.hm.get_subdirs(self.hdfspath)
         self.assertListEqual(subdirs, ptns)
 
-    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
-    def test_get_subdirs_exception(self, mock_safe_execute):
-        mock_safe_execute.side_effect = tse.ShellException()
-        mock_safe_execute.return_value = tse.ShellResult(0, "", "")
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_subdirs_exception(self, mock_stream):
+        mock_stream.side_effect = tse.ShellException()
         with self.assertRaises(thex.HdfsManagerException):
             _ = self.hm.get_subdirs(self.hdfspath)
 
-    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
-    def test_get_primary_namenode_shell(self, mock_safe_execute):
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute_batch")
+    def test_get_primary_namenode_shell(self, mock_batch):
         namenodes = ["nn1", "nn2"]
         webhdfs_path = "/foo/bar"
         hdfs_user = "userfoo"
-        _ = self.hm.get_primary_namenode(namenodes, webhdfs_path, hdfs_user)
-        cmds = ["curl --negotiate -u:%s '%s?op=GETFILESTATUS' " \
+        mock_batch.return_value = [tse.ShellResult(0, "", "")] * 2
+        _ = self.hm.get_primary_namenode(namenodes, webhdfs_path, hdfs_user, timeout=3)
+        cmds = ["curl --negotiate -u:%s --max-time 3 '%s?op=GETFILESTATUS' " \
                 % (hdfs_user, "%s/foo/bar" % nn) for nn in namenodes]
-        self.assertEqual(mock_safe_execute.call_count, 2)
+        mock_batch.assert_called_once_with(cmds, 2, splitcmd=False, as_shell=True)
 
-        calls = [mock.call(cmd, splitcmd=False, as_shell=True) for cmd in cmds]
-        mock_safe_execute.assert_has_calls(calls, any_order=True)
-
-    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
-    def test_get_primary_namenode_return_val_namenode_found(self, mock_safe_execute):
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute_batch")
+    def test_get_primary_namenode_return_val_namenode_found(self, mock_batch):
         namenodes = ["nn1", "nn2"]
         webhdfs_path = "/foo/bar"
         hdfs_user = "userfoo"
-        mock_safe_execute.return_value = tse.ShellResult(0, "FileStatus", "")
+        mock_batch.return_value = [tse.ShellResult(0, "FileStatus", "")] * 2
         nn = self.hm.get_primary_namenode(namenodes, webhdfs_path, hdfs_user)
         self.assertEqual(nn, "nn1")
 
-    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
-    def test_get_primary_namenode_return_val_namenode_not_found(self, mock_safe_execute):
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute_batch")
+    def test_get_primary_namenode_skips_failed_namenode(self, mock_batch):
+        namenodes = ["nn1", "nn2"]
+        webhdfs_path = "/foo/bar"
+        hdfs_user = "userfoo"
+        mock_batch.return_value = [tse.ShellResult(28, "", "timed out"),
+                                   tse.ShellResult(0, "FileStatus", "")]
+        nn = self.hm.get_primary_namenode(namenodes, webhdfs_path, hdfs_user)
+        self.assertEqual(nn, "nn2")
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute_batch")
+    def test_get_primary_namenode_return_val_namenode_not_found(self, mock_batch):
         namenodes = ["nn1", "nn2"]
         webhdfs_path = "/foo/bar"
         hdfs_user = "userfoo"
-        mock_safe_execute.return_value = tse.ShellResult(0, "", "")
+        mock_batch.return_value = [tse.ShellResult(0, "", "")] * 2
         self.assertIsNone(self.hm.get_primary_namenode(namenodes, webhdfs_path,
                                                        hdfs_user))
 
-    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
-    def test_get_primary_namenode_exception(self, mock_safe_execute):
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute_batch")
+    def test_get_primary_namenode_exception(self, mock_batch):
         namenodes = ["nn1", "nn2"]
         webhdfs_path = "/foo/bar"
         hdfs_user = "userfoo"
-        mock_safe_execute.side_effect = tse.ShellException()
+        mock_batch.side_effect = tse.ShellException()
         with self.assertRaises(thex.HdfsManagerException):
             _ = self.hm.get_primary_namenode(namenodes, webhdfs_path, hdfs_user)
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute_batch")
+    def test_get_primary_namenode_cached(self, mock_batch):
+        cache = mock.MagicMock()
+        cache.get.return_value = "nn2"
+        nn = self.hm.get_primary_namenode(["nn1", "nn2"], "/foo/bar", "userfoo",
+                                          cache=cache)
+        self.assertEqual(nn, "nn2")
+        self.assertFalse(mock_batch.called)
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.execute_batch")
+    def test_get_primary_namenode_caches_result(self, mock_batch):
+        cache = mock.MagicMock()
+        cache.get.return_value = None
+        mock_batch.return_value = [tse.ShellResult(0, "FileStatus", "")] * 2
+        self.hm.get_primary_namenode(["nn1", "nn2"], "/foo/bar", "userfoo", cache=cache)
+        cache.put.assert_called_with("nn1")
+
+
+class TestNamenodeCache(unittest.TestCase):
+    def setUp(self):
+        self.cachefile = "__test__namenode.cache"
+
+    def tearDown(self):
+        if os.path.exists(self.cachefile):
+            os.remove(self.cachefile)
+
+    def test_put_get(self):
+        cache = thm.NamenodeCache(self.cachefile)
+        self.assertIsNone(cache.get(["nn1", "nn2"]))
+        cache.put("nn2")
+        self.assertEqual(thm.NamenodeCache(self.cachefile).get(["nn1", "nn2"]), "nn2")
+
+    def test_get_unconfigured_namenode(self):
+        cache = thm.NamenodeCache(self.cachefile)
+        cache.put("nn3")
+        self.assertIsNone(cache.get(["nn1", "nn2"]))
+
+    @mock.patch("thrive.hdfs_manager.time")
+    def test_get_expired(self, mock_time):
+        cache = thm.NamenodeCache(self.cachefile, ttl=60)
+        mock_time.time.return_value = 1000.0
+        cache.put("nn1")
+        mock_time.time.return_value = 1059.0
+        self.assertEqual(cache.get(["nn1"]), "nn1")
+        mock_time.time.return_value = 1060.0
+        self.assertIsNone(cache.get(["nn1"]))
+
+    def test_invalidate(self):
+        cache = thm.NamenodeCache(self.cachefile)
+        cache.put("nn1")
+        cache.invalidate()
+        self.assertIsNone(cache.get(["nn1"]))
+        self.assertFalse(os.path.exists(self.cachefile))
+        cache.invalidate()
@@ -86,6 +86,47 @@ class TestHiveManager(unittest.TestCase):
         with self.assertRaises(HiveManagerException):
             self.hm.create_partition("/foo/2016/08/12/14/0")
 
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    @mock.patch("thrive.hive_manager.HdfsManager.paths_exist")
+    def test_create_partitions(self, mock_pths_exist, mock_safe_exec):
+        ptn_paths = ["/foo/2016/08/12/14/0", "/foo/2016/08/12/15/0"]
+        mock_pths_exist.return_value = dict((p, True) for p in ptn_paths)
+        self.assertListEqual(self.hm.create_partitions(ptn_paths), ptn_paths)
+        self.assertEqual(mock_safe_exec.call_count, 1)
+        cmd = mock_safe_exec.call_args[0][0]
+        self.assertIn("alter table %s add partition (year = '2016', month = '08', "
+                      "day = '12', hour = '14', part = '0') location '%s' partition "
+                      "(year = '2016', month = '08', day = '12', hour = '15', "
+                      "part = '0') location '%s';" % ((self.table,) + tuple(ptn_paths)),
+                      cmd)
+
+    def test_create_partitions_empty(self):
+        self.assertListEqual(self.hm.create_partitions([]), [])
+
+    @mock.patch("thrive.hive_manager.HiveManager.create_partition")
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    @mock.patch("thrive.hive_manager.HdfsManager.paths_exist")
+    def test_create_partitions_fallback(self, mock_pths_exist, mock_safe_exec,
+                                        mock_create_ptn):
+        ptn_paths = ["/foo/2016/08/12/14/0", "/foo/2016/08/12/15/0",
+                     "/foo/2016/08/12/16/0"]
+        mock_pths_exist.return_value = dict((p, True) for p in ptn_paths)
+        mock_safe_exec.side_effect = tse.ShellException()
+        mock_create_ptn.side_effect = [None, HiveManagerException(), None]
+        self.assertListEqual(self.hm.create_partitions(ptn_paths), ptn_paths[:1])
+        self.assertEqual(mock_create_ptn.call_count, 2)
+
+    @mock.patch("thrive.hive_manager.HiveManager.create_partition")
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    @mock.patch("thrive.hive_manager.HdfsManager.paths_exist")
+    def test_create_partitions_missing_path(self, mock_pths_exist, mock_safe_exec,
+                                            mock_create_ptn):
+        ptn_paths = ["/foo/2016/08/12/14/0", "/foo/2016/08/12/15/0"]
+        mock_pths_exist.return_value = {ptn_paths[0]: True, ptn_paths[1]: False}
+        mock_create_ptn.side_effect = [None, HiveManagerException()]
+        self.assertListEqual(self.hm.create_partitions(ptn_paths), ptn_paths[:1])
+        self.assertFalse(mock_safe_exec.called)
+
     def test_create_table(self):
         pass
 
@@ -116,20 +157,51 @@ class TestHiveManager(unittest.TestCase):
         with self.assertRaises(HiveManagerException):
             self.hm.drop_table()
 
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_check_partition_shell(self, mock_safe_exec):
+        mock_safe_exec.return_value = tse.ShellResult(0, "", "")
+        self.hm.check_partition("year=2016/month=08/day=12/hour=14/part=0")
+        cmd = ''' hive -e "use %s; show partitions %s partition(%s)" ''' \
+              % (self.db, self.table,
+                 "year='2016', month='08', day='12', hour='14', part='0'")
+        mock_safe_exec.assert_called_with(cmd, splitcmd=False, as_shell=True)
+
     @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
     def test_check_partition_ptn_exists(self, mock_safe_exec):
-        ptn_str = "/foo/2016/08/12/14/0"
-        mock_safe_exec.return_value = tse.ShellResult(0, ptn_str, "")
+        ptn_str = "year=2016/month=08/day=12/hour=14/part=0"
+        mock_safe_exec.return_value = tse.ShellResult(0, "%s\n" % ptn_str, "")
         self.assertTrue(self.hm.check_partition(ptn_str))
 
     @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
     def test_check_partition_ptn_doesnt_exist(self, mock_safe_exec):
-        ptn_str = "/foo/2016/08/12/14/0"
-        mock_safe_exec.return_value = tse.ShellResult(0, "/bar/2016/08/12/14/0", "")
+        ptn_str = "year=2016/month=08/day=12/hour=14/part=1"
+        mock_safe_exec.return_value = \
+            tse.ShellResult(0, "year=2016/month=08/day=12/hour=14/part=10\n", "")
         self.assertFalse(self.hm.check_partition(ptn_str))
 
     @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
     def test_check_partition_exception(self, mock_safe_exec):
         mock_safe_exec.side_effect = tse.ShellException()
+        with self.assertRaises(HiveManagerException):
+            self.hm.check_partition("year=2016/month=08/day=12/hour=14/part=0")
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_check_partition_malformed(self, mock_safe_exec):
         with self.assertRaises(HiveManagerException):
             self.hm.check_partition("/bar/2016/08/12/14/0")
+        self.assertFalse(mock_safe_exec.called)
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_check_partition_cached(self, mock_safe_exec):
+        ptn_str = "year=2016/month=08/day=12/hour=14/part=0"
+        mock_safe_exec.return_value = tse.ShellResult(0, ptn_str, "")
+        tse.command_cache.enable()
+        try:
+            self.assertTrue(self.hm.check_partition(ptn_str))
+            self.assertTrue(self.hm.check_partition(ptn_str))
+            self.assertEqual(mock_safe_exec.call_count, 1)
+            self.hm.drop_partition(ptn_str)
+            self.assertTrue(self.hm.check_partition(ptn_str))
+            self.assertEqual(mock_safe_exec.call_count, 3)
+        finally:
+            tse.command_cache.disable()
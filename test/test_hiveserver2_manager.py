@@ -0,0 +1,121 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import mock
+import thrive.hiveserver2_manager as ths2
+from thrive.odbc_pool import odbc_pool
+import thrive.exceptions as thex
+from test.utils.fake_hiveserver2 import FakeHiveServer2
+
+
+class TestHiveServer2Manager(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeHiveServer2()
+        self.connect_patcher = mock.patch("thrive.odbc_pool.pyodbc.connect",
+                                          side_effect=self.server.connect)
+        self.connect_patcher.start()
+
+        self.pe_patcher = mock.patch("thrive.hiveserver2_manager.HdfsManager.path_exists",
+                                     return_value=True)
+        self.pe_patcher.start()
+
+        self.pse_patcher = mock.patch("thrive.hiveserver2_manager.HdfsManager.paths_exist",
+                                      side_effect=lambda paths: dict((p, True) for p in paths))
+        self.mock_paths_exist = self.pse_patcher.start()
+
+        self.hm = ths2.HiveServer2Manager("dbfoo", "tablefoo", "DSN=hive")
+        self.ptn_paths = ["/foo/2016/08/12/14/0", "/foo/2016/08/12/15/0"]
+
+    def tearDown(self):
+        odbc_pool.close()
+        self.connect_patcher.stop()
+        self.pe_patcher.stop()
+        self.pse_patcher.stop()
+
+    def test_create_partition(self):
+        self.hm.create_partition(self.ptn_paths[0])
+        ptns = self.server.tables["dbfoo.tablefoo"]
+        self.assertEqual(ptns["year=2016/month=08/day=12/hour=14/part=0"], self.ptn_paths[0])
+
+    @mock.patch("thrive.hiveserver2_manager.command_stats")
+    def test_command_stats(self, mock_stats):
+        self.hm.create_partition(self.ptn_paths[0])
+        mock_stats.timed.assert_called_with("hive.add_partition")
+
+    def test_create_partition_exists(self):
+        self.hm.create_partition(self.ptn_paths[0])
+        with self.assertRaises(thex.HiveManagerException):
+            self.hm.create_partition(self.ptn_paths[0])
+
+    def test_create_partitions(self):
+        created = self.hm.create_partitions(self.ptn_paths)
+        self.assertListEqual(created, self.ptn_paths)
+        self.assertEqual(len(self.server.tables["dbfoo.tablefoo"]), 2)
+        adds = [st for st in self.server.statements if " add " in st]
+        self.assertEqual(len(adds), 1)
+
+    def test_create_partitions_fallback_to_single(self):
+        self.hm.create_partition(self.ptn_paths[1])
+        created = self.hm.create_partitions(self.ptn_paths)
+        self.assertListEqual(created, self.ptn_paths[:1])
+
+    def test_check_partition(self):
+        ptn_str = "year=2016/month=08/day=12/hour=14/part=0"
+        self.assertFalse(self.hm.check_partition(ptn_str))
+        self.hm.create_partition(self.ptn_paths[0])
+        self.assertTrue(self.hm.check_partition(ptn_str))
+        self.assertIn("show partitions dbfoo.tablefoo partition(year='2016', month='08', "
+                      "day='12', hour='14', part='0')", self.server.statements)
+
+    def test_drop_partition(self):
+        self.hm.create_partition(self.ptn_paths[0])
+        self.hm.drop_partition("year=2016, month=08, day=12, hour=14, part=0")
+        self.assertDictEqual(self.server.tables["dbfoo.tablefoo"], dict())
+
+    def test_drop_table(self):
+        self.hm.create_partition(self.ptn_paths[0])
+        self.hm.drop_table()
+        self.assertNotIn("dbfoo.tablefoo", self.server.tables)
+
+    def test_drop_db(self):
+        self.hm.create_partition(self.ptn_paths[0])
+        self.hm.drop_db()
+        self.assertDictEqual(self.server.tables, dict())
+
+    def test_session_reuse(self):
+        other = ths2.HiveServer2Manager("dbbar", "tablebar", "DSN=hive")
+        self.hm.create_partition(self.ptn_paths[0])
+        other.create_partition(self.ptn_paths[1])
+        self.hm.drop_table()
+        self.assertEqual(self.server.connections, 1)
+
+    def test_session_reconnect(self):
+        self.hm.drop_table()
+        self.server.drop_connections()
+        self.hm.drop_table()
+        self.assertEqual(self.server.connections, 2)
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_fallback_to_cli(self, mock_safe_execute):
+        self.server.down = True
+        self.hm.drop_table()
+        mock_safe_execute.assert_called_with(''' hive -e "use dbfoo; drop table tablefoo" ''',
+                                             splitcmd=False, as_shell=True)
+
+    def test_no_fallback(self):
+        self.server.down = True
+        hm = ths2.HiveServer2Manager("dbfoo", "tablefoo", "DSN=hive", fallback=False)
+        with self.assertRaises(thex.HiveManagerException):
+            hm.drop_table()
@@ -0,0 +1,81 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import mock
+import thrive.lease_heartbeat as tlhb
+import thrive.exceptions as thex
+
+
+class TestLeaseHeartbeat(unittest.TestCase):
+    def setUp(self):
+        self.md_patcher = mock.patch("thrive.lease_heartbeat.MetadataManager")
+        self.mock_mm = self.md_patcher.start()
+
+        self.hb = tlhb.LeaseHeartbeat({"dbtype": "MySQL"}, "foo", "host:1:12345", 900)
+
+        # Renew immediately instead of waiting for a third of the lease
+        self.hb._stopped.wait = mock.MagicMock()
+
+    def tearDown(self):
+        self.md_patcher.stop()
+
+    def test_lost(self):
+        mm = self.mock_mm.return_value
+        mm.renew_lock.side_effect = [True, True, False]
+        self.hb.start()
+        self.hb._thread.join()
+        self.assertTrue(self.hb.lost)
+        self.assertEqual(mm.renew_lock.call_count, 3)
+        mm.renew_lock.assert_called_with("foo", "host:1:12345", 900)
+        self.mock_mm.assert_called_once_with({"dbtype": "MySQL"})
+        mm.close.assert_called_with()
+
+    def test_renew_exception_retried(self):
+        mm = self.mock_mm.return_value
+        mm.renew_lock.side_effect = [thex.MetadataManagerException(), False]
+        self.hb.start()
+        self.hb._thread.join()
+        self.assertEqual(mm.renew_lock.call_count, 2)
+        self.assertTrue(self.hb.lost)
+
+    @mock.patch("thrive.lease_heartbeat.time")
+    def test_lost_expired(self, mock_time):
+        mm = self.mock_mm.return_value
+        mm.renew_lock.side_effect = [True] + [thex.MetadataManagerException()] * 3
+        mock_time.time.side_effect = [0, 300, 600, 1200, 1201]
+        self.hb.start()
+        self.hb._thread.join()
+        self.assertTrue(self.hb.lost)
+        self.assertEqual(mm.renew_lock.call_count, 4)
+
+    def test_stop(self):
+        mm = self.mock_mm.return_value
+        mm.renew_lock.return_value = True
+        self.hb.start()
+        self.hb.stop()
+        self.assertFalse(self.hb.lost)
+        self.assertFalse(self.hb._thread.is_alive())
+
+    def test_metadata_backend(self):
+        mdmgr_class = mock.MagicMock()
+        mdmgr_class.return_value.renew_lock.return_value = False
+        hb = tlhb.LeaseHeartbeat({"dbtype": "sqlite"}, "foo", "host:1:12345", 900,
+                                 mdmgr_class=mdmgr_class)
+        hb._stopped.wait = mock.MagicMock()
+        hb.start()
+        hb._thread.join()
+        mdmgr_class.assert_called_once_with({"dbtype": "sqlite"})
+        self.assertFalse(self.mock_mm.called)
+
@@ -0,0 +1,105 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import mock
+from datetime import timedelta
+import thrive.load_daemon as tld
+import thrive.exceptions as thex
+
+
+class TestLoadDaemon(unittest.TestCase):
+    def setUp(self):
+        self.lh_patcher = mock.patch("thrive.load_daemon.LoadHandler")
+        self.mock_lh = self.lh_patcher.start()
+
+        self.time_patcher = mock.patch("thrive.load_daemon.time")
+        self.mock_time = self.time_patcher.start()
+
+        self.logging_patcher = mock.patch("thrive.load_daemon.init_logging")
+        self.mock_logging = self.logging_patcher.start()
+
+        self.ds = ("data.cfg", "env.cfg")
+        self.daemon = tld.LoadDaemon([self.ds],
+                                     min_interval=timedelta(0, 60),
+                                     max_interval=timedelta(0, 600))
+
+    def tearDown(self):
+        self.lh_patcher.stop()
+        self.time_patcher.stop()
+        self.logging_patcher.stop()
+
+    def test_get_handler_reused(self):
+        h1 = self.daemon.get_handler(self.ds)
+        h2 = self.daemon.get_handler(self.ds)
+        self.assertIs(h1, h2)
+        self.mock_lh.assert_called_once_with(datacfg_file="data.cfg", envcfg_file="env.cfg")
+        h2.reset.assert_called_once_with()
+
+    def test_poll_loaded(self):
+        self.mock_lh.return_value.execute.return_value = True
+        self.assertTrue(self.daemon.poll(self.ds))
+        self.mock_lh.return_value.execute.assert_called_with()
+        self.assertEqual(self.daemon.intervals[self.ds], timedelta(0, 600))
+
+    def test_poll_logging(self):
+        ds2 = ("data2.cfg", "env.cfg")
+        self.daemon.poll(self.ds)
+        self.daemon.poll(ds2)
+        self.mock_logging.assert_has_calls([mock.call("data.cfg"),
+                                            mock.call("data2.cfg")])
+
+    def test_poll_nothing_to_load(self):
+        self.mock_lh.return_value.execute.return_value = False
+        intervals = []
+        for _ in range(5):
+            self.assertFalse(self.daemon.poll(self.ds))
+            intervals.append(self.daemon.intervals[self.ds].seconds)
+        self.assertListEqual(intervals, [300, 150, 75, 60, 60])
+
+    def test_poll_exception(self):
+        handler = self.mock_lh.return_value
+        handler.execute.side_effect = thex.LoadHandlerException()
+        self.daemon.intervals[self.ds] = timedelta(0, 60)
+        self.assertFalse(self.daemon.poll(self.ds))
+        handler.close.assert_called_with()
+        self.assertNotIn(self.ds, self.daemon.handlers)
+        self.assertEqual(self.daemon.intervals[self.ds], timedelta(0, 600))
+
+    def test_poll_unexpected_exception(self):
+        ds2 = ("data2.cfg", "env.cfg")
+        daemon = tld.LoadDaemon([self.ds, ds2],
+                                min_interval=timedelta(0, 60),
+                                max_interval=timedelta(0, 600))
+        handler = self.mock_lh.return_value
+        handler.execute.side_effect = [KeyError("foo"), False]
+        daemon.intervals[self.ds] = timedelta(0, 60)
+        self.assertFalse(daemon.poll(self.ds))
+        handler.close.assert_called_with()
+        self.assertNotIn(self.ds, daemon.handlers)
+        self.assertEqual(daemon.intervals[self.ds], timedelta(0, 600))
+        daemon.poll(ds2)
+        self.assertIn(ds2, daemon.handlers)
+
+    def test_run_cycles(self):
+        self.mock_lh.return_value.execute.return_value = False
+        self.daemon.run(cycles=2)
+        self.assertEqual(self.mock_lh.return_value.execute.call_count, 1)
+        self.assertEqual(self.mock_time.sleep.call_count, 1)
+
+    def test_stop(self):
+        self.mock_lh.return_value.execute.side_effect = self.daemon.stop
+        self.daemon.run()
+        self.assertFalse(self.daemon.running)
+        self.assertFalse(self.mock_time.sleep.called)
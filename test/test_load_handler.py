@@ -14,14 +14,22 @@
 # limitations under the License.
 
 import os
+import json
 import unittest
 import mock
+import __builtin__
+from itertools import imap
 import thrive.load_handler as tlh
+from thrive.hdfs_manager import HdfsManager
+from thrive.vertica_manager import VerticaManager
+from thrive.vertica_odbc_manager import VerticaOdbcManager
 from datetime import datetime
 from test.utils.utils import squeeze
 from thrive.utils import CAMUS_FOLDER_FREQ
 import thrive.exceptions as thex
 
+builtin_int = __builtin__.int
+
 class TestLoadHandler(unittest.TestCase):
     def setUp(self):
         self.config_loader_patcher = mock.patch("thrive.thrive_handler.ConfigLoader")
@@ -29,12 +37,15 @@ class TestLoadHandler(unittest.TestCase):
 
         self.md_patcher = mock.patch("thrive.thrive_handler.MetadataManager")
         self.mock_mm = self.md_patcher.start()
+        self.mock_mm.return_value.get_next_part.return_value = None
 
         self.hdfs_patcher = mock.patch("thrive.thrive_handler.HdfsManager")
         self.mock_hdfs = self.hdfs_patcher.start()
 
         self.hive_patcher = mock.patch("thrive.thrive_handler.HiveManager")
         self.mock_hive = self.hive_patcher.start()
+        self.mock_hive.return_value.create_partitions.side_effect = \
+            lambda ptn_paths, hdfs_mgr=None: list(ptn_paths)
 
         self.vertica_patcher = mock.patch("thrive.thrive_handler.VerticaManager")
         self.mock_vtica = self.vertica_patcher.start()
@@ -51,6 +62,20 @@ class TestLoadHandler(unittest.TestCase):
         self.newrelic_patcher = mock.patch("thrive.load_handler.NewRelicManager")
         self.mock_newrelic = self.newrelic_patcher.start()
 
+        # Run the Vertica load stage in order on the calling thread
+        self.pool_patcher = mock.patch("thrive.load_handler.ThreadPool")
+        self.mock_pool = self.pool_patcher.start()
+        self.mock_pool.return_value.imap.side_effect = imap
+
+        self.journal_patcher = mock.patch("thrive.load_handler.MetadataJournal")
+        self.mock_journal = self.journal_patcher.start()
+        self.mock_journal.return_value.unprocessed_partitions.return_value = []
+        self.mock_journal.return_value.pending.return_value = False
+
+        self.heartbeat_patcher = mock.patch("thrive.load_handler.LeaseHeartbeat")
+        self.mock_heartbeat = self.heartbeat_patcher.start()
+        self.mock_heartbeat.return_value.lost = False
+
         self.uuid_patcher = mock.patch("thrive.thrive_handler.uuid")
         self.mock_uuid = self.uuid_patcher.start()
         self.mock_uuid.uuid1.return_value = "12345"
@@ -76,6 +101,9 @@ class TestLoadHandler(unittest.TestCase):
         self.th_get_config_patcher.stop()
         self.oozie_patcher.stop()
         self.newrelic_patcher.stop()
+        self.pool_patcher.stop()
+        self.journal_patcher.stop()
+        self.heartbeat_patcher.stop()
         self.int_patcher.stop()
         self.float_patcher.stop()
 
@@ -84,7 +112,7 @@ class TestLoadHandler(unittest.TestCase):
         _ = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                             resources_file="baz.zip")
         hdfs_mgr = self.mock_hdfs.return_value
-        hdfs_mgr.get_primary_namenode.assert_called_with([cv], cv, cv)
+        hdfs_mgr.get_primary_namenode.assert_called_with([cv], cv, cv, cache=mock.ANY)
 
         self.mock_oozie.assert_called_with()
         #self.mock_newrelic.assert_called_with(cv, cv, cv)
@@ -102,6 +130,42 @@ class TestLoadHandler(unittest.TestCase):
             _ = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                                 resources_file="baz.zip")
 
+    @mock.patch("thrive.load_handler.uuid")
+    @mock.patch("thrive.load_handler.command_stats")
+    def test_reset(self, mock_stats, mock_uuid):
+        mock_uuid.uuid1.return_value = "67890"
+        hdfs_mgr = self.mock_hdfs.return_value
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        lh.newdirs = ["d_20160812-1410"]
+        lh.locked = True
+        lh.granted_paths.add("foo")
+        lh.reset()
+        self.assertEqual(lh.load_id, "67890")
+        self.assertIsNone(lh.newdirs)
+        self.assertFalse(lh.locked)
+        self.assertSetEqual(lh.granted_paths, set())
+        mock_stats.reset.assert_called_with()
+        self.assertEqual(hdfs_mgr.get_primary_namenode.call_count, 2)
+
+    def test_close(self):
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        lh.hdfs_mgr = mock.Mock(spec=tlh.WebHdfsManager)
+        lh.vertica_mgr = mock.Mock(spec=VerticaOdbcManager)
+        self.mock_mm.return_value.close.side_effect = Exception()
+        lh.close()
+        lh.hdfs_mgr.close.assert_called_with()
+        lh.vertica_mgr.close.assert_called_with()
+
+    def test_close_vsql(self):
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        lh.hdfs_mgr = mock.Mock(spec=HdfsManager)
+        lh.vertica_mgr = mock.Mock(spec=VerticaManager)
+        lh.close()
+        self.mock_mm.return_value.close.assert_called_with()
+
     # def test_init_newrelic_manager_exception(self):
     #     self.mock_newrelic.side_effect = Exception()
     #     with self.assertRaises(thex.LoadHandlerException):
@@ -128,7 +192,22 @@ class TestLoadHandler(unittest.TestCase):
                              resources_file="baz.zip")
         _ = lh.get_newdirs()
         hdfs_mgr = self.mock_hdfs.return_value
-        hdfs_mgr.get_newdirs.assert_called_with(cv, lastdir, mdt, 4.0)
+        hdfs_mgr.get_newdirs.assert_called_with(cv, lastdir, mdt, 4.0, index=mock.ANY)
+        index = hdfs_mgr.get_newdirs.call_args[1]["index"]
+        self.assertEqual(index.indexfile, cv)
+
+    @mock.patch("thrive.load_handler.SourceDirIndex")
+    def test_get_newdirs_index_kept(self, mock_index):
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        _ = lh.get_newdirs()
+        _ = lh.get_newdirs()
+        self.assertEqual(mock_index.call_count, 1)
+        hdfs_mgr = self.mock_hdfs.return_value
+        self.assertIs(hdfs_mgr.get_newdirs.call_args[1]["index"], mock_index.return_value)
+        with mock.patch("thrive.load_handler.uuid"):
+            lh.reset()
+        self.assertEqual(mock_index.call_count, 2)
 
     def test_get_newdirs_val(self):
         hdfs_mgr = self.mock_hdfs.return_value
@@ -247,6 +326,18 @@ class TestLoadHandler(unittest.TestCase):
         numrows = lh.vload_copy(hiveptn_, mode="direct")
         self.assertEqual(numrows, 100)
 
+    @mock.patch("thrive.load_handler.NamenodeCache")
+    def test_vload_copy_exception_invalidates_namenode(self, mock_nn_cache):
+        hm = self.mock_hdfs.return_value
+        hm.get_primary_namenode.return_value = self.config_value
+        vm = self.mock_vtica.return_value
+        vm.load.side_effect = thex.VerticaManagerException()
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        with self.assertRaises(thex.VerticaManagerException):
+            lh.vload_copy("2016/08/16/14/0", mode="direct")
+        mock_nn_cache.return_value.invalidate.assert_called_with()
+
     @mock.patch("thrive.load_handler.os.path.join")
     def test_vload_copy_decompress_call(self, mock_join):
         mock_pth = "a/b/c"
@@ -260,62 +351,390 @@ class TestLoadHandler(unittest.TestCase):
         _ = lh.vload_copy(hiveptn_, mode="decompress")
         vm = self.mock_vtica.return_value
         hm.makedir.assert_called_with(mock_pth)
-        hm.decompress.assert_called_with(mock_pth, mock_pth)
+        hm.decompress_parts.assert_called_with(mock_pth, mock_pth)
         vm.load.assert_called_with(cv, mock_pth, cv, cv, cv, mode="decompress")
 
+    @mock.patch("thrive.load_handler.LoadHandler.copy_mode", return_value="direct")
+    @mock.patch("thrive.load_handler.iso_format")
+    @mock.patch("thrive.load_handler.LoadHandler.vload_copy")
+    def test_vload_partitions_order(self, mock_vload_copy, mock_iso_fmt, mock_mode):
+        self.mock_int.side_effect = builtin_int
+        self.mock_get_config.side_effect = \
+            lambda key, *args, **kwargs: "1" if key == "vertica_copy_batch_size" else "4"
+        mock_iso_fmt.return_value = "2016-08-19 14:10:00"
+        mock_vload_copy.return_value = 100
+        pending = [("12345", "2016/08/19/15/0", "100", "50"),
+                   ("12345", "2016/08/19/14/10", "100", "50"),
+                   ("12345", "2016/08/19/14/9", "100", "50")]
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        lh.vload_partitions(pending, 50)
+        self.mock_pool.assert_called_with(3)
+        mj = self.mock_journal.return_value
+        self.assertEqual(mj.update_loads.call_count, 3)
+        self.assertListEqual([c[0][0][0][0][1] for c in mj.update_loads.call_args_list],
+                             ["2016/08/19/14/9", "2016/08/19/14/10", "2016/08/19/15/0"])
+
+    @mock.patch("thrive.load_handler.LoadHandler.copy_mode", return_value="direct")
+    @mock.patch("thrive.load_handler.iso_format")
+    @mock.patch("thrive.load_handler.LoadHandler.vload_copy")
+    def test_vload_partitions_failed_partition(self, mock_vload_copy, mock_iso_fmt,
+                                               mock_mode):
+        self.mock_int.side_effect = builtin_int
+        self.mock_get_config.return_value = "1"
+        mock_vload_copy.side_effect = [thex.VerticaManagerException(), 100]
+        pending = [("12345", "2016/08/19/14/0", "100", "50"),
+                   ("12345", "2016/08/19/15/0", "100", "50")]
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        with self.assertRaises(thex.LoadHandlerException):
+            lh.vload_partitions(pending, 50)
+        mj = self.mock_journal.return_value
+        self.assertEqual(mj.update_loads.call_count, 1)
+        self.assertListEqual([pk for pk, _ in mj.update_loads.call_args[0][0]],
+                             [("12345", "2016/08/19/15/0")])
+
+    @mock.patch("thrive.load_handler.LoadHandler.copy_mode", return_value="direct")
+    @mock.patch("thrive.load_handler.iso_format")
+    @mock.patch("thrive.load_handler.LoadHandler.vload_copy_many")
+    @mock.patch("thrive.load_handler.LoadHandler.vload_copy")
+    def test_vload_partitions_copy_batches(self, mock_vload_copy, mock_vload_copy_many,
+                                           mock_iso_fmt, mock_mode):
+        self.mock_int.side_effect = builtin_int
+        self.mock_get_config.return_value = "2"
+        mock_vload_copy.return_value = 30
+        mock_vload_copy_many.return_value = [10, 20]
+        hiveptns = ["2016/08/19/14/0", "2016/08/19/15/0", "2016/08/19/16/0"]
+        pending = [("12345", hiveptn, "100", "50") for hiveptn in hiveptns]
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        lh.vload_partitions(pending, 50)
+        mock_vload_copy_many.assert_called_with(hiveptns[:2], dtable=None, mode="direct")
+        mock_vload_copy.assert_called_with(hiveptns[2], dtable=None, mode="direct")
+        mj = self.mock_journal.return_value
+        self.assertListEqual([(c[0][0][0][0][1], c[0][0][0][1]["vertica_rows_loaded"])
+                              for c in mj.update_loads.call_args_list],
+                             zip(hiveptns, [10, 20, 30]))
+
+    @mock.patch("thrive.load_handler.LoadHandler.copy_mode", return_value="direct")
+    @mock.patch("thrive.load_handler.iso_format")
+    @mock.patch("thrive.load_handler.LoadHandler.vload_copy_many")
+    def test_vload_partitions_copy_batch_failed(self, mock_vload_copy_many,
+                                                mock_iso_fmt, mock_mode):
+        mock_vload_copy_many.side_effect = thex.VerticaManagerException()
+        pending = [("12345", "2016/08/19/14/0", "100", "50"),
+                   ("12345", "2016/08/19/15/0", "100", "50")]
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        with self.assertRaises(thex.LoadHandlerException):
+            lh.vload_partitions(pending, 50)
+        mj = self.mock_journal.return_value
+        self.assertFalse(mj.update_loads.called)
+
+    @mock.patch("thrive.load_handler.LoadHandler.copy_mode", return_value="direct")
+    @mock.patch("thrive.load_handler.iso_format")
+    @mock.patch("thrive.load_handler.LoadHandler.vload_copy")
+    def test_vload_partitions_recorded_before_interrupt(self, mock_vload_copy,
+                                                        mock_iso_fmt, mock_mode):
+        self.mock_int.side_effect = builtin_int
+        self.mock_get_config.return_value = "1"
+        mock_vload_copy.side_effect = [100, KeyboardInterrupt()]
+        pending = [("12345", "2016/08/19/14/0", "100", "50"),
+                   ("12345", "2016/08/19/15/0", "100", "50")]
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        with self.assertRaises(KeyboardInterrupt):
+            lh.vload_partitions(pending, 50)
+        mj = self.mock_journal.return_value
+        self.assertEqual(mj.update_loads.call_count, 1)
+        self.assertEqual(mj.update_loads.call_args[0][0][0][0],
+                         ("12345", "2016/08/19/14/0"))
+
+    def test_vload_copy_many(self):
+        cv = self.config_value
+        hm = self.mock_hdfs.return_value
+        hm.get_primary_namenode.return_value = cv
+        vm = self.mock_vtica.return_value
+        vm.load_many.return_value = [10, 20]
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        rows = lh.vload_copy_many(["2016/08/19/14/0", "2016/08/19/15/0"])
+        self.assertListEqual(rows, [10, 20])
+        vm.load_many.assert_called_with(cv, ["foo/2016/08/19/14/0", "foo/2016/08/19/15/0"],
+                                        cv, cv, cv, mode="direct")
+
+    @mock.patch("thrive.load_handler.LoadHandler.vload_copy_many")
+    def test_vload_staged(self, mock_vload_copy_many):
+        cv = self.config_value
+        hiveptns = ["2016/08/19/14/0", "2016/08/19/15/0"]
+        mock_vload_copy_many.return_value = [10, 20]
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        self.assertListEqual(lh.vload_staged(hiveptns), [10, 20])
+        stagingtable = "foo__staging__2016_08_19_14_0"
+        vm = self.mock_vtica.return_value
+        vm.create_staging_table.assert_called_with(cv, cv, stagingtable)
+        mock_vload_copy_many.assert_called_with(hiveptns, dtable=stagingtable,
+                                                mode="direct")
+        vm.publish.assert_called_with(cv, stagingtable, cv, partition_expr=cv)
+        vm.drop_table.assert_called_with(cv, stagingtable)
+
+    @mock.patch("thrive.load_handler.LoadHandler.vload_copy")
+    def test_vload_staged_exception(self, mock_vload_copy):
+        mock_vload_copy.side_effect = thex.VerticaManagerException()
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        with self.assertRaises(thex.VerticaManagerException):
+            lh.vload_staged(["2016/08/19/14/0"])
+        vm = self.mock_vtica.return_value
+        self.assertFalse(vm.publish.called)
+        vm.drop_table.assert_called_with("foo", "foo__staging__2016_08_19_14_0")
+
+    @mock.patch("thrive.load_handler.LoadHandler.vload_copy_many")
+    def test_vload_staged_publish_exception(self, mock_vload_copy_many):
+        mock_vload_copy_many.return_value = [10]
+        vm = self.mock_vtica.return_value
+        vm.publish.side_effect = thex.VerticaManagerException()
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        with self.assertRaises(thex.VerticaManagerException):
+            lh.vload_staged(["2016/08/19/14/0"])
+        self.assertFalse(vm.drop_table.called)
+
+    @mock.patch("thrive.load_handler.LoadHandler.copy_mode", return_value="decompress")
+    @mock.patch("thrive.load_handler.iso_format")
+    @mock.patch("thrive.load_handler.LoadHandler.vload_copy")
+    def test_vload_partitions_decompress(self, mock_vload_copy, mock_iso_fmt, mock_mode):
+        self.mock_int.side_effect = builtin_int
+        self.mock_get_config.return_value = "4"
+        hiveptns = ["2016/08/19/14/0", "2016/08/19/15/0"]
+        pending = [("12345", hiveptn, "100", "50") for hiveptn in hiveptns]
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        lh.vload_partitions(pending, 50)
+        self.mock_pool.assert_called_with(1)
+        mock_vload_copy.assert_has_calls([mock.call(hiveptn, dtable=None, mode="decompress")
+                                          for hiveptn in hiveptns])
+
+    def test_copy_mode_partfiles(self):
+        hm = self.mock_hdfs.return_value
+        hm.partfiles.return_value = ["foo/2016/08/19/14/0/part-00000.bz2"]
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        self.assertEqual(lh.copy_mode("2016/08/19/14/0"), "bzip")
+        hm.partfiles.assert_called_with("foo/2016/08/19/14/0")
+
+    def test_copy_mode_partfiles_exception(self):
+        self.mock_get_config.return_value = "org.apache.hadoop.io.compress.GzipCodec"
+        hm = self.mock_hdfs.return_value
+        for ex in [tlh.ShellException(), thex.HdfsManagerException()]:
+            hm.partfiles.side_effect = ex
+            lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                                 resources_file="baz.zip")
+            self.assertEqual(lh.copy_mode("2016/08/19/14/0"), "direct")
+
+    def test_copy_mode_codec(self):
+        self.mock_get_config.return_value = "org.apache.hadoop.io.compress.GzipCodec"
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        self.assertEqual(lh.copy_mode(), "direct")
+        self.assertFalse(self.mock_hdfs.return_value.partfiles.called)
+
+    def test_vload_partitions_empty(self):
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        lh.vload_partitions([], 50)
+        self.assertFalse(self.mock_pool.called)
+
+    def test_next_partition_path_from_state(self):
+        cv = self.config_value
+        mm = self.mock_mm.return_value
+        mm.get_next_part.return_value = 2
+        hm = self.mock_hdfs.return_value
+        hm.path_exists.return_value = False
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        self.assertEqual(lh.next_partition_path("2016/08/19/14"),
+                         "%s/2016/08/19/14/2" % cv)
+        mm.get_next_part.assert_called_with(cv, cv, "2016/08/19/14")
+        self.assertFalse(hm.get_subdirs.called)
+
+    def test_next_partition_path_state_stale(self):
+        self.mock_int.side_effect = builtin_int
+        cv = self.config_value
+        self.mock_mm.return_value.get_next_part.return_value = 2
+        hm = self.mock_hdfs.return_value
+        hm.path_exists.return_value = True
+        hm.get_subdirs.return_value = ["0", "1", "2"]
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        self.assertEqual(lh.next_partition_path("2016/08/19/14"),
+                         "%s/2016/08/19/14/3" % cv)
+
+    def test_next_partition_path_no_state(self):
+        cv = self.config_value
+        hm = self.mock_hdfs.return_value
+        hm.path_exists.return_value = False
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        self.assertEqual(lh.next_partition_path("2016/08/19/14"),
+                         "%s/2016/08/19/14/0" % cv)
+
     def test_lock(self):
         cv = self.config_value
         mm = self.mock_mm.return_value
+        mm.acquire_lock.return_value = True
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
-        lh.lock()
-        mm.lock.assert_called_with(cv)
+        self.assertTrue(lh.lock())
+        self.assertTrue(lh.locked)
+        holder = mm.acquire_lock.call_args[0][1]
+        self.assertTrue(holder.endswith(":12345"))
+        mm.acquire_lock.assert_called_with(cv, holder, 3333)
+        self.mock_heartbeat.assert_called_with(mm.credentials, cv, holder, 3333,
+                                               mdmgr_class=type(mm))
+        self.mock_heartbeat.return_value.start.assert_called_with()
+
+    def test_lock_held_by_other_load(self):
+        cv = self.config_value
+        mm = self.mock_mm.return_value
+        mm.acquire_lock.return_value = False
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        self.assertFalse(lh.lock())
+        self.assertFalse(lh.locked)
+        mm.increment_release_attempt.assert_called_with(cv)
+        self.assertFalse(self.mock_heartbeat.called)
 
     def test_lock_exception(self):
         mm = self.mock_mm.return_value
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
-        mm.lock.side_effect = thex.MetadataManagerException()
+        mm.acquire_lock.side_effect = thex.MetadataManagerException()
         with self.assertRaises(thex.LoadHandlerException):
             lh.lock()
 
-    def test_proceed_dataset_locked(self):
+    def test_unlock(self):
+        cv = self.config_value
         mm = self.mock_mm.return_value
-        mm.get_lock_status.return_value = (1, 0)
+        mm.acquire_lock.return_value = True
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        lh.lock()
+        lh.unlock()
+        self.mock_heartbeat.return_value.stop.assert_called_with()
+        mm.release.assert_called_with(cv, holder=lh.lock_holder)
+
+    def test_check_lease_lost(self):
+        self.mock_mm.return_value.acquire_lock.return_value = True
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        lh.check_lease()
+        lh.lock()
+        lh.check_lease()
+        self.mock_heartbeat.return_value.lost = True
+        with self.assertRaises(thex.LoadHandlerException):
+            lh.check_lease()
+
+    @mock.patch("thrive.load_handler.LoadHandler.get_newdirs")
+    def test_proceed_dataset_locked(self, mock_gn):
+        mm = self.mock_mm.return_value
+        mm.acquire_lock.return_value = False
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
         self.assertFalse(lh.proceed())
+        self.assertFalse(mock_gn.called)
 
     @mock.patch("thrive.load_handler.LoadHandler.get_newdirs")
     def test_proceed_no_newdirs(self, mock_gn):
         mock_gn.return_value = []
         mm = self.mock_mm.return_value
-        mm.get_lock_status.return_value = (0, 0)
+        mm.acquire_lock.return_value = True
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
         self.assertFalse(lh.proceed())
+        self.assertFalse(lh.locked)
+        self.assertTrue(mm.release.called)
 
     @mock.patch("thrive.load_handler.LoadHandler.get_newdirs")
     def test_proceed_no_primary_namenode(self, mock_gn):
         mock_gn.return_value = ["foo", "bar"]
         mm = self.mock_mm.return_value
-        mm.get_lock_status.return_value = (0, 0)
+        mm.acquire_lock.return_value = True
         hm = self.mock_hdfs.return_value
         hm.get_primary_namenode.return_value = None
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
         self.assertFalse(lh.proceed())
+        self.assertFalse(mm.acquire_lock.called)
 
     @mock.patch("thrive.load_handler.LoadHandler.get_newdirs")
     def test_proceed_all_conditions_satisfied(self, mock_gn):
         mock_gn.return_value = ["foo", "bar"]
         mm = self.mock_mm.return_value
-        mm.get_lock_status.return_value = (0, 0)
+        mm.acquire_lock.return_value = True
         hm = self.mock_hdfs.return_value
         hm.get_primary_namenode.return_value = "foo"
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
         self.assertTrue(lh.proceed())
+        self.assertTrue(lh.locked)
+
+    @mock.patch("thrive.load_handler.LoadHandler.get_newdirs")
+    def test_proceed_replays_journal(self, mock_gn):
+        mock_gn.return_value = ["foo", "bar"]
+        mm = self.mock_mm.return_value
+        mm.acquire_lock.return_value = True
+        mj = self.mock_journal.return_value
+        mj.replay.side_effect = lambda: self.assertFalse(mock_gn.called)
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        self.assertTrue(lh.proceed())
+        self.assertTrue(mj.replay.called)
+
+    @mock.patch("thrive.load_handler.LoadHandler.get_newdirs")
+    def test_proceed_replay_exception(self, mock_gn):
+        mm = self.mock_mm.return_value
+        mm.acquire_lock.return_value = True
+        mj = self.mock_journal.return_value
+        mj.replay.side_effect = thex.MetadataManagerException()
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        with self.assertRaises(thex.LoadHandlerException):
+            lh.proceed()
+        self.assertFalse(mock_gn.called)
+
+    def test_commit_metadata_exception(self):
+        mj = self.mock_journal.return_value
+        mj.commit.side_effect = thex.MetadataManagerException()
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        with self.assertRaises(thex.LoadHandlerException):
+            lh.commit_metadata()
+
+    @mock.patch("thrive.load_handler.get_logfile")
+    @mock.patch("thrive.load_handler.command_stats")
+    def test_report_command_stats(self, mock_stats, mock_logfile):
+        summary = {"hdfs.ls": {"count": 2, "failures": 0, "output_bytes": 10,
+                               "total_secs": 3.0, "p50_secs": 1.0, "p95_secs": 2.0}}
+        mock_stats.summary.return_value = summary
+        mock_logfile.return_value = "__test__run.log"
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        self.assertDictEqual(lh.report_command_stats(), summary)
+        statsfile = "__test__run_cmdstats.json"
+        with open(statsfile) as sf:
+            self.assertDictEqual(json.load(sf), summary)
+        os.remove(statsfile)
+
+    @mock.patch("thrive.load_handler.LoadHandler.report_command_stats")
+    @mock.patch("thrive.load_handler.LoadHandler.proceed")
+    def test_execute_report_command_stats(self, mock_proceed, mock_report):
+        mock_proceed.return_value = False
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        lh.execute()
+        mock_report.assert_called_with()
 
     @mock.patch("thrive.load_handler.LoadHandler.proceed")
     def test_execute_no_proceed(self, mock_proceed):
@@ -323,7 +742,7 @@ class TestLoadHandler(unittest.TestCase):
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
         # If proceed() is False, execute() returns None
-        self.assertEqual(lh.execute(), None)
+        self.assertFalse(lh.execute())
 
     @mock.patch("thrive.load_handler.iso_format")
     @mock.patch("thrive.load_handler.chunk_dirs")
@@ -349,11 +768,12 @@ class TestLoadHandler(unittest.TestCase):
                                       "reduce_output_records": 28701197,
                                       "skipped": 9}
         mm = self.mock_mm.return_value
+        mj = self.mock_journal.return_value
         mm.get_unprocessed_partitions.return_value = ["2016/08/19/14"]
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
 
-        lh.execute()
+        self.assertTrue(lh.execute())
 
         # workflow properties file tests
         mock_wpf.assert_called_with(ptn_path, ["d_20160819-1410"])
@@ -365,10 +785,10 @@ class TestLoadHandler(unittest.TestCase):
 
         # Hive tests
         hive_mgr = self.mock_hive.return_value
-        hive_mgr.create_partition.assert_called_with(ptn_path)
+        hive_mgr.create_partitions.assert_called_with([ptn_path], hdfs_mgr=hm)
 
         # HDFS tests
-        hm.grantall.assert_called_with("rx", cv)
+        hm.grant_partition.assert_called_with("rx", ptn_path, cv, set())
 
         # Metadata manager tests
         hive_load_metadata = {
@@ -383,7 +803,7 @@ class TestLoadHandler(unittest.TestCase):
             "hive_last_partition": "2016/08/19/14/0",
             "hadoop_records_processed": 12466493,
             "hive_rows_loaded": 28701197}
-        mm.insert.assert_called_with(hive_load_metadata, mdtype="load")
+        mj.record_loads.assert_called_with([hive_load_metadata])
 
     @mock.patch("thrive.load_handler.iso_format")
     @mock.patch("thrive.load_handler.chunk_dirs")
@@ -432,6 +852,10 @@ class TestLoadHandler(unittest.TestCase):
                                        mock_proceed, mock_lock, mock_chunk_dirs,
                                        mock_iso_fmt):
         cv = self.mock_get_config.return_value = "true"
+        configs = {"vertica_staging_load": "false",
+                   "mr_output_codec": "org.apache.hadoop.io.compress.GzipCodec"}
+        self.mock_get_config.side_effect = \
+            lambda key, *args, **kwargs: configs.get(key, cv)
         mock_proceed.return_value = True
         mock_chunk_dirs.return_value = {"2016/08/19/14": ["d_20160819-1410"]}
         ts = "2016-08-19 14:10:00"
@@ -449,6 +873,7 @@ class TestLoadHandler(unittest.TestCase):
                                       "reduce_output_records": 28701197,
                                       "skipped": 9}
         mm = self.mock_mm.return_value
+        mj = self.mock_journal.return_value
         mm.get_unprocessed_partitions.return_value = \
             [("12345", hive_ptn, "100", "50")]
 
@@ -462,7 +887,7 @@ class TestLoadHandler(unittest.TestCase):
         mn = self.mock_newrelic.return_value
         mn.get_count.return_value = 100
 
-        lh.execute()
+        self.assertTrue(lh.execute())
 
         # workflow properties file tests
         mock_wpf.assert_called_with(ptn_path, ["d_20160819-1410"])
@@ -474,10 +899,10 @@ class TestLoadHandler(unittest.TestCase):
 
         # Hive tests
         hive_mgr = self.mock_hive.return_value
-        hive_mgr.create_partition.assert_called_with(ptn_path)
+        hive_mgr.create_partitions.assert_called_with([ptn_path], hdfs_mgr=hm)
 
         # HDFS tests
-        hm.grantall.assert_called_with("rx", cv)
+        hm.grant_partition.assert_called_with("rx", ptn_path, cv, set())
 
         # Metadata manager tests
         hive_load_metadata = {
@@ -492,7 +917,7 @@ class TestLoadHandler(unittest.TestCase):
             "hive_last_partition": hive_ptn,
             "hadoop_records_processed": 12466493,
             "hive_rows_loaded": 28701197}
-        mm.insert.assert_called_with(hive_load_metadata, mdtype="load")
+        mj.record_loads.assert_called_with([hive_load_metadata])
 
         vertica_metadata = {
             "vertica_db": cv,
@@ -503,11 +928,10 @@ class TestLoadHandler(unittest.TestCase):
             "vertica_last_partition": hive_ptn,
             "vertica_rows_loaded": 100,
             "status": "SUCCESS"}
-        mm.update.assert_called_with(("12345", hive_ptn), vertica_metadata,
-                                     mdtype="load")
+        mj.update_loads.assert_called_with([(("12345", hive_ptn), vertica_metadata)])
 
         # Vertica manager tests
-        mock_vload_copy.assert_called_with(hive_ptn, mode="direct")
+        mock_vload_copy.assert_called_with(hive_ptn, dtable=None, mode="direct")
 
         # dirname_to_dto_tests
         # mock_dtd.assert_has_calls([mock.call("d_20160819-1410"),
@@ -592,7 +1016,7 @@ class TestLoadHandler(unittest.TestCase):
         hm = self.mock_hdfs.return_value
         hm.path_exists.return_value = False
         hive_mgr = self.mock_hive.return_value
-        hive_mgr.create_partition.side_effect = tlh.HiveManagerException()
+        hive_mgr.create_partitions.side_effect = tlh.HiveManagerException()
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
         with self.assertRaises(thex.LoadHandlerException):
@@ -603,14 +1027,103 @@ class TestLoadHandler(unittest.TestCase):
     @mock.patch("thrive.load_handler.LoadHandler.lock")
     @mock.patch("thrive.load_handler.LoadHandler.proceed")
     @mock.patch("thrive.load_handler.LoadHandler.make_workflowpropsfile")
-    def test_execute_HdfsManager_grantall_exception(self, mock_wpf, mock_proceed,
-                                            mock_lock, mock_chunk_dirs,
-                                            mock_iso_fmt):
+    def test_execute_partitions_batched(self, mock_wpf, mock_proceed, mock_lock,
+                                        mock_chunk_dirs, mock_iso_fmt):
+        cv = self.config_value
+        mock_proceed.return_value = True
+        mock_chunk_dirs.return_value = {"2016/08/19/14": ["d_20160819-1410"],
+                                        "2016/08/19/15": ["d_20160819-1510"]}
+        hm = self.mock_hdfs.return_value
+        hm.path_exists.return_value = False
+        mo = self.mock_oozie.return_value
+        mo.get_counts.return_value = {"map_input_records": 10,
+                                      "map_output_records": 10,
+                                      "skipped": 0}
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        lh.execute()
+        hive_mgr = self.mock_hive.return_value
+        hive_mgr.create_partitions.assert_called_once_with(
+            ["%s/2016/08/19/14/0" % cv, "%s/2016/08/19/15/0" % cv], hdfs_mgr=hm)
+        mj = self.mock_journal.return_value
+        self.assertEqual(mj.record_loads.call_count, 1)
+        self.assertEqual(len(mj.record_loads.call_args[0][0]), 2)
+        self.assertEqual(mj.commit.call_count, 1)
+
+    @mock.patch("thrive.load_handler.LoadHandler.vload_partitions")
+    @mock.patch("thrive.load_handler.iso_format")
+    @mock.patch("thrive.load_handler.chunk_dirs")
+    @mock.patch("thrive.load_handler.LoadHandler.lock")
+    @mock.patch("thrive.load_handler.LoadHandler.proceed")
+    @mock.patch("thrive.load_handler.LoadHandler.make_workflowpropsfile")
+    def test_execute_partitions_batched_processed_records(self, mock_wpf, mock_proceed,
+                                                          mock_lock, mock_chunk_dirs,
+                                                          mock_iso_fmt, mock_vload):
+        self.mock_int.side_effect = builtin_int
+        configs = {"hive_partition_batch_size": "0", "vertica_load": "true"}
+        self.mock_get_config.side_effect = \
+            lambda key, *args, **kwargs: configs.get(key, self.config_value)
+        mock_proceed.return_value = True
+        mock_chunk_dirs.return_value = {"2016/08/19/14": ["d_20160819-1410"],
+                                        "2016/08/19/15": ["d_20160819-1510"]}
+        hm = self.mock_hdfs.return_value
+        hm.path_exists.return_value = False
+        mo = self.mock_oozie.return_value
+        mo.get_counts.side_effect = [{"map_input_records": 10, "map_output_records": 9,
+                                      "skipped": 1},
+                                     {"map_input_records": 20, "map_output_records": 18,
+                                      "skipped": 2}]
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        lh.execute()
+        self.assertEqual(mock_vload.call_count, 1)
+        self.assertEqual(mock_vload.call_args[0][1], 27)
+
+    @mock.patch("thrive.load_handler.iso_format")
+    @mock.patch("thrive.load_handler.chunk_dirs")
+    @mock.patch("thrive.load_handler.LoadHandler.lock")
+    @mock.patch("thrive.load_handler.LoadHandler.proceed")
+    @mock.patch("thrive.load_handler.LoadHandler.make_workflowpropsfile")
+    def test_execute_partitions_partially_created(self, mock_wpf, mock_proceed,
+                                                  mock_lock, mock_chunk_dirs,
+                                                  mock_iso_fmt):
+        cv = self.config_value
+        mock_proceed.return_value = True
+        mock_chunk_dirs.return_value = {"2016/08/19/14": ["d_20160819-1410"],
+                                        "2016/08/19/15": ["d_20160819-1510"]}
+        hm = self.mock_hdfs.return_value
+        hm.path_exists.return_value = False
+        mo = self.mock_oozie.return_value
+        mo.get_counts.return_value = {"map_input_records": 10,
+                                      "map_output_records": 10,
+                                      "skipped": 0}
+        hive_mgr = self.mock_hive.return_value
+        hive_mgr.create_partitions.side_effect = \
+            lambda ptn_paths, hdfs_mgr=None: ptn_paths[:1]
+        mj = self.mock_journal.return_value
+        mj.pending.return_value = True
+        lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
+                             resources_file="baz.zip")
+        with self.assertRaises(thex.LoadHandlerException):
+            lh.execute()
+        self.assertEqual(mj.commit.call_count, 1)
+        self.assertEqual(mj.record_loads.call_count, 1)
+        self.assertListEqual([md["last_load_folder"] for md in mj.record_loads.call_args[0][0]],
+                             ["d_20160819-1410"])
+
+    @mock.patch("thrive.load_handler.iso_format")
+    @mock.patch("thrive.load_handler.chunk_dirs")
+    @mock.patch("thrive.load_handler.LoadHandler.lock")
+    @mock.patch("thrive.load_handler.LoadHandler.proceed")
+    @mock.patch("thrive.load_handler.LoadHandler.make_workflowpropsfile")
+    def test_execute_HdfsManager_grant_partition_exception(self, mock_wpf, mock_proceed,
+                                                           mock_lock, mock_chunk_dirs,
+                                                           mock_iso_fmt):
         mock_proceed.return_value = True
         mock_chunk_dirs.return_value = {"2016/08/19/14": ["d_20160819-1410"]}
         hm = self.mock_hdfs.return_value
         hm.path_exists.return_value = False
-        hm.grantall.side_effect = thex.HdfsManagerException
+        hm.grant_partition.side_effect = thex.HdfsManagerException
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
         with self.assertRaises(thex.LoadHandlerException):
@@ -628,8 +1141,8 @@ class TestLoadHandler(unittest.TestCase):
         mock_chunk_dirs.return_value = {"2016/08/19/14": ["d_20160819-1410"]}
         hm = self.mock_hdfs.return_value
         hm.path_exists.return_value = False
-        mm = self.mock_mm.return_value
-        mm.insert.side_effect = tlh.MetadataManagerException()
+        mj = self.mock_journal.return_value
+        mj.record_loads.side_effect = tlh.MetadataManagerException()
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
         with self.assertRaises(thex.LoadHandlerException):
@@ -647,8 +1160,8 @@ class TestLoadHandler(unittest.TestCase):
         mock_chunk_dirs.return_value = {"2016/08/19/14": ["d_20160819-1410"]}
         hm = self.mock_hdfs.return_value
         hm.path_exists.return_value = False
-        mm = self.mock_mm.return_value
-        mm.insert.side_effect = BaseException()
+        mj = self.mock_journal.return_value
+        mj.record_loads.side_effect = BaseException()
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
         with self.assertRaises(BaseException):
@@ -693,9 +1206,10 @@ class TestLoadHandler(unittest.TestCase):
         hm = self.mock_hdfs.return_value
         hm.path_exists.return_value = False
         mm = self.mock_mm.return_value
+        mj = self.mock_journal.return_value
         mm.get_unprocessed_partitions.return_value = \
             [("12345", "2016/08/19/14/0", "100", "50")]
-        mm.update.side_effect = tlh.MetadataManagerException()
+        mj.update_loads.side_effect = tlh.MetadataManagerException()
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
         with self.assertRaises(thex.LoadHandlerException):
@@ -719,5 +1233,6 @@ class TestLoadHandler(unittest.TestCase):
         lh = tlh.LoadHandler(datacfg_file="foo", envcfg_file="bar",
                              resources_file="baz.zip")
         lh.locked = True
+        lh.lock_holder = "host:1:12345"
         lh.execute()
-        mm.release.assert_called_with(self.config_value)
+        mm.release.assert_called_with(self.config_value, holder="host:1:12345")
@@ -13,6 +13,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import uuid
 import unittest
 import mock
 import pyodbc
@@ -81,6 +83,32 @@ class TestMetadataManager(unittest.TestCase):
         with self.assertRaises(MetadataManagerException):
             self.mm.execute("foo")
 
+    def test_execute_params(self):
+        stmt = "update foo set bar = ? where baz = ?;"
+        self.mock_cursor.rowcount = 1
+        self.assertEqual(self.mm.execute(stmt, ["bar", "baz"]), 1)
+        self.mock_cursor.execute.assert_called_with(stmt, ["bar", "baz"])
+        self.mock_connection.commit.assert_called_with()
+
+    def test_executemany(self):
+        stmt = "delete from foo where bar = ?;"
+        rows = [("baz",), ("quux",)]
+        self.mm.executemany(stmt, rows)
+        self.mock_cursor.executemany.assert_called_once_with(stmt, rows)
+        self.assertEqual(self.mock_connection.commit.call_count, 1)
+        self.mock_cursor.close.assert_called_with()
+
+    def test_executemany_no_rows(self):
+        self.mm.executemany("delete from foo where bar = ?;", [])
+        self.assertFalse(self.mock_connection.cursor.called)
+
+    def test_executemany_exception_rollback(self):
+        self.mock_cursor.executemany.side_effect = pyodbc.Error()
+        with self.assertRaises(MetadataManagerException):
+            self.mm.executemany("delete from foo where bar = ?;", [("baz",)])
+        self.mock_connection.rollback.assert_called_with()
+        self.assertFalse(self.mock_connection.commit.called)
+
     def test_execute_return_calls(self):
         stmt = "select * from foo;"
         self.mm.execute_return(stmt)
@@ -123,12 +151,24 @@ class TestMetadataManager(unittest.TestCase):
 
         data = {"fookey": "fooval", "barkey": "barval"}
         columns = ",".join(data.keys())
-        values = ",".join("'%s'" % v for v in data.values())
 
         for mdtype, mdtable in mdmap.items():
-            stmt = "insert into %s (%s) values (%s);" % (mdtable, columns, values)
+            stmt = "insert into %s (%s) values (?,?);" % (mdtable, columns)
             self.mm.insert(data, mdtype=mdtype)
-            mock_exec.assert_called_with(stmt)
+            mock_exec.assert_called_with(stmt, data.values())
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.executemany")
+    def test_insert_many(self, mock_execmany):
+        rows = [{"fookey": "fooval%d" % i, "barkey": "barval%d" % i} for i in range(3)]
+        columns = ",".join(rows[0].keys())
+        stmt = "insert into thrive_load_metadata (%s) values (?,?);" % columns
+        self.mm.insert_many(rows, mdtype="load")
+        mock_execmany.assert_called_once_with(stmt, [row.values() for row in rows])
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.executemany")
+    def test_insert_many_no_rows(self, mock_execmany):
+        self.mm.insert_many([], mdtype="load")
+        self.assertFalse(mock_execmany.called)
 
     def test_insert_unallowed_mdtype_exception(self):
         with self.assertRaises(MetadataManagerException):
@@ -146,59 +186,77 @@ class TestMetadataManager(unittest.TestCase):
         with self.assertRaises(MetadataManagerException):
             self.mm.insert({"foo": "bar"}, mdtype="foo")
 
-    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
-    def test_update(self, mock_exec):
+    @mock.patch("thrive.metadata_manager.MetadataManager.executemany")
+    def test_update(self, mock_execmany):
         pk = ("pk1", "pk2")
         mdmap = { "setup": "thrive_setup", "load": "thrive_load_metadata"}
         mdfilter = {
-            "setup": "dataset_id = '%s'" % pk[0],
-            "load": "(load_id, hive_last_partition) = ('%s', '%s')" % pk
+            "setup": ("(dataset_id) = (?)", ["pk1"]),
+            "load": ("(load_id, hive_last_partition) = (?, ?)", ["pk1", "pk2"])
         }
         data = {"fookey": "fooval", "barkey": "barval"}
 
         for mdtype, mdtable in mdmap.items():
-            updates = ",".join('%s="%s"' % (key, val) for key, val in data.items())
+            updates = ",".join("%s=?" % key for key in data.keys())
             stmt = "update %s set %s where %s;" \
-                         % (mdtable, updates, mdfilter[mdtype])
+                         % (mdtable, updates, mdfilter[mdtype][0])
             self.mm.update(pk, data, mdtype=mdtype)
             self.assertEqual(squeeze(stmt),
-                             squeeze(mock_exec.call_args[0][0]))
+                             squeeze(mock_execmany.call_args[0][0]))
+            self.assertListEqual(mock_execmany.call_args[0][1],
+                                 [data.values() + mdfilter[mdtype][1]])
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.executemany")
+    def test_update_many(self, mock_execmany):
+        updates = [(("12345", "2016/08/19/14/%d" % i), {"vertica_rows_loaded": i})
+                   for i in range(3)]
+        self.mm.update_many(updates, mdtype="load")
+        self.assertEqual(mock_execmany.call_count, 1)
+        self.assertListEqual(mock_execmany.call_args[0][1],
+                             [[i, "12345", "2016/08/19/14/%d" % i] for i in range(3)])
 
     def test_update_unallowed_mdtype_exception(self):
         with self.assertRaises(MetadataManagerException):
             self.mm.update(("foo", "bar"), {"foo": "bar"}, mdtype="foo")
 
-    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
-    def test_update_execute_exception(self, mock_exec):
-        mock_exec.side_effect = Exception()
+    @mock.patch("thrive.metadata_manager.MetadataManager.executemany")
+    def test_update_execute_exception(self, mock_execmany):
+        mock_execmany.side_effect = Exception()
         with self.assertRaises(MetadataManagerException):
-            self.mm.update(("foo", "bar"), {"foo": "bar"}, mdtype="foo")
+            self.mm.update(("foo", "bar"), {"foo": "bar"}, mdtype="load")
 
+    @mock.patch("thrive.metadata_manager.MetadataManager.get_state")
     @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
-    def test_get_last_dir_call(self, mock_exec):
+    def test_get_last_dir_call(self, mock_exec, mock_state):
+        mock_state.return_value = None
         dataset_name, hive_table, load_type = "foo", "bar", "baz"
         stmt = '''
                  select last_load_folder
                  from thrive_load_metadata
-                 where dataset_name = '%s'
-                 and hive_table = '%s'
-                 and load_type = '%s'
+                 where dataset_name = ?
+                 and hive_table = ?
+                 and load_type = ?
                  order by hive_end_ts desc
                  limit 1;
-              ''' % (dataset_name, hive_table, load_type)
+              '''
         _ = self.mm.get_lastdir(dataset_name, hive_table, load_type)
         self.assertEqual(squeeze(stmt),
                          squeeze(mock_exec.call_args[0][0]))
+        self.assertListEqual(mock_exec.call_args[0][1], [dataset_name, hive_table, load_type])
 
+    @mock.patch("thrive.metadata_manager.MetadataManager.get_state")
     @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
-    def test_get_last_dir_val(self, mock_exec):
+    def test_get_last_dir_val(self, mock_exec, mock_state):
+        mock_state.return_value = None
         result = [["foo", "bar"], ["baz", "quux"]]
         mock_exec.return_value = result
         last_dir = self.mm.get_lastdir("foo", "bar", "baz")
         self.assertEqual(last_dir, "foo")
 
+    @mock.patch("thrive.metadata_manager.MetadataManager.get_state")
     @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
-    def test_get_last_dir_exception(self, mock_exec):
+    def test_get_last_dir_exception(self, mock_exec, mock_state):
+        mock_state.return_value = None
         mock_exec.side_effect = Exception()
         with self.assertRaises(MetadataManagerException):
             _ = self.mm.get_lastdir("foo", "bar", "baz")
@@ -206,15 +264,59 @@ class TestMetadataManager(unittest.TestCase):
     @mock.patch("thrive.metadata_manager.MetadataManager.execute")
     def test_purge(self, mock_exec):
         thrive_tables = ["thrive_setup", "thrive_load_metadata",
-                         "thrive_dataset_lock"]
+                         "thrive_dataset_lock", "thrive_dataset_state"]
         calls = []
         dataset_name = "foo"
         for tt in thrive_tables:
-            stmt = "delete from %s where dataset_name = '%s';" % (tt, dataset_name)
-            calls.append(mock.call(stmt))
+            stmt = "delete from %s where dataset_name = ?;" % tt
+            calls.append(mock.call(stmt, [dataset_name]))
         self.mm.purge(dataset_name)
         mock_exec.assert_has_calls(calls, any_order=True)
 
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
+    def test_get_last_dir_from_state(self, mock_exec):
+        mock_exec.return_value = [("d_20160819-1410",)]
+        self.assertEqual(self.mm.get_lastdir("foo", "bar", "scheduled"), "d_20160819-1410")
+        self.assertEqual(mock_exec.call_count, 1)
+        self.assertListEqual(mock_exec.call_args[0][1], ["foo", "bar", "lastdir:scheduled"])
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
+    def test_get_next_part(self, mock_exec):
+        mock_exec.return_value = [("3",)]
+        self.assertEqual(self.mm.get_next_part("foo", "bar", "2016/08/19/14"), 3)
+        self.assertListEqual(mock_exec.call_args[0][1], ["foo", "bar", "part:2016/08/19/14"])
+        mock_exec.return_value = []
+        self.assertIsNone(self.mm.get_next_part("foo", "bar", "2016/08/19/14"))
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_transaction")
+    def test_record_loads(self, mock_trans):
+        rows = [{"dataset_name": "foo", "hive_table": "bar", "load_type": "scheduled",
+                 "last_load_folder": "d_20160819-%s10" % hour,
+                 "hive_last_partition": "2016/08/19/%s/0" % hour}
+                for hour in ("14", "15")]
+        self.mm.record_loads(rows)
+        self.assertEqual(mock_trans.call_count, 1)
+        (insert_qry, insert_rows), (lastdir_qry, lastdirs), (part_qry, parts) = \
+            mock_trans.call_args[0][0]
+        self.assertTrue(insert_qry.startswith("insert into thrive_load_metadata"))
+        self.assertIn("on duplicate key update", insert_qry)
+        self.assertListEqual(insert_rows, [row.values() for row in rows])
+        self.assertIn("on duplicate key update state_value = values(state_value)",
+                      squeeze(lastdir_qry))
+        self.assertListEqual(lastdirs,
+                             [("foo", "bar", "lastdir:scheduled", "d_20160819-1410"),
+                              ("foo", "bar", "lastdir:scheduled", "d_20160819-1510")])
+        self.assertIn("greatest", part_qry)
+        self.assertListEqual(parts, [("foo", "bar", "part:2016/08/19/14", "1"),
+                                     ("foo", "bar", "part:2016/08/19/15", "1")])
+
+    def test_execute_transaction(self):
+        self.mm.execute_transaction([("qry1", [("a",)]), ("qry2", []), ("qry3", [("b",)])])
+        self.mock_cursor.executemany.assert_has_calls([mock.call("qry1", [("a",)]),
+                                                       mock.call("qry3", [("b",)])])
+        self.assertEqual(self.mock_cursor.executemany.call_count, 2)
+        self.assertEqual(self.mock_connection.commit.call_count, 1)
+
     @mock.patch("thrive.metadata_manager.MetadataManager.execute")
     def test_purge_exception(self, mock_exec):
         mock_exec.side_effect = Exception()
@@ -230,14 +332,15 @@ class TestMetadataManager(unittest.TestCase):
                          hive_rows_loaded,
                          hadoop_records_processed
                   from thrive_load_metadata
-                  where hive_db = '%s'
-                  and hive_table = '%s'
+                  where hive_db = ?
+                  and hive_table = ?
                   and hive_last_partition <> ''
                   and vertica_last_partition is NULL;
-              ''' % (hive_db, hive_table)
+              '''
         _ = self.mm.get_unprocessed_partitions("foo", "bar")
         self.assertEqual(squeeze(stmt),
                          squeeze(mock_exec.call_args[0][0]))
+        self.assertListEqual(mock_exec.call_args[0][1], [hive_db, hive_table])
 
     @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
     def test_get_unprocessed_partitions_val(self, mock_exec):
@@ -258,11 +361,12 @@ class TestMetadataManager(unittest.TestCase):
         stmt = '''
                   update thrive_dataset_lock
                   set locked = TRUE, release_attempts = 0
-                  where  dataset_name = '%s';
-               ''' % dsname
+                  where  dataset_name = ?;
+               '''
         self.mm.lock(dsname)
         self.assertEqual(squeeze(stmt),
                          squeeze(mock_exec.call_args[0][0]))
+        self.assertListEqual(mock_exec.call_args[0][1], [dsname])
 
     @mock.patch("thrive.metadata_manager.MetadataManager.execute")
     def test_lock_exception(self, mock_exec):
@@ -275,12 +379,78 @@ class TestMetadataManager(unittest.TestCase):
         dsname = "foo"
         stmt = '''
                   update thrive_dataset_lock
-                  set locked = FALSE
-                  where dataset_name='%s';
-               ''' % dsname
+                  set locked = FALSE, holder = NULL, lease_expiry = NULL
+                  where dataset_name = ?
+               '''
         self.mm.release(dsname)
         self.assertEqual(squeeze(stmt),
                          squeeze(mock_exec.call_args[0][0]))
+        self.assertListEqual(mock_exec.call_args[0][1], [dsname])
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
+    def test_release_holder(self, mock_exec):
+        self.mm.release("foo", holder="host:1:12345")
+        self.assertTrue(squeeze(mock_exec.call_args[0][0]).endswith("and holder = ?"))
+        self.assertListEqual(mock_exec.call_args[0][1], ["foo", "host:1:12345"])
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
+    def test_acquire_lock(self, mock_exec):
+        mock_exec.return_value = 1
+        self.assertTrue(self.mm.acquire_lock("foo", "host:1:12345", 900))
+        stmt = '''
+                  update thrive_dataset_lock
+                  set locked = TRUE, release_attempts = 0, holder = ?,
+                      lease_expiry = timestampadd(second, ?, now())
+                  where dataset_name = ?
+                  and (locked = FALSE or lease_expiry < now() or holder = ?);
+               '''
+        self.assertEqual(squeeze(stmt),
+                         squeeze(mock_exec.call_args[0][0]))
+        self.assertListEqual(mock_exec.call_args[0][1],
+                             ["host:1:12345", 900, "foo", "host:1:12345"])
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
+    def test_acquire_lock_held(self, mock_exec, mock_exec_return):
+        mock_exec.return_value = 0
+        mock_exec_return.return_value = [("host:2:67890",)]
+        self.assertFalse(self.mm.acquire_lock("foo", "host:1:12345", 900))
+        stmt = '''
+                  select holder
+                  from thrive_dataset_lock
+                  where dataset_name = ? and locked = TRUE;
+               '''
+        self.assertEqual(squeeze(stmt), squeeze(mock_exec_return.call_args[0][0]))
+        self.assertListEqual(mock_exec_return.call_args[0][1], ["foo"])
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
+    def test_acquire_lock_unchanged(self, mock_exec, mock_exec_return):
+        # Re-acquired by its holder within the same second
+        mock_exec.return_value = 0
+        mock_exec_return.return_value = [("host:1:12345",)]
+        self.assertTrue(self.mm.acquire_lock("foo", "host:1:12345", 900))
+        mock_exec_return.return_value = []
+        self.assertFalse(self.mm.acquire_lock("foo", "host:1:12345", 900))
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
+    def test_acquire_lock_exception(self, mock_exec):
+        mock_exec.side_effect = MetadataManagerException()
+        with self.assertRaises(MetadataManagerException):
+            self.mm.acquire_lock("foo", "host:1:12345", 900)
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
+    def test_renew_lock(self, mock_exec, mock_exec_return):
+        mock_exec.return_value = 1
+        self.assertTrue(self.mm.renew_lock("foo", "host:1:12345", 900))
+        self.assertListEqual(mock_exec.call_args[0][1], [900, "foo", "host:1:12345"])
+        self.assertFalse(mock_exec_return.called)
+        mock_exec.return_value = 0
+        mock_exec_return.return_value = [("host:1:12345",)]
+        self.assertTrue(self.mm.renew_lock("foo", "host:1:12345", 900))
+        mock_exec_return.return_value = [("host:2:67890",)]
+        self.assertFalse(self.mm.renew_lock("foo", "host:1:12345", 900))
 
     @mock.patch("thrive.metadata_manager.MetadataManager.execute")
     def test_release_exception(self, mock_exec):
@@ -294,10 +464,11 @@ class TestMetadataManager(unittest.TestCase):
         stmt = '''
                   select locked, release_attempts
                   from thrive_dataset_lock
-                  where dataset_name = '%s'; ''' % dsname
+                  where dataset_name = ?; '''
         _ = self.mm.get_lock_status(dsname)
         self.assertEqual(squeeze(stmt),
                          squeeze(mock_exec.call_args[0][0]))
+        self.assertListEqual(mock_exec.call_args[0][1], [dsname])
 
     @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
     def test_get_lock_status_val(self, mock_exec):
@@ -324,11 +495,12 @@ class TestMetadataManager(unittest.TestCase):
         stmt = '''
                  update thrive_dataset_lock
                  set release_attempts = release_attempts + 1
-                 where dataset_name = '%s';
-               ''' % dsname
+                 where dataset_name = ?;
+               '''
         self.mm.increment_release_attempt(dsname)
         self.assertEqual(squeeze(stmt),
                          squeeze(mock_exec.call_args[0][0]))
+        self.assertListEqual(mock_exec.call_args[0][1], [dsname])
 
     @mock.patch("thrive.metadata_manager.MetadataManager.execute")
     def test_increment_release_attempt_exception(self, mock_exec):
@@ -336,25 +508,195 @@ class TestMetadataManager(unittest.TestCase):
         with self.assertRaises(MetadataManagerException):
             self.mm.increment_release_attempt("bar")
 
-    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
-    def test_delete_call(self, mock_exec):
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_transaction")
+    def test_delete_call(self, mock_trans):
         dataset, mdcolname, mdcolvalue = "foo", "bar", "baz"
 
         stmt = '''
                   delete from thrive_load_metadata
-                  where dataset_name = '%s'
-                  and %s = '%s';
-               ''' % (dataset, mdcolname, mdcolvalue)
+                  where dataset_name = ?
+                  and %s = ?;
+               ''' % mdcolname
         self.mm.delete(dataset, mdcolname, mdcolvalue)
-        self.assertEqual(squeeze(stmt),
-                         squeeze(mock_exec.call_args[0][0]))
+        (delqry, rows), (state_qry, state_rows) = mock_trans.call_args[0][0]
+        self.assertEqual(squeeze(stmt), squeeze(delqry))
+        self.assertListEqual(rows, [(dataset, mdcolvalue)])
+        self.assertIn("delete from thrive_dataset_state", squeeze(state_qry))
+        self.assertListEqual(state_rows, [(dataset,)])
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_transaction")
+    def test_delete_many(self, mock_trans):
+        self.mm.delete_many("foo", "bar", ["baz", "quux"])
+        self.assertEqual(mock_trans.call_count, 1)
+        self.assertListEqual(mock_trans.call_args[0][0][0][1],
+                             [("foo", "baz"), ("foo", "quux")])
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_transaction")
+    def test_delete_exception(self, mock_trans):
+        mock_trans.side_effect = Exception()
+        with self.assertRaises(MetadataManagerException):
+            self.mm.delete("foo", "bar", "baz")
 
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
     @mock.patch("thrive.metadata_manager.MetadataManager.execute")
-    def test_delete_exception(self, mock_exec):
-        mock_exec.side_effect = Exception()
+    def test_get_schema_version(self, mock_exec, mock_exec_return):
+        mock_exec_return.return_value = [(3,)]
+        self.assertEqual(self.mm.get_schema_version(), 3)
+        self.assertIn("create table if not exists thrive_schema_version",
+                      squeeze(mock_exec.call_args[0][0]))
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
+    def test_get_schema_version_no_migrations(self, mock_exec, mock_exec_return):
+        mock_exec_return.return_value = [(None,)]
+        self.assertEqual(self.mm.get_schema_version(), 0)
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
+    def test_get_schema_version_exception(self, mock_exec):
+        mock_exec.side_effect = MetadataManagerException()
         with self.assertRaises(MetadataManagerException):
-            self.mm.delete("foo", "bar", "baz")
+            self.mm.get_schema_version()
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.insert")
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
+    @mock.patch("thrive.metadata_manager.MetadataManager.get_schema_version")
+    def test_migrate(self, mock_version, mock_exec, mock_insert):
+        mock_version.return_value = 1
+        migrations = [(3, "baz", ["stmt3"]), (1, "foo", ["stmt1"]),
+                      (2, "bar", ["stmt2a", "stmt2b"])]
+        applied = self.mm.migrate(migrations)
+        self.assertListEqual(applied, [2, 3])
+        mock_exec.assert_has_calls([mock.call("stmt2a"), mock.call("stmt2b"),
+                                    mock.call("stmt3")])
+        self.assertEqual(mock_exec.call_count, 3)
+        mock_insert.assert_called_with({"version": 3, "description": "baz"},
+                                       mdtype="schema")
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.insert")
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute")
+    @mock.patch("thrive.metadata_manager.MetadataManager.get_schema_version")
+    def test_migrate_failed_not_recorded(self, mock_version, mock_exec, mock_insert):
+        mock_version.return_value = 0
+        mock_exec.side_effect = MetadataManagerException()
+        with self.assertRaises(MetadataManagerException):
+            self.mm.migrate([(1, "foo", ["stmt1"])])
+        self.assertFalse(mock_insert.called)
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
+    def test_unapplied_index(self, mock_exec_return):
+        mock_exec_return.return_value = [(1,)]
+        self.assertIsNone(self.mm.unapplied("create index idx\n  on t (a(100), b)"))
+        qry = "select 1 from information_schema.statistics where table_schema = " \
+              "database() and table_name = ? and index_name = ?;"
+        mock_exec_return.assert_called_with(qry, ["t", "idx"])
+        mock_exec_return.return_value = []
+        self.assertEqual(self.mm.unapplied("create index idx on t (a)"),
+                         "create index idx on t (a)")
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
+    def test_unapplied_table(self, mock_exec_return):
+        mock_exec_return.return_value = [(1,)]
+        self.assertIsNone(self.mm.unapplied("create table t (a int)"))
+        mock_exec_return.assert_called_with("select 1 from information_schema.tables "
+                                            "where table_schema = database() "
+                                            "and table_name = ?;", ["t"])
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
+    def test_unapplied_columns(self, mock_exec_return):
+        mock_exec_return.side_effect = [[(1,)], []]
+        stmt = "alter table t\n  add column a varchar(200) default null,\n" \
+               "  add column b timestamp null default null"
+        self.assertEqual(self.mm.unapplied(stmt),
+                         "alter table t add column b timestamp null default null")
+        mock_exec_return.assert_called_with("select 1 from information_schema.columns "
+                                            "where table_schema = database() and "
+                                            "table_name = ? and column_name = ?;",
+                                            ["t", "b"])
+
+    @mock.patch("thrive.metadata_manager.MetadataManager.execute_return")
+    def test_unapplied_other(self, mock_exec_return):
+        stmt = "update t set a = 1"
+        self.assertEqual(self.mm.unapplied(stmt), stmt)
+        self.assertFalse(mock_exec_return.called)
 
     def test_close(self):
         self.mm.close()
         self.mock_connection.close.assert_called_with()
+
+
+class TestMetadataJournal(unittest.TestCase):
+    def setUp(self):
+        self.journalfile = "__test__metadata.journal"
+        self.mm = mock.MagicMock()
+        self.mm.load_batches.side_effect = lambda rows: [("insert", [[row["load_id"]]
+                                                                    for row in rows])]
+        self.mm.update_batch.side_effect = lambda updates, mdtype: \
+            ("update", [list(pk) for pk, _ in updates])
+        self.journal = tmm.MetadataJournal(self.mm, self.journalfile)
+        self.load_id = uuid.uuid1()
+        self.load = {"load_id": self.load_id,
+                     "hive_last_partition": "2016/08/19/14/0",
+                     "hive_rows_loaded": 100,
+                     "hadoop_records_processed": 50}
+
+    def tearDown(self):
+        if os.path.exists(self.journalfile):
+            os.remove(self.journalfile)
+
+    def test_queue_saves_journal(self):
+        self.journal.record_loads([self.load])
+        self.assertFalse(self.mm.execute_transaction.called)
+        self.assertTrue(os.path.exists(self.journalfile))
+
+        self.journal.update_loads([((self.load_id, "2016/08/19/14/0"), {"status": "SUCCESS"})])
+        replayed = tmm.MetadataJournal(self.mm, self.journalfile)
+        self.assertTrue(replayed.replay())
+        load_id = str(self.load_id)
+        self.mm.execute_transaction.assert_called_with(
+            [(u"insert", [[load_id]]), (u"update", [[load_id, u"2016/08/19/14/0"]])])
+        self.assertFalse(os.path.exists(self.journalfile))
+
+    def test_commit(self):
+        self.journal.record_loads([self.load])
+        self.journal.commit()
+        self.mm.execute_transaction.assert_called_once_with([("insert", [[self.load_id]])])
+        self.assertFalse(self.journal.pending())
+        self.assertFalse(os.path.exists(self.journalfile))
+
+    def test_commit_nothing_queued(self):
+        self.journal.commit()
+        self.assertFalse(self.mm.execute_transaction.called)
+
+    def test_commit_failed(self):
+        self.mm.execute_transaction.side_effect = MetadataManagerException()
+        self.journal.record_loads([self.load])
+        with self.assertRaises(MetadataManagerException):
+            self.journal.commit()
+        self.assertTrue(self.journal.pending())
+        self.assertTrue(os.path.exists(self.journalfile))
+
+    def test_replay_no_journal(self):
+        self.assertFalse(self.journal.replay())
+        self.assertFalse(self.mm.execute_transaction.called)
+
+    def test_replay_unreadable(self):
+        with open(self.journalfile, "w") as jf:
+            jf.write("[[")
+        with self.assertRaises(MetadataManagerException):
+            self.journal.replay()
+
+    def test_unprocessed_partitions(self):
+        other = dict(self.load, hive_last_partition="2016/08/19/15/0")
+        self.journal.record_loads([self.load, other])
+        self.journal.update_loads([((self.load_id, "2016/08/19/14/0"),
+                                    {"vertica_last_partition": "2016/08/19/14/0"})])
+        self.assertListEqual(self.journal.unprocessed_partitions(),
+                             [(self.load_id, "2016/08/19/15/0", 100, 50)])
+
+    def test_save_exception(self):
+        with mock.patch("thrive.metadata_manager.json.dump", side_effect=TypeError()):
+            with self.assertRaises(MetadataManagerException):
+                self.journal.record_loads([self.load])
+        self.assertFalse(os.path.exists(self.journalfile))
+        self.assertFalse(os.path.exists("%s.%d.tmp" % (self.journalfile, os.getpid())))
+
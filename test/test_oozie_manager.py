@@ -119,19 +119,28 @@ class TestOozieManager(unittest.TestCase):
         with self.assertRaises(Exception):
             _ = self.om.get_status("foo")
 
-    def test_get_logtrace_call(self):
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_logtrace_call(self, mock_stream):
         jobid = "job: 12-34"
         _ = self.om.get_logtrace(jobid)
         cmd = "oozie job -log %s" % jobid
-        self.mock_exec.assert_called_with(cmd)
+        mock_stream.assert_called_with(cmd)
 
-    def test_get_logtrace_val(self):
-        self.mock_exec.return_value = tse.ShellResult(0, "foo", "")
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_logtrace_val(self, mock_stream):
+        mock_stream.return_value = iter(["foo", "bar"])
         lt = self.om.get_logtrace("1234")
-        self.assertEqual(lt, "foo")
+        self.assertEqual(lt, "foo\nbar")
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_logtrace_maxlines(self, mock_stream):
+        mock_stream.return_value = iter(map(str, range(10)))
+        lt = self.om.get_logtrace("1234", maxlines=3)
+        self.assertEqual(lt, "7\n8\n9")
 
-    def test_get_logtrace_exception(self):
-        self.mock_exec.side_effect = tse.ShellException()
+    @mock.patch("thrive.shell_executor.ShellExecutor.stream")
+    def test_get_logtrace_exception(self, mock_stream):
+        mock_stream.side_effect = tse.ShellException()
         with self.assertRaises(Exception):
             _ = self.om.get_logtrace("1234")
 
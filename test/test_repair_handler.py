@@ -0,0 +1,66 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import mock
+import thrive.repair_handler as trh
+import thrive.exceptions as thex
+
+
+class TestRepairHandler(unittest.TestCase):
+    def setUp(self):
+        self.config_loader_patcher = mock.patch("thrive.thrive_handler.ConfigLoader")
+        self.mock_config_loader = self.config_loader_patcher.start()
+
+        self.md_patcher = mock.patch("thrive.thrive_handler.MetadataManager")
+        self.mock_mm = self.md_patcher.start()
+
+        self.hdfs_patcher = mock.patch("thrive.thrive_handler.HdfsManager")
+        self.mock_hdfs = self.hdfs_patcher.start()
+
+        self.hive_patcher = mock.patch("thrive.thrive_handler.HiveManager")
+        self.mock_hive = self.hive_patcher.start()
+
+        self.vertica_patcher = mock.patch("thrive.thrive_handler.VerticaManager")
+        self.mock_vtica = self.vertica_patcher.start()
+
+        self.shell_patcher = mock.patch("thrive.thrive_handler.ShellExecutor")
+        self.mock_shell = self.shell_patcher.start()
+
+        self.th_get_config_patcher = mock.patch("thrive.thrive_handler.ThriveHandler.get_config")
+        self.mock_get_config = self.th_get_config_patcher.start()
+
+        self.rh = trh.RepairHandler(datacfg_file="foo", envcfg_file="bar")
+
+        self.config_value = "foo"
+        self.mock_get_config.return_value = self.config_value
+
+    def tearDown(self):
+        self.config_loader_patcher.stop()
+        self.md_patcher.stop()
+        self.hdfs_patcher.stop()
+        self.hive_patcher.stop()
+        self.vertica_patcher.stop()
+        self.shell_patcher.stop()
+        self.th_get_config_patcher.stop()
+
+    def test_execute(self):
+        self.rh.execute()
+        hdfs_mgr = self.mock_hdfs.return_value
+        hdfs_mgr.grantall.assert_called_with("rx", self.config_value)
+
+    def test_execute_exception(self):
+        self.mock_hdfs.return_value.grantall.side_effect = thex.HdfsManagerException()
+        with self.assertRaises(thex.RepairHandlerException):
+            self.rh.execute()
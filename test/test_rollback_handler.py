@@ -16,6 +16,7 @@
 import unittest
 import mock
 import thrive.rollback_handler as trh
+import thrive.exceptions as thex
 from test.utils.utils import make_tempfile, tempfile_write
 
 
@@ -29,6 +30,7 @@ class TestRollbackHandler(unittest.TestCase):
 
         self.hdfs_patcher = mock.patch("thrive.thrive_handler.HdfsManager")
         self.mock_hdfs = self.hdfs_patcher.start()
+        self.mock_hdfs.return_value.partfiles.return_value = ["part-00000.gz"]
 
         self.hive_patcher = mock.patch("thrive.thrive_handler.HiveManager")
         self.mock_hive = self.hive_patcher.start()
@@ -92,7 +94,7 @@ class TestRollbackHandler(unittest.TestCase):
         vmgr = self.mock_vtica.return_value
         vmgr.clone_schema.assert_called_with(cv, cv, cv, "%s__rollback__" % cv)
 
-    def test_execute_HdfsManager_path_exists_calls(self):
+    def test_execute_HdfsManager_paths_exist_call(self):
         cv = self.config_value
         tf = make_tempfile()
         tempfile_write(tf, self.ptn_file_contents)
@@ -100,9 +102,8 @@ class TestRollbackHandler(unittest.TestCase):
                                  resources_file="baz.zip", partitions_file=tf.name)
         rh.execute()
         hdfs_paths = ["%s/%s" % (cv, ptn) for ptn in self.ptns]
-        path_exist_calls = [mock.call(s) for s in hdfs_paths]
         hdfs_mgr = self.mock_hdfs.return_value
-        self.assertEqual(path_exist_calls, hdfs_mgr.path_exists.call_args_list)
+        hdfs_mgr.paths_exist.assert_called_once_with(hdfs_paths)
 
     @mock.patch("thrive.load_handler.LoadHandler.vload_copy")
     def test_execute_LoadHandler_vload_copy_direct_calls(self, mock_vcopy):
@@ -117,6 +118,18 @@ class TestRollbackHandler(unittest.TestCase):
                       for p in self.ptns]
         mock_vcopy.assert_has_calls(copy_calls)
 
+    @mock.patch("thrive.load_handler.LoadHandler.vload_copy")
+    def test_execute_LoadHandler_vload_copy_partfiles_mode(self, mock_vcopy):
+        cv = self.config_value
+        tf = make_tempfile()
+        tempfile_write(tf, self.ptn_file_contents)
+        self.mock_hdfs.return_value.partfiles.return_value = ["part-00000.bz2"]
+        rh = trh.RollbackHandler(datacfg_file="foo", envcfg_file="bar",
+                                 resources_file="baz.zip", partitions_file=tf.name)
+        rh.execute()
+        self.assertEqual(mock_vcopy.call_count, len(self.ptns))
+        mock_vcopy.assert_called_with(self.ptns[-1], cv, "%s__rollback__" % cv, mode="bzip")
+
     def test_execute_VerticaManager_rollback_calls(self):
         cv = self.config_value
         tf = make_tempfile()
@@ -131,6 +144,31 @@ class TestRollbackHandler(unittest.TestCase):
         vmgr = self.mock_vtica.return_value
         vmgr.rollback.assert_has_calls(rollback_calls)
 
+    def test_execute_VerticaManager_drop_rollback_partitions_aligned(self):
+        cv = self.config_value
+        tf = make_tempfile()
+        tempfile_write(tf, self.ptn_file_contents)
+        vmgr = self.mock_vtica.return_value
+        vmgr.drop_rollback_partitions.return_value = []
+        rh = trh.RollbackHandler(datacfg_file="foo", envcfg_file="bar",
+                                 resources_file="baz.zip", partitions_file=tf.name)
+        rh.execute()
+        vmgr.drop_rollback_partitions.assert_called_with(cv, cv, cv, "%s__rollback__" % cv,
+                                                         cv, rkey=cv)
+        self.assertFalse(vmgr.rollback.called)
+
+    def test_execute_VerticaManager_no_partition_expr(self):
+        tf = make_tempfile()
+        tempfile_write(tf, self.ptn_file_contents)
+        self.mock_get_config.side_effect = \
+            lambda key, *args, **kwargs: "" if key == "vertica_partition_expr" else "foo"
+        rh = trh.RollbackHandler(datacfg_file="foo", envcfg_file="bar",
+                                 resources_file="baz.zip", partitions_file=tf.name)
+        rh.execute()
+        vmgr = self.mock_vtica.return_value
+        self.assertFalse(vmgr.drop_rollback_partitions.called)
+        self.assertEqual(vmgr.rollback.call_count, len(self.ptns))
+
     def test_execute_VerticaManager_truncate_calls(self):
         cv = self.config_value
         tf = make_tempfile()
@@ -174,10 +212,23 @@ class TestRollbackHandler(unittest.TestCase):
         rh = trh.RollbackHandler(datacfg_file="foo", envcfg_file="bar",
                                  resources_file="baz.zip", partitions_file=tf.name)
         rh.execute()
-        md_delete_calls = [mock.call(cv, mdcolname="hive_last_partition", mdcolvalue=p)
-                           for p in self.ptns]
         md_mgr = self.mock_mm.return_value
-        md_mgr.delete.assert_has_calls(md_delete_calls)
+        md_mgr.delete_many.assert_called_once_with(cv, mdcolname="hive_last_partition",
+                                                   mdcolvalues=self.ptns)
+
+    def test_execute_MetadataManager_delete_partitions_rolled_back(self):
+        cv = self.config_value
+        tf = make_tempfile()
+        tempfile_write(tf, self.ptn_file_contents)
+        hive_mgr = self.mock_hive.return_value
+        hive_mgr.drop_partition.side_effect = [None, thex.HiveManagerException()]
+        rh = trh.RollbackHandler(datacfg_file="foo", envcfg_file="bar",
+                                 resources_file="baz.zip", partitions_file=tf.name)
+        with self.assertRaises(thex.RollbackHandlerException):
+            rh.execute()
+        md_mgr = self.mock_mm.return_value
+        md_mgr.delete_many.assert_called_once_with(cv, mdcolname="hive_last_partition",
+                                                   mdcolvalues=self.ptns[:1])
 
     def test_execute_VerticaManager_drop_table_call(self):
         cv = self.config_value
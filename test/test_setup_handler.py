@@ -205,12 +205,11 @@ class TestSetupHandler(unittest.TestCase):
         shell_calls = [mock.call("mkdir -p %s" % configval),
                        mock.call("mkdir -p %s" % configval),
                        mock.call("mkdir -p %s" % configval),
-                       mock.call("chmod a+rx %s" % configval),
-                       mock.call("chmod a+r foo"),
-                       mock.call("chmod a+r bar"),
-                       mock.call("chmod a+x foo"),
-                       mock.call("chmod a+x bar")]
+                       mock.call("chmod a+rx %s" % configval)]
         shexec.assert_has_calls(shell_calls)
+        batch_calls = [mock.call(["chmod a+r foo", "chmod a+r bar"]),
+                       mock.call(["chmod a+x foo", "chmod a+x bar"])]
+        self.mock_shell.return_value.safe_execute_batch.assert_has_calls(batch_calls)
 
     def test_setup_hive(self):
         shexec = self.mock_shell.return_value.safe_execute
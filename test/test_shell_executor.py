@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import unittest
+import mock
 import thrive.shell_executor as shell_exec
 
 
@@ -69,6 +70,140 @@ class TestShellExecutor(unittest.TestCase):
         with self.assertRaises(shell_exec.ShellException):
             self.exec_.safe_execute(cmd)
 
+    def test_stream(self):
+        lines = list(self.exec_.stream("seq 1 5"))
+        self.assertListEqual(lines, ["1", "2", "3", "4", "5"])
+
+    def test_stream_nonzero_retcode(self):
+        with self.assertRaises(shell_exec.ShellException):
+            list(self.exec_.stream("ls doesnotexist"))
+
+    def test_stream_shell_exception(self):
+        with self.assertRaises(shell_exec.ShellException):
+            list(self.exec_.stream("notacommand"))
+
+    def test_stream_early_exit(self):
+        stream = self.exec_.stream("yes foo")
+        self.assertEqual(next(stream), "foo")
+        stream.close()
+
+    def test_execute_batch(self):
+        results = self.exec_.execute_batch(["echo %d" % i for i in range(10)] +
+                                           ["ls doesnotexist"], workers=4)
+        self.assertListEqual([r.output for r in results[:-1]],
+                             ["%d\n" % i for i in range(10)])
+        self.assertNotEqual(results[-1].retcode, 0)
+
+    def test_execute_batch_empty(self):
+        self.assertListEqual(self.exec_.execute_batch([]), [])
+
+    def test_safe_execute_batch(self):
+        results = self.exec_.safe_execute_batch(["echo foo", "echo bar"])
+        self.assertListEqual([r.output for r in results], ["foo\n", "bar\n"])
+
+    def test_safe_execute_batch_failures(self):
+        cmds = ["echo foo", "ls doesnotexist", "notacommand"]
+        with self.assertRaises(shell_exec.ShellBatchException) as cm:
+            self.exec_.safe_execute_batch(cmds)
+        self.assertListEqual(cm.exception.failed, cmds[1:])
+
+    def test_command_tag(self):
+        cmds = {
+            "hadoop fs -ls /foo": "hdfs.ls",
+            "hadoop fs -mkdir -p /foo": "hdfs.mkdir",
+            '''hive -e "use db; alter table t add partition (year = '2016')" ''': "hive.add_partition",
+            '''hive -e "use db; alter table t drop if exists partition (year = '2016')"''': "hive.drop_partition",
+            ''' hive -e "use db; show partitions t" ''': "hive.show_partitions",
+            "hive -f /foo/ddl.sql": "hive.script",
+            '''kinit -kt k u && /opt/vertica/bin/vsql -h h -c "COPY s.t SOURCE Hdfs()" ''': "vertica.copy",
+            "/opt/vertica/bin/vsql -h h -f '/foo/ddl.sql'": "vertica.script",
+            "oozie job -info 12-34@parse-json -verbose": "oozie.info",
+            "oozie job -config foo.properties -run": "oozie.run",
+            "curl --negotiate -u:foo 'http://nn/webhdfs/v1/user/foo?op=GETFILESTATUS' ": "webhdfs.getfilestatus",
+            "curl -k -u a:b --request DELETE https://splunk/foo": "curl.delete",
+            "mkdir -p /foo": "shell.mkdir"
+        }
+        for cmd, tag in cmds.items():
+            self.assertEqual(shell_exec.command_tag(cmd), tag)
+
+    def test_command_stats(self):
+        stats = shell_exec.CommandStats()
+        for i in range(1, 21):
+            stats.record("hadoop fs -ls /foo", float(i), 0, 10)
+        stats.record("oozie job -info 12-34", 1.0, 1, 0)
+        summary = stats.summary()
+        self.assertDictEqual(summary["hdfs.ls"],
+                             {"count": 20, "failures": 0, "output_bytes": 200,
+                              "total_secs": 210.0, "p50_secs": 10.0, "p95_secs": 19.0})
+        self.assertEqual(summary["oozie.info"]["failures"], 1)
+        stats.reset()
+        self.assertDictEqual(stats.summary(), {})
+
+    def test_command_stats_timed(self):
+        stats = shell_exec.CommandStats()
+        with stats.timed("vertica.copy"):
+            pass
+        with self.assertRaises(ValueError):
+            with stats.timed("vertica.copy"):
+                raise ValueError()
+        summary = stats.summary()
+        self.assertEqual(summary["vertica.copy"]["count"], 2)
+        self.assertEqual(summary["vertica.copy"]["failures"], 1)
+
+    def test_execute_records_stats(self):
+        shell_exec.command_stats.reset()
+        self.exec_.execute("echo foo")
+        list(self.exec_.stream("echo foo"))
+        summary = shell_exec.command_stats.summary()
+        self.assertEqual(summary["shell.echo"]["count"], 2)
+        self.assertEqual(summary["shell.echo"]["output_bytes"], 8)
+
+    def test_command_cache_disabled(self):
+        compute = mock.Mock(return_value="foo")
+        cache = shell_exec.CommandCache()
+        cache.get("hadoop fs -ls /foo", ["/foo"], compute)
+        cache.get("hadoop fs -ls /foo", ["/foo"], compute)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_command_cache_normalized_key(self):
+        compute = mock.Mock(return_value="foo")
+        cache = shell_exec.CommandCache()
+        cache.enable()
+        self.assertEqual(cache.get("hadoop fs -ls /foo", ["/foo"], compute), "foo")
+        self.assertEqual(cache.get(" hadoop  fs -ls\n/foo ", ["/foo"], compute), "foo")
+        self.assertEqual(compute.call_count, 1)
+
+    def test_command_cache_exception(self):
+        compute = mock.Mock(side_effect=shell_exec.ShellException())
+        cache = shell_exec.CommandCache()
+        cache.enable()
+        for _ in range(2):
+            with self.assertRaises(shell_exec.ShellException):
+                cache.get("hadoop fs -test -e /foo", ["/foo"], compute)
+        self.assertEqual(compute.call_count, 1)
+
+    def test_command_cache_invalidate(self):
+        cache = shell_exec.CommandCache()
+        cache.enable()
+        paths = ["/foo", "/foo/bar", "/foo/bar/baz", "/foo/barbaz", "/qux"]
+        for path in paths:
+            cache.get("hadoop fs -ls %s" % path, [path], lambda: 1)
+        cache.invalidate("/foo/bar/")
+        compute = mock.Mock(return_value=2)
+        recomputed = [p for p in paths
+                      if cache.get("hadoop fs -ls %s" % p, [p], compute) == 2]
+        self.assertListEqual(recomputed, ["/foo", "/foo/bar", "/foo/bar/baz"])
+
+    def test_command_cache_disable(self):
+        compute = mock.Mock(return_value="foo")
+        cache = shell_exec.CommandCache()
+        cache.enable()
+        cache.get("hadoop fs -ls /foo", ["/foo"], compute)
+        cache.disable()
+        cache.enable()
+        cache.get("hadoop fs -ls /foo", ["/foo"], compute)
+        self.assertEqual(compute.call_count, 2)
+
     def test_shell_result_all_args(self):
         self.assertEqual(shell_exec.ShellResult("123", "456", "789").__repr__(),
                          "retcode = 123\noutput = 456\nerror = 789")
@@ -0,0 +1,69 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+import thrive.source_index as tsi
+from test.utils.utils import make_tempfile, tempfile_write
+
+
+class TestSourceDirIndex(unittest.TestCase):
+    def setUp(self):
+        self.dirs = ["d_20160812-%s" % i for i in range(1400, 1460, 10)]
+        self.indexfile = "__test__source_dirs.idx"
+
+    def tearDown(self):
+        if os.path.exists(self.indexfile):
+            os.remove(self.indexfile)
+
+    def test_dirkey(self):
+        self.assertEqual(tsi.dirkey("d_20150311-1610"), "201503111610")
+
+    def test_missing_file(self):
+        index = tsi.SourceDirIndex(self.indexfile)
+        self.assertEqual(len(index), 0)
+        self.assertIsNone(index.latest())
+
+    def test_load(self):
+        tf = make_tempfile()
+        tempfile_write(tf, "\n".join(reversed(self.dirs)))
+        index = tsi.SourceDirIndex(tf.name)
+        self.assertListEqual(index.dirs, self.dirs)
+        self.assertEqual(index.latest(), self.dirs[-1])
+
+    def test_add(self):
+        index = tsi.SourceDirIndex(self.indexfile)
+        self.assertEqual(index.add(self.dirs[3:]), 3)
+        self.assertEqual(index.add(self.dirs + ["_SUCCESS", "foo"]), 3)
+        self.assertListEqual(index.dirs, self.dirs)
+
+    def test_after(self):
+        index = tsi.SourceDirIndex(self.indexfile)
+        index.add(self.dirs)
+        self.assertListEqual(index.after(self.dirs[2]), self.dirs[3:])
+        self.assertListEqual(index.after(None), self.dirs)
+        self.assertListEqual(index.after(self.dirs[-1]), [])
+
+    def test_after_lastdir_not_indexed(self):
+        index = tsi.SourceDirIndex(self.indexfile)
+        index.add(self.dirs)
+        self.assertListEqual(index.after("d_20160812-1405"), self.dirs[1:])
+        self.assertListEqual(index.after("d_20160101-0000"), self.dirs)
+
+    def test_save(self):
+        index = tsi.SourceDirIndex(self.indexfile)
+        index.add(self.dirs)
+        index.save()
+        self.assertListEqual(tsi.SourceDirIndex(self.indexfile).dirs, self.dirs)
+        self.assertFalse(os.path.exists("%s.tmp" % self.indexfile))
@@ -0,0 +1,204 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import unittest
+import mock
+import thrive.sqlite_metadata_manager as tsmm
+import thrive.thrive_handler as tth
+from thrive.metadata_manager import MetadataJournal
+from thrive.exceptions import MetadataManagerException
+from test.utils.utils import squeeze
+
+
+class TestSqliteMetadataManager(unittest.TestCase):
+    def setUp(self):
+        self.dbfile = "__test__metadata.sqlite"
+        self.credentials = {"dbtype": "sqlite", "dbname": self.dbfile}
+        self.mm = tsmm.SqliteMetadataManager(self.credentials)
+        self.mm.insert({"dataset_name": "foo", "locked": 0, "release_attempts": 0},
+                       mdtype="lock")
+
+    def tearDown(self):
+        self.mm.close()
+        os.remove(self.dbfile)
+
+    def load_row(self, hour, part="0", load_id="12345"):
+        return {"load_id": load_id,
+                "load_type": "scheduled",
+                "dataset_name": "foo",
+                "hive_db": "hdb",
+                "hive_table": "htable",
+                "hive_start_ts": "2016-08-19 %s:10:00" % hour,
+                "hive_end_ts": "2016-08-19 %s:20:00" % hour,
+                "last_load_folder": "d_20160819-%s10" % hour,
+                "hive_last_partition": "2016/08/19/%s/%s" % (hour, part),
+                "hadoop_records_processed": 50,
+                "hive_rows_loaded": 100}
+
+    def test_schema_created(self):
+        self.assertEqual(self.mm.get_schema_version(), 3)
+
+    def test_migrate_retried_after_partial_failure(self):
+        # Statements run before a migration failed stay applied
+        self.mm.execute("delete from thrive_schema_version where version >= 2;")
+        self.mm.execute("drop table thrive_dataset_state;")
+        self.mm.migrate(tsmm.read_migrations(os.path.join(tsmm.MD_DIR, "migrations")))
+        self.assertEqual(self.mm.get_schema_version(), 3)
+        self.assertTrue(self.mm.table_exists("thrive_dataset_state"))
+
+    def test_schema_kept_on_reopen(self):
+        self.mm.close()
+        self.mm = tsmm.SqliteMetadataManager(self.credentials)
+        self.assertEqual(self.mm.get_lock_status("foo"), (0, 0))
+
+    def test_translate_index(self):
+        stmt = "create index idx on thrive_load_metadata (hive_db(100), load_type);"
+        self.assertListEqual(self.mm.translate(stmt),
+                             ["create index idx on thrive_load_metadata (hive_db, load_type)"])
+
+    def test_translate_alter_table(self):
+        stmt = "alter table t add column a varchar(200) default null, add column b timestamp"
+        self.assertListEqual(self.mm.translate(stmt),
+                             ["alter table t add column a varchar(200) default null",
+                              "alter table t add column b timestamp"])
+
+    def test_translate_upsert(self):
+        stmt = "insert into thrive_dataset_state (dataset_name, hive_table, state_key, " \
+               "state_value) values (?, ?, ?, ?) " \
+               "on duplicate key update state_value = values(state_value);"
+        self.assertEqual(squeeze(self.mm.translate(stmt)[0]),
+                         squeeze("insert into thrive_dataset_state (dataset_name, "
+                                 "hive_table, state_key, state_value) values (?, ?, ?, ?) "
+                                 "on conflict (dataset_name, hive_table, state_key) "
+                                 "do update set state_value = excluded.state_value"))
+
+    def test_lock(self):
+        self.assertTrue(self.mm.acquire_lock("foo", "holder1", 900))
+        self.assertFalse(self.mm.acquire_lock("foo", "holder2", 900))
+        self.assertTrue(self.mm.renew_lock("foo", "holder1", 900))
+        self.assertFalse(self.mm.renew_lock("foo", "holder2", 900))
+        self.mm.release("foo", holder="holder2")
+        self.assertEqual(self.mm.get_lock_status("foo"), (1, 0))
+        self.mm.release("foo", holder="holder1")
+        self.assertEqual(self.mm.get_lock_status("foo"), (0, 0))
+
+    def test_lock_lease_expired(self):
+        self.assertTrue(self.mm.acquire_lock("foo", "holder1", -60))
+        self.assertTrue(self.mm.acquire_lock("foo", "holder2", 900))
+        self.assertFalse(self.mm.renew_lock("foo", "holder1", 900))
+
+    def test_record_loads(self):
+        rows = [self.load_row("14"), self.load_row("15")]
+        self.mm.record_loads(rows)
+        self.mm.record_loads(rows)
+        self.assertEqual(self.mm.get_lastdir("foo", "htable", "scheduled"),
+                         "d_20160819-1510")
+        self.assertEqual(self.mm.get_next_part("foo", "htable", "2016/08/19/14"), 1)
+        self.assertEqual(len(self.mm.get_unprocessed_partitions("hdb", "htable")), 2)
+
+    def test_next_part_not_decreased(self):
+        self.mm.record_loads([self.load_row("14", part="3")])
+        self.mm.record_loads([self.load_row("14", part="1", load_id="67890")])
+        self.assertEqual(self.mm.get_next_part("foo", "htable", "2016/08/19/14"), 4)
+
+    def test_unprocessed_partitions(self):
+        self.mm.record_loads([self.load_row("14"), self.load_row("15")])
+        self.mm.update(("12345", "2016/08/19/14/0"),
+                       {"vertica_last_partition": "2016/08/19/14/0", "status": "SUCCESS"},
+                       mdtype="load")
+        self.assertListEqual(self.mm.get_unprocessed_partitions("hdb", "htable"),
+                             [("12345", "2016/08/19/15/0", 100, 50)])
+
+    def test_lastdir_after_delete(self):
+        self.mm.record_loads([self.load_row("14"), self.load_row("15")])
+        self.mm.delete("foo", "hive_last_partition", "2016/08/19/15/0")
+        self.assertEqual(self.mm.get_lastdir("foo", "htable", "scheduled"),
+                         "d_20160819-1410")
+
+    def test_purge(self):
+        self.mm.record_loads([self.load_row("14")])
+        self.mm.purge("foo")
+        self.assertIsNone(self.mm.get_state("foo", "htable", "lastdir:scheduled"))
+        self.assertListEqual(self.mm.get_unprocessed_partitions("hdb", "htable"), [])
+        with self.assertRaises(MetadataManagerException):
+            self.mm.get_lock_status("foo")
+
+    def test_duplicate_insert_exception(self):
+        self.mm.insert(self.load_row("14"), mdtype="load")
+        with self.assertRaises(MetadataManagerException):
+            self.mm.insert(self.load_row("14"), mdtype="load")
+
+
+class TestSqliteMetadataEndToEnd(unittest.TestCase):
+    """
+    Load metadata written through the journal to the SQLite backend of a
+    ThriveHandler, under the load_id generated by the handler
+    """
+    def setUp(self):
+        self.dbfile = "__test__metadata.sqlite"
+        self.journalfile = "__test__metadata.journal"
+        configs = {"dbtype": "sqlite", "dbname": self.dbfile}
+        self.config_loader_patcher = mock.patch("thrive.thrive_handler.ConfigLoader")
+        mock_config_loader = self.config_loader_patcher.start()
+        mock_config_loader.return_value.get_config.side_effect = \
+            lambda section, config: configs.get(config, "foo")
+
+        self.th = tth.ThriveHandler(datacfg_file="foo", envcfg_file="bar")
+        self.mm = self.th.metadata_mgr
+        self.load_id = self.th.load_id
+        self.hiveptn = "2016/08/19/14/0"
+        self.load = {"load_id": self.load_id,
+                     "load_type": "scheduled",
+                     "dataset_name": "foo",
+                     "hive_db": "hdb",
+                     "hive_table": "htable",
+                     "hive_start_ts": "2016-08-19 14:10:00",
+                     "hive_end_ts": "2016-08-19 14:20:00",
+                     "last_load_folder": "d_20160819-1410",
+                     "hive_last_partition": self.hiveptn,
+                     "hadoop_records_processed": 50,
+                     "hive_rows_loaded": 100}
+
+    def tearDown(self):
+        self.config_loader_patcher.stop()
+        self.mm.close()
+        for path in [self.dbfile, self.journalfile]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_backend(self):
+        self.assertIsInstance(self.mm, tsmm.SqliteMetadataManager)
+
+    def test_journal_commit(self):
+        journal = MetadataJournal(self.mm, self.journalfile)
+        journal.record_loads([self.load])
+        journal.commit()
+        self.assertListEqual(self.mm.get_unprocessed_partitions("hdb", "htable"),
+                             [(self.load_id, self.hiveptn, 100, 50)])
+
+        journal.update_loads([((self.load_id, self.hiveptn),
+                               {"vertica_last_partition": self.hiveptn,
+                                "status": "SUCCESS"})])
+        journal.commit()
+        self.assertListEqual(self.mm.get_unprocessed_partitions("hdb", "htable"), [])
+        self.assertEqual(self.mm.get_lastdir("foo", "htable", "scheduled"),
+                         "d_20160819-1410")
+        self.assertFalse(os.path.exists(self.journalfile))
+
+    def test_journal_replay(self):
+        MetadataJournal(self.mm, self.journalfile).record_loads([self.load])
+        self.assertTrue(MetadataJournal(self.mm, self.journalfile).replay())
+        self.assertListEqual(self.mm.get_unprocessed_partitions("hdb", "htable"),
+                             [(self.load_id, self.hiveptn, 100, 50)])
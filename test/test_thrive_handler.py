@@ -65,6 +65,15 @@ class TestThriveHandler(unittest.TestCase):
         md_credentials = dict([(cred, cv) for cred in credtypes])
         self.mock_mm.assert_called_with(credentials=md_credentials)
 
+    @mock.patch("thrive.thrive_handler.SqliteMetadataManager")
+    def test_init_SqliteMetadataManager_instantiation(self, mock_smm):
+        self.mcl.get_config.side_effect = lambda section, config: \
+            "SQLite" if config == "dbtype" else self.config_value
+        th = tth.ThriveHandler(datacfg_file="foo", envcfg_file="bar",
+                               resources_file="baz.zip")
+        mock_smm.assert_called_with(credentials={"dbtype": "SQLite", "dbname": "foo"})
+        self.assertIs(th.metadata_mgr, mock_smm.return_value)
+
     def test_init_ShellExecutor_instantiation(self):
         self.mock_shell.assert_called_with()
 
@@ -85,7 +94,14 @@ class TestThriveHandler(unittest.TestCase):
         self.mock_uuid.uuid1.assert_called_with()
 
     def test_init_load_id_val(self):
-        self.assertTrue(self.th.load_id, "12345")
+        self.assertEqual(self.th.load_id, "12345")
+
+    def test_init_load_id_str(self):
+        self.uuid_patcher.stop()
+        th = tth.ThriveHandler(datacfg_file="foo", envcfg_file="bar",
+                               resources_file="baz.zip")
+        self.uuid_patcher.start()
+        self.assertIsInstance(th.load_id, str)
 
     def test_init_exception(self):
         with self.assertRaises(tth.ThriveHandlerException):
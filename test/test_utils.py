@@ -35,6 +35,7 @@ class TestUtils(unittest.TestCase):
         mm.returncode = 0
 
         mock_logger = mock_logging.getLogger.return_value
+        mock_logger.handlers = []
         mock_logging.INFO = "foo"
         configs = "[main]\nnfs_log_path=/path/to/foo\ndataset_name=dsfoo\n"
         tf = make_tempfile()
@@ -146,6 +147,16 @@ class TestUtils(unittest.TestCase):
     def test_percentdiff_zero_division(self):
         self.assertEqual(tu.percentdiff(100, 0), 0.0)
 
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(tu.percentile(values, 50), 50)
+        self.assertEqual(tu.percentile(values, 95), 95)
+        self.assertEqual(tu.percentile([3, 1, 2], 50), 2)
+        self.assertEqual(tu.percentile([7], 95), 7)
+
+    def test_percentile_empty(self):
+        self.assertIsNone(tu.percentile([], 50))
+
     def test_chunk_dirs_hour(self):
         dirlist = ["d_20160606-2010", "d_20160606-2010",
                    "d_20160606-2100", "d_20160606-2210"]
@@ -176,3 +187,21 @@ class TestUtils(unittest.TestCase):
                    "d_20160707-2100", "d_20160707-2210"]
         with self.assertRaises(RuntimeError):
             _ = tu.chunk_dirs(dirlist, groupby="foo")
+
+    def test_read_sql_script(self):
+        tf = make_tempfile(suffix=".sql")
+        tempfile_write(tf, "-- comment; not a statement\n"
+                           "create index i on t (a);\n"
+                           "\n"
+                           "create index j\n  on t (b);\n")
+        self.assertListEqual(tu.read_sql_script(tf.name),
+                             ["create index i on t (a)", "create index j\n  on t (b)"])
+
+    @mock.patch("thrive.utils.read_sql_script")
+    @mock.patch("thrive.utils.os.listdir")
+    def test_read_migrations(self, mock_listdir, mock_read_script):
+        mock_listdir.return_value = ["010_foo.sql", "README", "002_bar.sql", "3_baz.txt"]
+        mock_read_script.side_effect = lambda path: [path]
+        self.assertListEqual(tu.read_migrations("mdir"),
+                             [(2, "bar", ["mdir/002_bar.sql"]),
+                              (10, "foo", ["mdir/010_foo.sql"])])
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import re
 import unittest
 import mock
 import thrive.vertica_manager as tvm
@@ -67,6 +68,14 @@ class TestVerticaManager(unittest.TestCase):
                                              as_shell=True, splitcmd=False,
                                              verbose=False)
 
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_execute_stmt_list(self, mock_safe_execute):
+        self.tvm.execute(["drop table if exists s.t", "create table s.t (a int)"])
+        mock_safe_execute.assert_called_with('%s -c "drop table if exists s.t; '
+                                             'create table s.t (a int);" ' % self.vsql,
+                                             as_shell=True, splitcmd=False,
+                                             verbose=False)
+
     @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
     def test_execute_file(self, mock_safe_execute):
         scriptfile = "/foo/bar.sql"
@@ -119,10 +128,9 @@ class TestVerticaManager(unittest.TestCase):
         srcschema, srctable = "schema_foo", "table_foo"
         dstschema, dsttable = "schema_bar", "table_bar"
         self.tvm.clone_schema(srcschema, srctable, dstschema, dsttable)
-        vsql_stmt = "drop table if exists %s.%s; create table %s.%s as select * from %s.%s where false;" \
-                    % (dstschema, dsttable,
-                       dstschema, dsttable,
-                       srcschema, srctable)
+        vsql_stmt = ["drop table if exists %s.%s" % (dstschema, dsttable),
+                     "create table %s.%s as select * from %s.%s where false"
+                     % (dstschema, dsttable, srcschema, srctable)]
         mock_vexec.assert_called_with(stmt=vsql_stmt)
 
     @mock.patch("thrive.vertica_manager.VerticaManager.execute")
@@ -156,6 +164,170 @@ class TestVerticaManager(unittest.TestCase):
         nrows = self.tvm.load("foo", "bar", "foo", "bar", "foo", "decompress")
         self.assertEqual(nrows, "3100")
 
+    @mock.patch("thrive.vertica_manager.VerticaManager.query")
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute_count")
+    def test_load_many(self, mock_vexec, mock_query):
+        mock_vexec.return_value = "35"
+        mock_query.return_value = [("http://nn/webhdfs/v1/foo/14/0/part-00000.gz", "10"),
+                                   ("http://nn/webhdfs/v1/foo/14/10/part-00000.gz", "20"),
+                                   ("http://nn/webhdfs/v1/foo/14/0/part-00001.gz", "5")]
+        nrows = self.tvm.load_many("http://nn/webhdfs/v1", ["/foo/14/0", "/foo/14/1",
+                                                            "/foo/14/10"],
+                                   "vschema", "dtable", "rtable")
+        self.assertListEqual(nrows, [15, 0, 20])
+        copy_cmd = mock_vexec.call_args[0][0]
+        self.assertIn("url='http://nn/webhdfs/v1/foo/14/0/*,http://nn/webhdfs/v1/foo/14/1/*,"
+                      "http://nn/webhdfs/v1/foo/14/10/*'", copy_cmd)
+        stream = re.search(r"STREAM NAME '(\w+)'", copy_cmd).group(1)
+        self.assertIn("stream_name = '%s'" % stream, mock_query.call_args[0][0])
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.query")
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute_count")
+    def test_load_many_unknown_source(self, mock_vexec, mock_query):
+        mock_vexec.return_value = "10"
+        mock_query.return_value = [("http://nn/webhdfs/v1/bar/part-00000.gz", "10")]
+        nrows = self.tvm.load_many("http://nn/webhdfs/v1", ["/foo/14/0"],
+                                   "vschema", "dtable", "rtable")
+        self.assertListEqual(nrows, [10])
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.query")
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute_count")
+    def test_load_many_sources_missing(self, mock_vexec, mock_query):
+        mock_vexec.return_value = "35"
+        mock_query.return_value = [("http://nn/webhdfs/v1/foo/14/0/part-00000.gz", "10")]
+        nrows = self.tvm.load_many("http://nn/webhdfs/v1", ["/foo/14/0", "/foo/14/1"],
+                                   "vschema", "dtable", "rtable")
+        self.assertListEqual(nrows, [10, 25])
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.query")
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute_count")
+    def test_load_many_sources_exception(self, mock_vexec, mock_query):
+        mock_vexec.return_value = "35"
+        mock_query.side_effect = VerticaManagerException()
+        nrows = self.tvm.load_many("http://nn/webhdfs/v1", ["/foo/14/0", "/foo/14/1"],
+                                   "vschema", "dtable", "rtable")
+        self.assertListEqual(nrows, [0, 35])
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.query")
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute_count")
+    def test_load_many_copy_exception(self, mock_vexec, mock_query):
+        mock_vexec.side_effect = VerticaManagerException()
+        with self.assertRaises(VerticaManagerException):
+            self.tvm.load_many("http://nn/webhdfs/v1", ["/foo/14/0", "/foo/14/1"],
+                               "vschema", "dtable", "rtable")
+        self.assertFalse(mock_query.called)
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.query")
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute_count")
+    def test_load_many_single_dir_sources_missing(self, mock_vexec, mock_query):
+        mock_vexec.return_value = "35"
+        mock_query.return_value = []
+        nrows = self.tvm.load_many("http://nn/webhdfs/v1", ["/foo/14/0"],
+                                   "vschema", "dtable", "rtable")
+        self.assertListEqual(nrows, [35])
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_query(self, mock_safe_exec):
+        mock_safe_exec.return_value = tse.ShellResult(0, "a|10\nb|20\n", "")
+        self.assertListEqual(self.tvm.query("select 1"), [("a", "10"), ("b", "20")])
+        mock_safe_exec.assert_called_with('%s -A -t -F "|" -c "select 1" ' % self.vsql,
+                                          verbose=False, as_shell=True, splitcmd=False)
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.query")
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute")
+    def test_drop_rollback_partitions(self, mock_vexec, mock_query):
+        mock_query.return_value = [("7", "100", "100"), ("8", "100", "40"), ("", "5", "5")]
+        remaining = self.tvm.drop_rollback_partitions("s", "t", "s", "t__rollback__",
+                                                      "extract(month from ts)",
+                                                      rkey="event_id")
+        self.assertListEqual(remaining, ["8", ""])
+        mock_vexec.assert_called_with(stmt=["select drop_partition('s.t', '7')"])
+        qry = mock_query.call_args[0][0]
+        self.assertIn("(extract(month from ts))::varchar as ptn_key", qry)
+        self.assertIn("select distinct event_id as rkey from s.t__rollback__", qry)
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.query")
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute")
+    def test_drop_rollback_partitions_none_aligned(self, mock_vexec, mock_query):
+        mock_query.return_value = [("8", "100", "40")]
+        remaining = self.tvm.drop_rollback_partitions("s", "t", "s", "t__rollback__",
+                                                      "extract(month from ts)",
+                                                      rkey="event_id")
+        self.assertListEqual(remaining, ["8"])
+        self.assertFalse(mock_vexec.called)
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.query")
+    def test_drop_rollback_partitions_exception(self, mock_query):
+        mock_query.side_effect = VerticaManagerException()
+        with self.assertRaises(VerticaManagerException):
+            self.tvm.drop_rollback_partitions("s", "t", "s", "t__rollback__",
+                                              "extract(month from ts)", rkey="event_id")
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute")
+    def test_create_staging_table(self, mock_vexec):
+        self.tvm.create_staging_table("s", "t", "t__staging__0")
+        mock_vexec.assert_called_with(stmt=["drop table if exists s.t__staging__0",
+                                            "create table s.t__staging__0 like s.t "
+                                            "including projections"])
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.query")
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute")
+    def test_publish_partitions(self, mock_vexec, mock_query):
+        mock_query.side_effect = [[("7", "12")], [("0",)]]
+        self.tvm.publish("s", "t__staging__0", "t", partition_expr="extract(month from ts)")
+        mock_query.assert_has_calls([
+            mock.call("select min(extract(month from ts)), max(extract(month from ts)) "
+                      "from s.t__staging__0"),
+            mock.call("select count(*) from s.t__staging__0")])
+        mock_vexec.assert_called_with(stmt="select move_partitions_to_table("
+                                           "'s.t__staging__0', '7', '12', 's.t')")
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.query")
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute")
+    def test_publish_partitions_left(self, mock_vexec, mock_query):
+        mock_query.side_effect = [[("7", "12")], [("25",)]]
+        with self.assertRaises(VerticaManagerException):
+            self.tvm.publish("s", "t__staging__0", "t",
+                             partition_expr="extract(month from ts)")
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.query")
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute")
+    def test_publish_empty_staging(self, mock_vexec, mock_query):
+        mock_query.return_value = [("", "")]
+        self.tvm.publish("s", "t__staging__0", "t", partition_expr="extract(month from ts)")
+        self.assertFalse(mock_vexec.called)
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute")
+    def test_publish_unpartitioned(self, mock_vexec):
+        self.tvm.publish("s", "t__staging__0", "t")
+        mock_vexec.assert_called_with(stmt=["insert /*+ direct */ into s.t select * "
+                                            "from s.t__staging__0", "commit"])
+
+    def test_copy_mode(self):
+        self.assertEqual(tvm.VerticaManager.copy_mode(
+            "org.apache.hadoop.io.compress.GzipCodec"), "direct")
+        self.assertEqual(tvm.VerticaManager.copy_mode(
+            "org.apache.hadoop.io.compress.BZip2Codec"), "bzip")
+        self.assertEqual(tvm.VerticaManager.copy_mode(
+            "org.apache.hadoop.io.compress.SnappyCodec"), "decompress")
+        self.assertEqual(tvm.VerticaManager.copy_mode(""), "plain")
+
+    def test_copy_mode_partfiles(self):
+        gzip = "org.apache.hadoop.io.compress.GzipCodec"
+        self.assertEqual(tvm.VerticaManager.copy_mode(gzip, ["/a/part-00000.bz2"]), "bzip")
+        self.assertEqual(tvm.VerticaManager.copy_mode(gzip, ["/a/part-00000"]), "plain")
+        self.assertEqual(tvm.VerticaManager.copy_mode(gzip, ["/a/part-00000.snappy"]),
+                         "decompress")
+        self.assertEqual(tvm.VerticaManager.copy_mode(gzip, ["/a/part-00000.gz",
+                                                              "/a/part-00001.bz2"]),
+                         "decompress")
+
+    @mock.patch("thrive.vertica_manager.VerticaManager.execute")
+    def test_load_bzip(self, mock_vexec):
+        mock_vexec.return_value = tse.ShellResult(0, "Rows Loaded\n-----\n3100\n", "")
+        self.tvm.load("foo", "bar", "foo", "bar", "foo", "bzip")
+        self.assertIn("FILTER BZIP()", mock_vexec.call_args[1]["stmt"])
+
     @mock.patch("thrive.vertica_manager.VerticaManager.execute")
     def test_load_wrong_mode(self, mock_vexec):
         with self.assertRaises(VerticaManagerException):
@@ -0,0 +1,143 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import mock
+import pyodbc
+import thrive.vertica_odbc_manager as tvom
+from thrive.odbc_pool import odbc_pool
+from thrive.exceptions import VerticaManagerException
+
+
+class TestVerticaOdbcManager(unittest.TestCase):
+    def setUp(self):
+        self.connection_info = {
+            "vertica_vsql_path": "/foo/vsql",
+            "vertica_krb_svcname": "krb_svcname",
+            "vertica_krb_host": "krb_host",
+            "vertica_host": "vertica_host",
+            "vertica_port": "vertica_port",
+            "vertica_db": "vertica_db",
+            "vertica_user": "vertica_user"
+        }
+        self.connect_patcher = mock.patch("thrive.odbc_pool.pyodbc.connect")
+        self.mock_connect = self.connect_patcher.start()
+        self.mock_cursor = self.mock_connect.return_value.cursor.return_value
+        self.mock_cursor.description = None
+        self.mock_cursor.rowcount = 0
+
+        self.tvom = tvom.VerticaOdbcManager(self.connection_info)
+
+    def tearDown(self):
+        odbc_pool.close()
+        self.connect_patcher.stop()
+
+    def test_connstr(self):
+        self.tvom.execute(stmt="select 1")
+        connstr = "DRIVER={Vertica};SERVERNAME=vertica_host;PORT=vertica_port;" \
+                  "DATABASE=vertica_db;UID=vertica_user;" \
+                  "KerberosServiceName=krb_svcname;KerberosHostName=krb_host"
+        self.mock_connect.assert_called_with(connstr, autocommit=True)
+
+    def test_execute_statements(self):
+        connection = self.mock_connect.return_value
+        self.tvom.execute(stmt=["drop table if exists s.t", "create table s.t (a int)"])
+        self.mock_cursor.execute.assert_has_calls([mock.call("drop table if exists s.t"),
+                                                   mock.call("create table s.t (a int)")])
+        connection.commit.assert_called_with()
+        self.assertTrue(connection.autocommit)
+
+    def test_execute_statements_rollback(self):
+        connection = self.mock_connect.return_value
+        self.mock_cursor.execute.side_effect = [None, pyodbc.ProgrammingError("42V01", "foo")]
+        with self.assertRaises(VerticaManagerException):
+            self.tvom.execute(stmt=["insert into s.t select * from s.u", "commit"])
+        connection.rollback.assert_called_with()
+        self.assertFalse(connection.commit.called)
+        self.assertTrue(connection.autocommit)
+
+    def test_execute_statement_not_split(self):
+        stmt = "copy s.t from stdin delimiter ';'"
+        self.tvom.execute(stmt=stmt)
+        self.mock_cursor.execute.assert_called_once_with(stmt)
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_execute_scriptfile(self, mock_safe_exec):
+        self.tvom.execute(scriptfile="foo.sql")
+        self.assertTrue(mock_safe_exec.call_args[0][0].endswith("-f 'foo.sql'"))
+        self.assertFalse(self.mock_connect.called)
+
+    def test_session_reuse(self):
+        self.tvom.execute(stmt="select 1")
+        self.tvom.truncate("s", "t")
+        self.assertEqual(self.mock_connect.call_count, 1)
+
+    def test_load_rows(self):
+        self.mock_cursor.description = [("Rows Loaded",)]
+        self.mock_cursor.fetchone.return_value = (3100,)
+        rows = self.tvom.load("http://namenode:50070/webhdfs/v1", "/foo/bar",
+                              "vschema", "dtable", "rtable")
+        self.assertEqual(rows, 3100)
+
+    def test_rollback_rows(self):
+        self.mock_cursor.rowcount = 42
+        rows = self.tvom.rollback("s", "t", "rs", "rt", rkey="event_id")
+        self.assertEqual(rows, 42)
+
+    @mock.patch("thrive.vertica_odbc_manager.command_stats")
+    def test_command_stats(self, mock_stats):
+        self.tvom.execute(stmt="copy s.t from stdin")
+        mock_stats.timed.assert_called_with("vertica.copy")
+
+    def test_execute_exception(self):
+        self.mock_cursor.execute.side_effect = pyodbc.ProgrammingError("42V01", "foo")
+        with self.assertRaises(VerticaManagerException):
+            self.tvom.execute(stmt="select 1")
+
+    def test_broken_session_not_reused(self):
+        self.mock_cursor.execute.side_effect = pyodbc.OperationalError("08S01", "foo")
+        with self.assertRaises(VerticaManagerException):
+            self.tvom.execute(stmt="select 1")
+        self.mock_cursor.execute.side_effect = None
+        self.tvom.execute(stmt="select 1")
+        self.assertEqual(self.mock_connect.call_count, 2)
+
+    def test_execute_text_result(self):
+        self.mock_cursor.description = [("move_partitions_to_table",)]
+        self.mock_cursor.fetchone.return_value = ("Moved 1 partition(s)",)
+        self.assertIsNone(self.tvom.execute(stmt="select move_partitions_to_table("
+                                                 "'s.t_stg', '1', '1', 's.t')"))
+
+    def test_publish_partitions(self):
+        self.mock_cursor.description = [("move_partitions_to_table",)]
+        self.mock_cursor.fetchall.side_effect = [[(7, 12)], [(0,)]]
+        self.mock_cursor.fetchone.return_value = ("1 distinct partition values moved",)
+        self.tvom.publish("s", "t_stg", "t", partition_expr="extract(month from ts)")
+        self.mock_cursor.execute.assert_any_call("select move_partitions_to_table("
+                                                 "'s.t_stg', '7', '12', 's.t')")
+
+    def test_drop_rollback_partitions(self):
+        self.mock_cursor.description = [("drop_partition",)]
+        self.mock_cursor.fetchall.return_value = [("2016-08-19", 10, 10)]
+        self.mock_cursor.fetchone.return_value = ("Partition dropped",)
+        kept = self.tvom.drop_rollback_partitions("s", "t", "rs", "rt", "ts::date",
+                                                  rkey="event_id")
+        self.assertListEqual(kept, [])
+        self.assertIn("drop_partition", self.mock_cursor.execute.call_args[0][0])
+
+    def test_execute_count_not_a_number(self):
+        self.mock_cursor.description = [("Rows Loaded",)]
+        self.mock_cursor.fetchone.return_value = ("foo",)
+        with self.assertRaises(VerticaManagerException):
+            self.tvom.execute_count("copy s.t from stdin")
@@ -0,0 +1,153 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import mock
+import datetime as dt
+import thrive.webhdfs_manager as twm
+import thrive.exceptions as thex
+from test.utils.fake_webhdfs import FakeWebHdfs
+from test.utils.utils import make_tempfile, tempfile_write
+
+
+class TestWebHdfsManager(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeWebHdfs().start()
+        self.wm = twm.WebHdfsManager(self.server.webhdfs_root, "userfoo")
+
+    def tearDown(self):
+        self.wm.close()
+        self.server.stop()
+
+    def test_makedir(self):
+        self.wm.makedir("/foo/bar")
+        self.assertIn("/foo/bar", self.server.fs)
+        self.assertEqual(self.server.fs["/foo"]["type"], "DIRECTORY")
+
+    def test_command_stats(self):
+        twm.command_stats.reset()
+        self.wm.makedir("/foo/bar")
+        self.wm.path_exists("/foo/baz")
+        summary = twm.command_stats.summary()
+        self.assertEqual(summary["hdfs.mkdirs"]["count"], 1)
+        self.assertEqual(summary["hdfs.getfilestatus"]["failures"], 0)
+
+    def test_path_exists(self):
+        self.wm.makedir("/foo/bar")
+        self.assertTrue(self.wm.path_exists("/foo/bar"))
+        self.assertFalse(self.wm.path_exists("/foo/baz"))
+
+    def test_rmdir(self):
+        self.wm.makedir("/foo/bar/baz")
+        self.wm.rmdir("/foo/bar")
+        self.assertNotIn("/foo/bar", self.server.fs)
+        self.assertNotIn("/foo/bar/baz", self.server.fs)
+        self.assertIn("/foo", self.server.fs)
+
+    def test_rmdir_nonexistent(self):
+        with self.assertRaises(thex.HdfsManagerException):
+            self.wm.rmdir("/foo/bar")
+
+    def test_putfile_into_directory(self):
+        tf = make_tempfile()
+        tempfile_write(tf, "mapper code")
+        self.wm.makedir("/foo/script")
+        self.wm.putfile(tf.name, "/foo/script")
+        target = "/foo/script/%s" % tf.name.rsplit("/", 1)[-1]
+        self.assertEqual(self.server.fs[target]["data"], "mapper code")
+
+    def test_path_exists_exception(self):
+        self.server.reject = 500
+        with self.assertRaises(thex.HdfsManagerException):
+            self.wm.path_exists("/foo")
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_grantall(self, mock_safe_execute):
+        self.wm.grantall("rx", "/foo")
+        mock_safe_execute.assert_called_with("hadoop fs -chmod -R a+rx /foo")
+        self.assertListEqual(self.server.requests, [])
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_grant_partition(self, mock_safe_execute):
+        self.wm.makedir("/foo/2016/08/12/14/0/data")
+        self.wm.makedir("/foo/2015/01")
+        granted = set()
+        self.wm.grant_partition("rx", "/foo/2016/08/12/14/0", "/foo", granted)
+        fs = self.server.fs
+        mock_safe_execute.assert_called_with("hadoop fs -chmod -R a+rx /foo/2016/08/12/14/0")
+        self.assertEqual(fs["/foo/2016/08/12/14"]["permission"], "755")
+        self.assertEqual(fs["/foo"]["permission"], "755")
+        self.assertEqual(fs["/foo/2015"]["permission"], "750")
+        self.assertIn("/foo/2016/08", granted)
+
+    def test_get_subdirs(self):
+        for ptn in ["0", "1", "12"]:
+            self.wm.makedir("/foo/2016/08/12/14/%s" % ptn)
+        subdirs = self.wm.get_subdirs("/foo/2016/08/12/14")
+        self.assertListEqual(sorted(subdirs, key=int), ["0", "1", "12"])
+
+    def test_get_newdirs(self):
+        dirs = ["d_20160812-%s" % i for i in range(1400, 1460, 10)]
+        for d in dirs:
+            self.wm.makedir("/source/%s" % d)
+        newdirs = self.wm.get_newdirs("/source", dirs[0],
+                                      dt.datetime(2016, 8, 13, 14, 0), 4)
+        self.assertListEqual(newdirs, dirs[1:])
+
+    def test_connection_reuse(self):
+        for i in range(10):
+            self.wm.makedir("/foo/%d" % i)
+            self.assertTrue(self.wm.path_exists("/foo/%d" % i))
+        self.assertEqual(len(self.server.requests), 20)
+        self.assertEqual(self.server.connections, 1)
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_fallback_to_cli(self, mock_safe_execute):
+        self.server.stop()
+        self.wm.makedir("/foo/bar")
+        mock_safe_execute.assert_called_with("hadoop fs -mkdir -p /foo/bar")
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_fallback_invalidates_namenode_cache(self, mock_safe_execute):
+        nn_cache = mock.MagicMock()
+        wm = twm.WebHdfsManager(self.server.webhdfs_root, "userfoo", nn_cache=nn_cache)
+        self.server.stop()
+        wm.makedir("/foo/bar")
+        nn_cache.invalidate.assert_called_with()
+
+    @mock.patch("thrive.shell_executor.ShellExecutor.safe_execute")
+    def test_fallback_on_auth_rejected(self, mock_safe_execute):
+        nn_cache = mock.MagicMock()
+        wm = twm.WebHdfsManager(self.server.webhdfs_root, "userfoo", nn_cache=nn_cache)
+        self.server.reject = 401
+        wm.makedir("/foo/bar")
+        wm.rmdir("/foo/bar")
+        mock_safe_execute.assert_has_calls([mock.call("hadoop fs -mkdir -p /foo/bar")])
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertFalse(nn_cache.invalidate.called)
+        wm.close()
+
+    def test_forbidden_auth_rejected(self):
+        self.server.reject = 403
+        wm = twm.WebHdfsManager(self.server.webhdfs_root, "userfoo", fallback=False)
+        with self.assertRaises(thex.HdfsManagerException):
+            wm.makedir("/foo/bar")
+        self.assertFalse(wm.authorized)
+        wm.close()
+
+    def test_no_fallback(self):
+        self.server.stop()
+        wm = twm.WebHdfsManager(self.server.webhdfs_root, "userfoo", fallback=False)
+        with self.assertRaises(thex.HdfsManagerException):
+            wm.makedir("/foo/bar")
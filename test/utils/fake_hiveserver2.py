@@ -0,0 +1,99 @@
+import re
+import pyodbc
+
+
+class FakeCursor(object):
+    def __init__(self, server):
+        self.server = server
+        self.rows = []
+
+    def execute(self, stmt):
+        self.rows = self.server.run(stmt)
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def __init__(self, server):
+        self.server = server
+        self.closed = False
+
+    def cursor(self):
+        if self.closed or self.server.down:
+            raise pyodbc.OperationalError("08S01", "Connection lost")
+        return FakeCursor(self.server)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeHiveServer2(object):
+    """
+    Local stand-in for HiveServer2 reached through the Hive ODBC driver. Serves the
+    statements issued by HiveServer2Manager from an in-memory metastore mapping
+    qualified table names to their partitions. Use connect() in place of
+    pyodbc.connect. Records the statements run and the sessions opened.
+    """
+    def __init__(self):
+        self.tables = dict()
+        self.statements = []
+        self.connections = 0
+        self.opened = []
+        self.down = False
+
+    def connect(self, connstr, autocommit=False):
+        if self.down:
+            raise pyodbc.OperationalError("08001", "Unable to connect to server")
+        self.connections += 1
+        self.opened.append(FakeConnection(self))
+        return self.opened[-1]
+
+    def drop_connections(self):
+        for connection in self.opened:
+            connection.closed = True
+
+    @staticmethod
+    def _ptn_name(spec):
+        pairs = re.findall(r"(\w+)\s*=\s*'?([^',)]*)'?", spec)
+        return "/".join("%s=%s" % (k, v) for k, v in pairs)
+
+    def run(self, stmt):
+        self.statements.append(stmt)
+
+        m = re.match(r"alter table (\S+) add (.*)$", stmt)
+        if m:
+            partitions = self.tables.setdefault(m.group(1), dict())
+            added = dict((self._ptn_name(spec), location) for spec, location
+                         in re.findall(r"partition \(([^)]*)\) location '([^']*)'",
+                                       m.group(2)))
+            if set(added) & set(partitions):
+                raise pyodbc.ProgrammingError("42000", "AlreadyExistsException")
+            partitions.update(added)
+            return []
+
+        m = re.match(r"alter table (\S+) drop if exists partition \((.*)\)$", stmt)
+        if m:
+            self.tables.get(m.group(1), dict()).pop(self._ptn_name(m.group(2)), None)
+            return []
+
+        m = re.match(r"show partitions (\S+) partition\((.*)\)$", stmt)
+        if m:
+            name = self._ptn_name(m.group(2))
+            return [(name,)] if name in self.tables.get(m.group(1), dict()) else []
+
+        m = re.match(r"drop table (\S+)$", stmt)
+        if m:
+            self.tables.pop(m.group(1), None)
+            return []
+
+        m = re.match(r"drop database if exists (\S+) cascade$", stmt)
+        if m:
+            for table in [t for t in self.tables if t.startswith(m.group(1) + ".")]:
+                del self.tables[table]
+            return []
+
+        raise pyodbc.ProgrammingError("42000", "ParseException")
@@ -0,0 +1,127 @@
+import json
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+
+
+class FakeWebHdfsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the subset of the WebHDFS REST API used by WebHdfsManager from the
+    in-memory filesystem of the FakeWebHdfs server
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def _reply(self, status, payload=None, headers=None):
+        body = json.dumps(payload) if payload is not None else ""
+        self.send_response(status)
+        for key, val in (headers or dict()).items():
+            self.send_header(key, val)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _status(self, path):
+        entry = self.server.fs[path]
+        return {"pathSuffix": path.rsplit("/", 1)[-1],
+                "type": entry["type"],
+                "permission": entry["permission"]}
+
+    def _handle(self):
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        path = url.path[len(self.server.prefix):].rstrip("/") or "/"
+        op = params.get("op")
+        fs = self.server.fs
+        self.server.requests.append((self.command, op, path))
+
+        if self.server.reject:
+            return self._reply(self.server.reject)
+
+        length = int(self.headers.getheader("content-length") or 0)
+        data = self.rfile.read(length) if length else ""
+
+        if op == "GETFILESTATUS":
+            if path not in fs:
+                return self._reply(404, {"RemoteException": {"exception": "FileNotFoundException"}})
+            return self._reply(200, {"FileStatus": self._status(path)})
+
+        if op == "LISTSTATUS":
+            if path not in fs:
+                return self._reply(404, {"RemoteException": {"exception": "FileNotFoundException"}})
+            children = sorted(p for p in fs if p.rsplit("/", 1)[0] == path and p != path)
+            return self._reply(200, {"FileStatuses": {
+                "FileStatus": [self._status(c) for c in children]}})
+
+        if op == "MKDIRS":
+            parts = path.strip("/").split("/")
+            for i in range(1, len(parts) + 1):
+                fs.setdefault("/" + "/".join(parts[:i]),
+                              {"type": "DIRECTORY", "permission": "750"})
+            return self._reply(200, {"boolean": True})
+
+        if op == "DELETE":
+            if path not in fs:
+                return self._reply(200, {"boolean": False})
+            for p in [p for p in fs if p == path or p.startswith(path + "/")]:
+                del fs[p]
+            return self._reply(200, {"boolean": True})
+
+        if op == "SETPERMISSION":
+            fs[path]["permission"] = params["permission"]
+            return self._reply(200)
+
+        if op == "CREATE":
+            if "datanode" not in params:
+                location = "http://%s:%d%s&datanode=true" % (self.server.server_address[0],
+                                                             self.server.server_address[1],
+                                                             self.path)
+                return self._reply(307, headers={"Location": location})
+            fs[path] = {"type": "FILE", "permission": "640", "data": data}
+            return self._reply(201)
+
+        return self._reply(400, {"RemoteException": {"exception": "IllegalArgumentException"}})
+
+    do_GET = do_PUT = do_DELETE = _handle
+
+
+class FakeWebHdfs(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Local stand-in for a namenode's WebHDFS endpoint, backed by a dict mapping
+    absolute paths to entries. Records requests and the number of connections
+    accepted, so that tests can verify connection reuse. Setting 'reject' makes
+    it reply to every request with that status.
+    """
+    daemon_threads = True
+    prefix = "/webhdfs/v1"
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), FakeWebHdfsHandler)
+        self.fs = {"/": {"type": "DIRECTORY", "permission": "755"}}
+        self.requests = []
+        self.connections = 0
+        # Status with which all requests are rejected, if set
+        self.reject = None
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def webhdfs_root(self):
+        return "http://%s:%d%s" % (self.server_address[0], self.server_address[1],
+                                   self.prefix)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -82,6 +82,21 @@ class ConfigLoader(object):
             logkv(logger, {"msg": "ConfigParser no option error"}, "error")
             raise ConfigLoaderException()
 
+    def has_config(self, section, config):
+        """
+        Checks if a config named 'config' is present in 'section'
+
+        @type section: str
+        @param section: Name of section header
+
+        @type config: str
+        @param config: Key of the config to look up
+
+        @rtype: bool
+        @return: True if the config is present, False otherwise
+        """
+        return self.parser.has_option(section, config)
+
     def get_sections(self):
         """
         Returns section headers for this config file
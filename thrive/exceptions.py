@@ -41,10 +41,18 @@ class HdfsManagerException(ThriveManagerException):
     pass
 
 
+class WebHdfsManagerException(HdfsManagerException):
+    pass
+
+
 class HiveManagerException(ThriveManagerException):
     pass
 
 
+class HiveServer2ManagerException(HiveManagerException):
+    pass
+
+
 class MetadataManagerException(ThriveManagerException):
     pass
 
@@ -85,6 +93,14 @@ class RollbackHandlerException(ThriveHandlerException):
     pass
 
 
+class RepairHandlerException(ThriveHandlerException):
+    pass
+
+
+class MigrateHandlerException(ThriveHandlerException):
+    pass
+
+
 class ConfigLoaderException(ThriveBaseException):
     pass
 
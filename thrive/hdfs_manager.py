@@ -14,15 +14,103 @@
 
 import re
 import os
+import json
+import time
 import logging
-from thrive.shell_executor import ShellException
+from datetime import timedelta
+from thrive.shell_executor import ShellException, command_cache, BATCH_WORKERS
 from thrive.thrive_manager import ThriveManager
 from thrive.utils import pathjoin, logkv, SOURCE_DIR_PATTERN
 from thrive.utils import dirname_to_dto, utc_to_pst, hour_diff
+from thrive.source_index import dirkey
 from thrive.exceptions import HdfsManagerException
 
 logger = logging.getLogger(__name__)
 
+# Seconds a namenode probe may take before the namenode is considered unreachable
+NAMENODE_PROBE_TIMEOUT = 5
+
+# Seconds for which a cached primary namenode is trusted without probing
+NAMENODE_CACHE_TTL = 3600
+
+
+class NamenodeCache(object):
+    """
+    Primary namenode found by the last probe, persisted to a local file together
+    with the time of the probe. Lets consecutive loads skip probing the namenodes
+    while the entry is fresher than 'ttl' seconds. The entry is invalidated as soon
+    as an operation against the cached namenode fails.
+    """
+    def __init__(self, cachefile, ttl=NAMENODE_CACHE_TTL):
+        """
+        @type cachefile: str
+        @param cachefile: Path of the local file persisting the cached namenode
+
+        @type ttl: float
+        @param ttl: Seconds for which the cached namenode is valid
+
+        @rtype: None
+        @return: None
+        """
+        self.cachefile = cachefile
+        self.ttl = ttl
+
+    def get(self, namenodes):
+        """
+        @type namenodes: list
+        @param namenodes: Namenodes currently configured
+
+        @rtype: str
+        @return: Cached namenode, or None if there is no entry, the entry has
+        expired, or the cached namenode is no longer configured
+        """
+        try:
+            with open(self.cachefile) as cf:
+                entry = json.load(cf)
+        except (IOError, ValueError):
+            return None
+
+        namenode = entry.get("namenode")
+        age = time.time() - entry.get("timestamp", 0)
+        if namenode in namenodes and 0 <= age < self.ttl:
+            return namenode
+        return None
+
+    def put(self, namenode):
+        """
+        Caches 'namenode' as of now. The file is replaced atomically so that
+        concurrent loads never read a partial entry.
+
+        @type namenode: str
+        @param namenode: Primary namenode
+
+        @rtype: None
+        @return: None
+        """
+        tmpfile = "%s.%d.tmp" % (self.cachefile, os.getpid())
+        try:
+            with open(tmpfile, "w") as cf:
+                json.dump({"namenode": namenode, "timestamp": time.time()}, cf)
+            os.rename(tmpfile, self.cachefile)
+        except (IOError, OSError) as ex:
+            logkv(logger, {"msg": "Could not cache primary namenode",
+                           "file": self.cachefile,
+                           "error": str(ex)}, "warning")
+
+    def invalidate(self):
+        """
+        Removes the cached namenode, so that the next lookup probes the namenodes
+
+        @rtype: None
+        @return: None
+        """
+        try:
+            os.remove(self.cachefile)
+            logkv(logger, {"msg": "Invalidated cached primary namenode",
+                           "file": self.cachefile}, "info")
+        except OSError:
+            pass
+
 
 class HdfsManager(ThriveManager):
     """
@@ -40,6 +128,7 @@ class HdfsManager(ThriveManager):
         @rtype: None
         @return: None
         """
+        command_cache.invalidate(dirpath)
         try:
             self.shell_exec.safe_execute("hadoop fs -mkdir -p %s" % dirpath)
             logkv(logger, {"msg": "Created %s" % dirpath})
@@ -57,6 +146,7 @@ class HdfsManager(ThriveManager):
         @rtype: None
         @return: None
         """
+        command_cache.invalidate(dirpath)
         try:
             self.shell_exec.safe_execute("hadoop fs -rm -r -skipTrash %s" % dirpath)
             logkv(logger, {"msg": "Deleted %s" % dirpath})
@@ -77,6 +167,7 @@ class HdfsManager(ThriveManager):
         @rtype: None
         @return: None
         """
+        command_cache.invalidate(hdfspath)
         try:
             self.shell_exec.safe_execute("hadoop fs -put %s %s" % (localpath, hdfspath))
             logkv(logger, {"msg": "Put %s to HDFS path %s" % (localpath, hdfspath)}, "info")
@@ -95,8 +186,9 @@ class HdfsManager(ThriveManager):
         @return: True if the hdfspath exists, False otherwise
         """
         try:
-            self.shell_exec.safe_execute("hadoop fs -test -e %s" % hdfspath,
-                                         splitcmd=False, as_shell=True)
+            self.shell_exec.cached_safe_execute("hadoop fs -test -e %s" % hdfspath,
+                                                [hdfspath],
+                                                splitcmd=False, as_shell=True)
             return True
         except ShellException:
             # ShellException implies hdfspath does not exist
@@ -104,6 +196,32 @@ class HdfsManager(ThriveManager):
                            "path": hdfspath}, "info")
             return False
 
+    def paths_exist(self, hdfspaths):
+        """
+        Checks concurrently which of the specified HDFS paths exist
+
+        @type hdfspaths: list
+        @param hdfspaths: HDFS paths to check
+
+        @rtype: dict
+        @return: Dictionary mapping each of 'hdfspaths' to True if it exists and
+        False otherwise
+        """
+        try:
+            results = self.shell_exec.execute_batch(
+                ["hadoop fs -test -e %s" % hp for hp in hdfspaths],
+                splitcmd=False, as_shell=True)
+        except ShellException:
+            logkv(logger, {"msg": "Error checking HDFS paths"}, "error")
+            raise HdfsManagerException()
+
+        exist = dict((hp, res.retcode == 0) for hp, res in zip(hdfspaths, results))
+        for hp, found in exist.items():
+            if not found:
+                logkv(logger, {"msg": "Path does not exist",
+                               "path": hp}, "info")
+        return exist
+
     def decompress(self, srcpath, dstpath):
         """
         Decompresses data file(s) form 'srcpath' and output to 'dstpath'. Both srcpath
@@ -119,6 +237,7 @@ class HdfsManager(ThriveManager):
         @return: None
         """
         cmd = "hadoop fs -text %s | hadoop fs -put - %s" % (srcpath, dstpath)
+        command_cache.invalidate(dstpath)
         try:
             self.shell_exec.safe_execute(cmd,
                                          as_shell=True,
@@ -131,6 +250,65 @@ class HdfsManager(ThriveManager):
             logkv(logger, {"msg": "HDFS decompress failed. %s", "cmd": cmd}, "error")
             raise HdfsManagerException()
 
+    def partfiles(self, srcdir):
+        """
+        Lists the part files in 'srcdir'
+
+        @type srcdir: str
+        @param srcdir: HDFS directory written by a MapReduce job
+
+        @rtype: list
+        @return: HDFS paths of the part files
+
+        @raises: ShellException if 'srcdir' cannot be listed by the hadoop CLI,
+        HdfsManagerException if it cannot be listed by a backend overriding ls()
+        (e.g. WebHdfsManager)
+        """
+        # Part files are the entries of the listing whose names do not begin with
+        # '_' or '.' (e.g. _SUCCESS). The 'Found n items' header has no path.
+        partfiles = [line.split()[-1] for line in self.ls(srcdir)
+                     if line.strip() and "/" in line.split()[-1]]
+        return [pf for pf in partfiles
+                if not os.path.basename(pf).startswith(("_", "."))]
+
+    def decompress_parts(self, srcdir, dstdir, workers=BATCH_WORKERS):
+        """
+        Decompresses each part file in 'srcdir' to a plain text file of the same
+        name, with a .txt extension, in 'dstdir'. Up to 'workers' part files are
+        decompressed concurrently, and the output stays split into as many files
+        as there are part files, so that Vertica COPY can load them in parallel.
+        Both srcdir and dstdir are HDFS paths
+
+        @type srcdir: str
+        @param srcdir: Directory of compressed part files
+
+        @type dstdir: str
+        @param dstdir: Directory of uncompressed files
+
+        @type workers: int
+        @param workers: Maximum number of part files decompressed at a time
+
+        @rtype: list
+        @return: HDFS paths of the uncompressed files
+        """
+        try:
+            partfiles = self.partfiles(srcdir)
+            dstfiles = [os.path.join(dstdir, "%s.txt" % os.path.splitext(os.path.basename(pf))[0])
+                        for pf in partfiles]
+            command_cache.invalidate(dstdir)
+            self.shell_exec.safe_execute_batch(
+                ["hadoop fs -text %s | hadoop fs -put - %s" % (pf, df)
+                 for pf, df in zip(partfiles, dstfiles)],
+                workers, as_shell=True, splitcmd=False, verbose=False)
+            logkv(logger,
+                  {"msg": "Decompressed source data into target",
+                   "source": srcdir, "target": dstdir, "files": len(dstfiles)}, "info")
+            return dstfiles
+        except ShellException:
+            logkv(logger, {"msg": "HDFS decompress failed",
+                           "source": srcdir, "target": dstdir}, "error")
+            raise HdfsManagerException()
+
     def grantall(self, permissions, hdfspath):
         """
         Grants 'permissions' to all on HDFS hdfspath
@@ -159,7 +337,160 @@ class HdfsManager(ThriveManager):
                    "path": hdfspath}, "warning")
             raise HdfsManagerException()
 
-    def get_newdirs(self, hdfspath, lastdir, loadts, process_delay_hrs):
+    def grant(self, permissions, hdfspaths):
+        """
+        Grants 'permissions' to all on each of 'hdfspaths', but not on their contents
+
+        @type permissions: str
+        @param permissions: Permission string. E.g: "rx"
+
+        @type hdfspaths: list
+        @param hdfspaths: HDFS paths to grant permissions on
+
+        @rtype: None
+        @return: None
+        """
+        try:
+            self.shell_exec.safe_execute("hadoop fs -chmod a+%s %s"
+                                         % (permissions, " ".join(hdfspaths)))
+            logkv(logger,
+                  {"msg": "Granted permissions",
+                   "permissions": permissions,
+                   "paths": ",".join(hdfspaths)}, "info")
+        except ShellException:
+            logkv(logger,
+                  {"msg": "Error granting permissions",
+                   "permissions": permissions,
+                   "paths": ",".join(hdfspaths)}, "warning")
+            raise HdfsManagerException()
+
+    def grant_partition(self, permissions, ptn_path, root, granted):
+        """
+        Grants 'permissions' to all on the partition at 'ptn_path' and everything
+        below it, and on its ancestors up to and including 'root'. Unlike a
+        grantall on 'root', the cost does not depend on the size of the table.
+
+        @type permissions: str
+        @param permissions: Permission string. E.g: "rx"
+
+        @type ptn_path: str
+        @param ptn_path: HDFS path of a newly written partition under 'root'
+
+        @type root: str
+        @param root: HDFS path of the table
+
+        @type granted: set
+        @param granted: Ancestor paths already granted 'permissions'. They are
+        skipped, and the ancestors granted by this call are added to the set.
+
+        @rtype: None
+        @return: None
+        """
+        parts = os.path.relpath(ptn_path, root).split(os.sep)[:-1]
+        ancestors = [root] + [os.path.join(root, *parts[:i + 1])
+                              for i in range(len(parts))]
+        missing = [a for a in ancestors if a not in granted]
+        if missing:
+            self.grant(permissions, missing)
+            granted.update(missing)
+        self.grantall(permissions, ptn_path)
+
+    def ls(self, hdfspath, cached=False):
+        """
+        Lists the contents of 'hdfspath'. Each returned line ends with the full path
+        of one entry, which is all that the listing parsers in this class rely on.
+
+        @type hdfspath: str
+        @param hdfspath: HDFS path to list
+
+        @type cached: bool
+        @param cached: If true, the listing is read in full and kept in the run's
+        command cache. Use only for directories with few entries.
+
+        @rtype: iterable
+        @return: Lines of the listing, streamed as the command produces them
+        """
+        cmd = "hadoop fs -ls %s" % hdfspath
+        if cached:
+            return command_cache.get(cmd, [hdfspath],
+                                     lambda: list(self.shell_exec.stream(cmd)))
+        return self.shell_exec.stream(cmd)
+
+    def ls_sourcedirs(self, hdfspath, days):
+        """
+        Lists the Camus source dirs of the given days in 'hdfspath' with a single
+        glob, instead of listing the whole topic
+
+        @type hdfspath: str
+        @param hdfspath: HDFS path of the topic
+
+        @type days: list
+        @param days: datetime.date objects of the days to list
+
+        @rtype: list
+        @return: Names of the source dirs created on 'days'
+        """
+        daystrs = [d.strftime("%Y%m%d") for d in days]
+        if len(daystrs) == 1:
+            pattern = "d_%s-*" % daystrs[0]
+        else:
+            pattern = "d_{%s}-*" % ",".join(daystrs)
+
+        cmd = "hadoop fs -ls -d %s" % os.path.join(hdfspath, pattern)
+        result = self.shell_exec.execute(cmd)
+        if result.retcode != 0:
+            # A glob that matches nothing is not an error: no new dirs were created
+            if "No such file or directory" in result.error:
+                return []
+            logkv(logger, {"msg": "Error in execution of shell command",
+                           "cmd": cmd,
+                           "retcode": result.retcode,
+                           "error": result.error}, "warning")
+            raise ShellException
+
+        return [m.group(1) for m in
+                (re.match(SOURCE_DIR_PATTERN, line) for line in result.output.splitlines())
+                if m]
+
+    def refresh_index(self, hdfspath, index, loadts):
+        """
+        Brings a SourceDirIndex up to date and saves it. An empty index is seeded
+        from a full listing of the topic. Otherwise only the days from that of the
+        latest indexed dir up to the day after 'loadts' are listed, which covers the
+        difference between the UTC dir names and the local load time.
+
+        @type hdfspath: str
+        @param hdfspath: HDFS path of the topic
+
+        @type index: SourceDirIndex
+        @param index: Index of the source dirs of the topic
+
+        @type loadts: datetime
+        @param loadts: Load timestamp
+
+        @rtype: int
+        @return: Number of dirs added to the index
+        """
+        latest = index.latest()
+        if latest is None:
+            found = (m.group(1) for m in
+                     (re.match(SOURCE_DIR_PATTERN, line) for line in self.ls(hdfspath))
+                     if m)
+        else:
+            day = dirname_to_dto(latest).date()
+            days = []
+            while day <= loadts.date() + timedelta(days=1):
+                days.append(day)
+                day += timedelta(days=1)
+            found = self.ls_sourcedirs(hdfspath, days)
+
+        added = index.add(found)
+        index.save()
+        logkv(logger, {"msg": "Refreshed source dir index",
+                       "latest": index.latest(), "added": added}, "info")
+        return added
+
+    def get_newdirs(self, hdfspath, lastdir, loadts, process_delay_hrs, index=None):
         """
         Gets new HDFS folders generated since the last data load.
 
@@ -169,37 +500,33 @@ class HdfsManager(ThriveManager):
         @type lastdir: str
         @param lastdir: last directory whose data was processed
 
+        @type index: SourceDirIndex
+        @param index: Persisted index of the topic's dirs. If given, only the dirs
+        created since the index was last refreshed are listed, and the dirs after
+        lastdir are looked up in the index. Otherwise the whole topic is listed.
+
         @rtype: list
         @return: List of directories created at this location since processing of lastdir
 
         @raises: ValueError
         """
 
-        # Get all folders in topic
-        try:
-            result = self.shell_exec.safe_execute("hadoop fs -ls %s" % hdfspath)
-            alldirs = re.findall(SOURCE_DIR_PATTERN, result.output)
-        except ShellException:
-            logkv(logger, {"msg": "Error in fetching HDFS directories"}, "error")
-            raise HdfsManagerException()
+        if index is not None:
+            try:
+                self.refresh_index(hdfspath, index, loadts)
+                newdirs = index.after(lastdir)
+            except (ShellException, HdfsManagerException, IOError, OSError):
+                logkv(logger, {"msg": "Error in refreshing HDFS directory index"}, "error")
+                raise HdfsManagerException()
+        else:
+            newdirs = self._scan_newdirs(hdfspath, lastdir)
 
-        # Sort dirs according to date. Date is obtained from dirname
-        # (e.g. 'd_20150311-1610') by retaining only the numeric parts of
-        # the string and converting to int (e.g. 201503111610)
-        alldirs.sort(key=lambda s: int(re.sub("[^0-9]", "", s)))
+        logkv(logger, {"msg": "Last processed directory %s" % lastdir,
+                       "process_delay": process_delay_hrs}, "info")
 
-        # Get pending dirs (i.e. dirs generated since last load and yet to be processed)
+        # From newdirs, select those which are older than the chosen delay
+        # period (in hours) (Source/CAMUS may still be processing newer dirs)
         try:
-            if lastdir is None:
-                newdirs = alldirs
-            else:
-                lastindex = alldirs.index(lastdir)
-                newdirs = alldirs[lastindex + 1:]
-            logkv(logger, {"msg": "Last processed directory %s" % lastdir,
-                           "process_delay": process_delay_hrs}, "info")
-
-            # From newdirs, select those which are older than the chosen delay
-            # period (in hours) (Source/CAMUS may still be processing newer dirs)
             dirs_to_process = []
             for d in newdirs:
                 dir_dto = dirname_to_dto(d)
@@ -210,6 +537,47 @@ class HdfsManager(ThriveManager):
             logkv(logger, {"msg": "Error in generating list of directories to process"}, "error")
             raise HdfsManagerException()
 
+    def _scan_newdirs(self, hdfspath, lastdir):
+        """
+        Lists the whole topic and returns the dirs after lastdir, in time order.
+        The listing is consumed as it streams in and only the pending dirs are
+        retained, so that memory does not grow with the number of dirs in the topic.
+
+        @type hdfspath: str
+        @param hdfspath: HDFS to query for new directories
+
+        @type lastdir: str
+        @param lastdir: last directory whose data was processed
+
+        @rtype: list
+        @return: Dirs after lastdir
+
+        @raises: HdfsManagerException if lastdir is not in the topic
+        """
+        newdirs = []
+        lastdir_found = lastdir is None
+        try:
+            for line in self.ls(hdfspath):
+                m = re.match(SOURCE_DIR_PATTERN, line)
+                if not m:
+                    continue
+                d = m.group(1)
+                if d == lastdir:
+                    lastdir_found = True
+                elif lastdir is None or dirkey(d) > dirkey(lastdir):
+                    newdirs.append(d)
+        except (ShellException, HdfsManagerException):
+            logkv(logger, {"msg": "Error in fetching HDFS directories"}, "error")
+            raise HdfsManagerException()
+
+        if not lastdir_found:
+            logkv(logger, {"msg": "Error in generating list of directories to process",
+                           "lastdir": lastdir}, "error")
+            raise HdfsManagerException()
+
+        newdirs.sort(key=dirkey)
+        return newdirs
+
     def get_subdirs(self, hdfspath):
         """
         Gets subdirectories under 'hdfspath'
@@ -220,11 +588,12 @@ class HdfsManager(ThriveManager):
         @rtype: list
         @return: Basenames of subdirectories under 'hdfspath'
         """
-        HIVE_PTN_PATTERN = ".*(%s)$" % os.path.join(hdfspath, "[0-9]+")
+        HIVE_PTN_PATTERN = re.compile(".*(%s)$" % os.path.join(hdfspath, "[0-9]+"))
         try:
-            cmd = "hadoop fs -ls %s" % hdfspath
-            result = self.shell_exec.safe_execute(cmd)
-            subpaths = re.findall(HIVE_PTN_PATTERN, result.output, re.MULTILINE)
+            subpaths = [m.group(1) for m in
+                        (re.match(HIVE_PTN_PATTERN, line)
+                         for line in self.ls(hdfspath, cached=True))
+                        if m]
             subdirs = [os.path.basename(sp) for sp in subpaths]
             return subdirs
         except Exception:
@@ -232,39 +601,61 @@ class HdfsManager(ThriveManager):
                   "warning")
             raise HdfsManagerException()
 
-    def get_primary_namenode(self, namenodes, webhdfs_path, hdfs_user):
+    def get_primary_namenode(self, namenodes, webhdfs_path, hdfs_user, cache=None,
+                             timeout=NAMENODE_PROBE_TIMEOUT):
         """
         Vertica load via Webhdfs needs a primary (active) namenode. Because of
         failovers, the active namenodes can change anytime to the next available
         namenode. The config file specifies the possible namenodes in the
         cluster (in the Dev, prod, or QA environments.
 
-        The present function pings service user's home directory in each
-        namenode in the supplied list of namenodes and determines the which one
-        is active. It returns the first active namenode. If none of the
-        namenodes is active, it returns None and lets the caller figure out the
-        appropriate course of action
+        The present function pings service user's home directory in all the
+        namenodes in the supplied list concurrently and determines which one is
+        active. It returns the first active namenode in the order of the list. A
+        namenode which cannot be reached within 'timeout' seconds is skipped. If
+        none of the namenodes is active, it returns None and lets the caller figure
+        out the appropriate course of action. If a 'cache' is given, a fresh cached
+        namenode is returned without probing and a newly found one is cached.
 
         @type namenodes: list
         @param namenodes: list of HDFS namenode urls
 
+        @type cache: NamenodeCache
+        @param cache: Cache of the primary namenode
+
+        @type timeout: int
+        @param timeout: Seconds allowed to each namenode to respond
+
         @rtype: str
         @return: one item from the list of webhdfs urls, which is the active
         namenode or None if none of them are active
         """
+        if cache is not None:
+            nn = cache.get(namenodes)
+            if nn:
+                logkv(logger, {"msg": "Retrived cached namenode", "namenode": nn}, "info")
+                return nn
+
+        cmds = ["curl --negotiate -u:%s --max-time %s '%s?op=GETFILESTATUS' "
+                % (hdfs_user, timeout, pathjoin(nn, webhdfs_path)) for nn in namenodes]
+        try:
+            results = self.shell_exec.execute_batch(cmds, len(cmds), splitcmd=False,
+                                                    as_shell=True)
+        except ShellException:
+            logkv(logger, {"msg": "Error pinging namenodes", "namenodes": namenodes},
+                  "error")
+            raise HdfsManagerException()
 
-        for nn in namenodes:
-            path = pathjoin(nn, webhdfs_path)
-            cmd = "curl --negotiate -u:%s '%s?op=GETFILESTATUS' " % (hdfs_user, path)
-            try:
-                res = self.shell_exec.safe_execute(cmd, splitcmd=False, as_shell=True)
-                # If "FileStatus" key is present in output, the namenode is active
-                if "FileStatus" in res.output:
-                    logkv(logger, {"msg": "Retrived namenode", "namenode": nn}, "info")
-                    return nn
-            except ShellException:
-                logkv(logger, {"msg": "Error pinging namenode", "namenode": nn}, "error")
-                raise HdfsManagerException()
+        for nn, res in zip(namenodes, results):
+            # If "FileStatus" key is present in output, the namenode is active
+            if res.retcode == 0 and "FileStatus" in res.output:
+                logkv(logger, {"msg": "Retrived namenode", "namenode": nn}, "info")
+                if cache is not None:
+                    cache.put(nn)
+                return nn
+            logkv(logger, {"msg": "Namenode not active",
+                           "namenode": nn,
+                           "retcode": res.retcode}, "warning")
 
         # If no result had "FileStatus" key, then all namenodes are dead. Return None
         return None
@@ -13,8 +13,7 @@
 # limitations under the License.
 
 import logging
-import re
-from thrive.shell_executor import ShellExecutor, ShellException
+from thrive.shell_executor import ShellExecutor, ShellException, command_cache
 from thrive.utils import logkv, parse_partition
 from thrive.hdfs_manager import HdfsManager
 from thrive.exceptions import HiveManagerException
@@ -42,6 +41,9 @@ class HiveManager(object):
         self.table = table
         self.shell_exec = ShellExecutor()
 
+        # Name under which reads of the table's partitions are cached
+        self.cache_scope = "hive:%s.%s" % (db, table)
+
     def execute(self, stmt):
         """
         Executes Hive SQL statement 'stmt'
@@ -61,7 +63,7 @@ class HiveManager(object):
                            "query": stmt}, "error")
             raise HiveManagerException()
 
-    def create_partition(self, ptn_path):
+    def create_partition(self, ptn_path, hdfs_mgr=None):
         """
         Creates a timestmp-based partition and points the partition to the location of
         the data
@@ -69,12 +71,15 @@ class HiveManager(object):
         @type ptn_path: str
         @param ptn_path: location of the parsed JSON data
 
+        @type hdfs_mgr: HdfsManager
+        @param hdfs_mgr: HDFS manager checking the location, a new HdfsManager if None
+
         @rtype: None
         @return: None
         """
 
         # Check if HDFS path exists before attempting to point the new partition to it
-        hdfs_mgr = HdfsManager()
+        hdfs_mgr = hdfs_mgr or HdfsManager()
         if not hdfs_mgr.path_exists(ptn_path):
             logkv(logger, {"msg": "Hadoop path does not exist", "path": ptn_path}, "error")
             raise HiveManagerException()
@@ -94,6 +99,8 @@ class HiveManager(object):
             raise HiveManagerException()
 
         # If the partition does not exist, proceed to create it
+        command_cache.invalidate(self.cache_scope)
+
         # Construct partition command
         partition_cmd = ''' \
         hive -e "use %s; \
@@ -119,6 +126,59 @@ class HiveManager(object):
                            "partition": ptn_str}, "error")
             raise HiveManagerException()
 
+    def create_partitions(self, ptn_paths, hdfs_mgr=None):
+        """
+        Creates the partitions pointing to each of 'ptn_paths' with a single 'alter
+        table ... add partition' statement, and so a single Hive session. The Hive
+        metastore adds either all of the partitions or none of them. If the
+        statement fails, e.g. because one of the partitions already exists, the
+        partitions are created one at a time with create_partition, in order, up
+        to the first failure.
+
+        @type ptn_paths: list
+        @param ptn_paths: locations of the parsed JSON data, in load order
+
+        @type hdfs_mgr: HdfsManager
+        @param hdfs_mgr: HDFS manager checking the locations, a new HdfsManager if
+        None
+
+        @rtype: list
+        @return: The leading items of 'ptn_paths' whose partitions were created
+        """
+        if not ptn_paths:
+            return []
+
+        # Check if HDFS paths exist before attempting to point the new partitions to them
+        hdfs_mgr = hdfs_mgr or HdfsManager()
+        if all(hdfs_mgr.paths_exist(ptn_paths).values()):
+            ptn_clauses = ["partition (year = '%s', month = '%s', day = '%s', "
+                           "hour = '%s', part = '%s') location '%s'"
+                           % (parse_partition(ptn_path) + (ptn_path,))
+                           for ptn_path in ptn_paths]
+            partition_cmd = ''' hive -e "use %s; alter table %s add %s;" ''' \
+                            % (self.db, self.table, " ".join(ptn_clauses))
+            command_cache.invalidate(self.cache_scope)
+            try:
+                self.shell_exec.safe_execute(partition_cmd,
+                                             splitcmd=False,
+                                             as_shell=True)
+                logkv(logger, {"msg": "Created partitions",
+                               "partitions": len(ptn_paths)}, "info")
+                return list(ptn_paths)
+            except ShellException:
+                logkv(logger, {"msg": "Error creating Hive partitions in batch",
+                               "partitions": len(ptn_paths)}, "warning")
+
+        # Create the partitions one at a time to find out which of them can be
+        created = []
+        for ptn_path in ptn_paths:
+            try:
+                self.create_partition(ptn_path, hdfs_mgr)
+            except HiveManagerException:
+                break
+            created.append(ptn_path)
+        return created
+
     def drop_partition(self, ptn_str):
         """
         Deletes hive partition.
@@ -132,6 +192,7 @@ class HiveManager(object):
         # Compose drop partition command
         dropcmd = ''' hive -e "use %s; alter table %s drop if exists partition (%s)"''' \
                   % (self.db, self.table, ptn_str)
+        command_cache.invalidate(self.cache_scope)
         try:
             self.execute(dropcmd)
             logkv(logger, {"msg": "Dropped partition", "partition": ptn_str}, "info")
@@ -160,6 +221,7 @@ class HiveManager(object):
         @return: None
         """
         dropcmd = ''' hive -e "use %s; drop table %s" ''' %(self.db, self.table)
+        command_cache.invalidate(self.cache_scope)
         try:
             # Drop the table
             self.shell_exec.safe_execute(dropcmd, splitcmd=False, as_shell=True)
@@ -178,6 +240,7 @@ class HiveManager(object):
         @return: None
         """
         dropcmd = ''' hive -e "drop database if exists %s cascade;" ''' % (self.db)
+        command_cache.invalidate(self.cache_scope)
         try:
             # Drop the table
             self.shell_exec.safe_execute(dropcmd, splitcmd=False, as_shell=True)
@@ -194,6 +257,10 @@ class HiveManager(object):
         create already exists. So the create_partition uses this method to make
         sure that the partition does not* exist.
 
+        Only the partition with the exact spec is requested from the metastore,
+        so the cost of the check does not grow with the number of partitions in
+        the table.
+
         @type ptn_str: str
         @param ptn_str: Partition string.
                         E.g. "year=2016/month=06/day=06/hour=18/part=1"
@@ -201,10 +268,14 @@ class HiveManager(object):
         @rtype: bool
         @return: True if a partition exists, False otherwise
         """
-        cmd = ''' hive -e "use %s; show partitions %s" ''' % (self.db, self.table)
         try:
-            result = self.shell_exec.safe_execute(cmd, splitcmd=False, as_shell=True)
-            return bool(re.search(ptn_str, result.output))
+            ptn_spec = ", ".join("%s='%s'" % tuple(kv.split("=", 1))
+                                 for kv in ptn_str.split("/"))
+            cmd = ''' hive -e "use %s; show partitions %s partition(%s)" ''' \
+                  % (self.db, self.table, ptn_spec)
+            result = self.shell_exec.cached_safe_execute(cmd, [self.cache_scope],
+                                                         splitcmd=False, as_shell=True)
+            return ptn_str in result.output.split()
         except Exception:
             logkv(logger, {"msg": "Error checking Hive partition",
                            "partition": ptn_str}, "error")
@@ -0,0 +1,273 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pyodbc
+import logging
+from thrive.hive_manager import HiveManager
+from thrive.odbc_pool import odbc_pool, BROKEN_CONNECTION_ERRORS
+from thrive.hdfs_manager import HdfsManager
+from thrive.shell_executor import command_cache, command_stats, sql_operation
+from thrive.utils import logkv, parse_partition
+from thrive.exceptions import HiveManagerException, HiveServer2ManagerException
+
+logger = logging.getLogger(__name__)
+
+
+class HiveServer2Manager(HiveManager):
+    """
+    HiveManager backend which runs Hive statements over HiveServer2 sessions kept in
+    the process-wide ODBC pool instead of starting a 'hive' CLI for each of them.
+    Table names are qualified with the database, so that the same sessions serve
+    every dataset. If HiveServer2 cannot be reached and 'fallback' is set, the
+    command-line backend serves the failed operation.
+    """
+    def __init__(self, db, table, connstr, fallback=True):
+        """
+        @type db: str
+        @param db: Hive db
+
+        @type table: str
+        @param table: Hive table
+
+        @type connstr: str
+        @param connstr: ODBC connection string of HiveServer2. E.g.
+        "DRIVER={Hive};HOST=hs2host;PORT=10000;AuthMech=1;KrbServiceName=hive"
+
+        @type fallback: bool
+        @param fallback: Use the command-line backend if HiveServer2 is unreachable
+
+        @rtype: None
+        @return: None
+        """
+        super(HiveServer2Manager, self).__init__(db, table)
+        self.connstr = connstr
+        self.fallback = fallback
+
+    def _query(self, stmt, fetch=False):
+        """
+        Runs 'stmt' on a pooled session. If the session turns out to be closed by
+        the server, or no session can be opened, the statement is tried once more
+        on a new session.
+
+        @type stmt: str
+        @param stmt: HiveQL statement
+
+        @type fetch: bool
+        @param fetch: Return the rows produced by the statement
+
+        @rtype: list
+        @return: Rows as tuples, empty unless 'fetch' is set
+
+        @raises: HiveServer2ManagerException if HiveServer2 cannot be reached,
+        HiveManagerException if the statement fails
+        """
+        with command_stats.timed("hive.%s" % sql_operation(stmt)):
+            for attempt in range(2):
+                try:
+                    with odbc_pool.session(self.connstr) as connection:
+                        cursor = connection.cursor()
+                        try:
+                            cursor.execute(stmt)
+                            return [tuple(row) for row in cursor.fetchall()] if fetch else []
+                        finally:
+                            cursor.close()
+                except BROKEN_CONNECTION_ERRORS as ex:
+                    error = ex
+                except pyodbc.Error as ex:
+                    logkv(logger, {"msg": "HiveServer2 statement failed",
+                                   "query": stmt,
+                                   "error": str(ex)}, "error")
+                    raise HiveManagerException()
+
+            logkv(logger, {"msg": "HiveServer2 unreachable",
+                           "query": stmt,
+                           "error": str(error)}, "warning")
+            raise HiveServer2ManagerException()
+
+    def _fallback(self, operation, *args):
+        """
+        Serves 'operation' through the command-line backend after HiveServer2
+        could not be reached, or re-raises the failure if fallback is disabled.
+
+        @rtype: object
+        @return: Return value of the command-line implementation of 'operation'
+        """
+        if not self.fallback:
+            raise HiveManagerException()
+
+        logkv(logger, {"msg": "HiveServer2 unavailable, falling back to hive CLI",
+                       "operation": operation}, "warning")
+        return getattr(super(HiveServer2Manager, self), operation)(*args)
+
+    def _add_partitions(self, ptn_paths):
+        """
+        Adds the partitions pointing to 'ptn_paths' with a single statement
+
+        @rtype: None
+        @return: None
+        """
+        ptn_clauses = ["partition (year = '%s', month = '%s', day = '%s', "
+                       "hour = '%s', part = '%s') location '%s'"
+                       % (parse_partition(ptn_path) + (ptn_path,))
+                       for ptn_path in ptn_paths]
+        command_cache.invalidate(self.cache_scope)
+        self._query("alter table %s.%s add %s" % (self.db, self.table,
+                                                   " ".join(ptn_clauses)))
+
+    def create_partition(self, ptn_path, hdfs_mgr=None):
+        """
+        Creates a timestmp-based partition and points the partition to the location of
+        the data
+
+        @type ptn_path: str
+        @param ptn_path: location of the parsed JSON data
+
+        @type hdfs_mgr: HdfsManager
+        @param hdfs_mgr: HDFS manager checking the location, a new HdfsManager if None
+
+        @rtype: None
+        @return: None
+        """
+        hdfs_mgr = hdfs_mgr or HdfsManager()
+        if not hdfs_mgr.path_exists(ptn_path):
+            logkv(logger, {"msg": "Hadoop path does not exist", "path": ptn_path}, "error")
+            raise HiveManagerException()
+
+        ptn_str = "year=%s/month=%s/day=%s/hour=%s/part=%s" % parse_partition(ptn_path)
+        try:
+            if self.check_partition(ptn_str):
+                logkv(logger, {"msg": "Partition %s for table %s.%s already exists"
+                                      % (ptn_str, self.db, self.table)}, "error")
+                raise HiveManagerException()
+            self._add_partitions([ptn_path])
+            logkv(logger, {"msg": "Created partition", "partition": ptn_str}, "info")
+        except HiveServer2ManagerException:
+            self._fallback("create_partition", ptn_path, hdfs_mgr)
+
+    def create_partitions(self, ptn_paths, hdfs_mgr=None):
+        """
+        Creates the partitions pointing to each of 'ptn_paths' with a single
+        statement. If the statement fails, the partitions are created one at a time,
+        in order, up to the first failure.
+
+        @type ptn_paths: list
+        @param ptn_paths: locations of the parsed JSON data, in load order
+
+        @type hdfs_mgr: HdfsManager
+        @param hdfs_mgr: HDFS manager checking the locations, a new HdfsManager if
+        None
+
+        @rtype: list
+        @return: The leading items of 'ptn_paths' whose partitions were created
+        """
+        if not ptn_paths:
+            return []
+
+        hdfs_mgr = hdfs_mgr or HdfsManager()
+        try:
+            if all(hdfs_mgr.paths_exist(ptn_paths).values()):
+                self._add_partitions(ptn_paths)
+                logkv(logger, {"msg": "Created partitions",
+                               "partitions": len(ptn_paths)}, "info")
+                return list(ptn_paths)
+        except HiveServer2ManagerException:
+            return self._fallback("create_partitions", ptn_paths, hdfs_mgr)
+        except HiveManagerException:
+            logkv(logger, {"msg": "Error creating Hive partitions in batch",
+                           "partitions": len(ptn_paths)}, "warning")
+
+        # Create the partitions one at a time to find out which of them can be
+        created = []
+        for ptn_path in ptn_paths:
+            try:
+                self.create_partition(ptn_path, hdfs_mgr)
+            except HiveManagerException:
+                break
+            created.append(ptn_path)
+        return created
+
+    def drop_partition(self, ptn_str):
+        """
+        Deletes hive partition.
+
+        @type ptn_str: str
+        @param ptn_str: partition spec, e.g. "year=2016, month=08, day=12, hour=14, part=0"
+
+        @rtype: None
+        @return: None
+        """
+        command_cache.invalidate(self.cache_scope)
+        try:
+            self._query("alter table %s.%s drop if exists partition (%s)"
+                        % (self.db, self.table, ptn_str))
+            logkv(logger, {"msg": "Dropped partition", "partition": ptn_str}, "info")
+        except HiveServer2ManagerException:
+            self._fallback("drop_partition", ptn_str)
+
+    def drop_table(self):
+        """
+        Drops self.table
+
+        @rtype: None
+        @return: None
+        """
+        command_cache.invalidate(self.cache_scope)
+        try:
+            self._query("drop table %s.%s" % (self.db, self.table))
+            logkv(logger, {"msg": "Dropped table",
+                           "table": "%s.%s" % (self.db, self.table)}, "info")
+        except HiveServer2ManagerException:
+            self._fallback("drop_table")
+
+    def drop_db(self):
+        """
+        Drops self.db, deletes all tables inside
+
+        @rtype: None
+        @return: None
+        """
+        command_cache.invalidate(self.cache_scope)
+        try:
+            self._query("drop database if exists %s cascade" % self.db)
+            logkv(logger, {"msg": "Dropped database", "database": self.db}, "info")
+        except HiveServer2ManagerException:
+            self._fallback("drop_db")
+
+    def check_partition(self, ptn_str):
+        """
+        Checks if a Hive partition exists. Only the partition with the exact spec
+        is requested from the metastore.
+
+        @type ptn_str: str
+        @param ptn_str: Partition string.
+                        E.g. "year=2016/month=06/day=06/hour=18/part=1"
+
+        @rtype: bool
+        @return: True if a partition exists, False otherwise
+        """
+        try:
+            ptn_spec = ", ".join("%s='%s'" % tuple(kv.split("=", 1))
+                                 for kv in ptn_str.split("/"))
+        except TypeError:
+            logkv(logger, {"msg": "Error checking Hive partition",
+                           "partition": ptn_str}, "error")
+            raise HiveManagerException()
+
+        stmt = "show partitions %s.%s partition(%s)" % (self.db, self.table, ptn_spec)
+        try:
+            rows = command_cache.get("hiveserver2: %s" % stmt, [self.cache_scope],
+                                     lambda: self._query(stmt, fetch=True))
+            return ptn_str in [row[0] for row in rows]
+        except HiveServer2ManagerException:
+            return self._fallback("check_partition", ptn_str)
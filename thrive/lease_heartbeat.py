@@ -0,0 +1,134 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import logging
+import threading
+from thrive.metadata_manager import MetadataManager
+from thrive.utils import logkv
+from thrive.exceptions import MetadataManagerException
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseHeartbeat(object):
+    """
+    Renews the lease of a dataset lock from a background thread while a load runs.
+    The lease is renewed every third of its length, so that it only expires if the
+    load stops renewing it, e.g. because it crashed. The thread uses a metadata
+    database connection of its own, since ODBC connections cannot be shared between
+    threads. If the lease was taken over by another load, or could not be renewed
+    before it expired, renewals stop and 'lost' is set.
+    """
+    def __init__(self, credentials, dataset_name, holder, lease_secs,
+                 mdmgr_class=None):
+        """
+        @type credentials: dict
+        @param credentials: Metadata database credentials, as for MetadataManager
+
+        @type dataset_name: str
+        @param dataset_name: Dataset whose lock is held
+
+        @type holder: str
+        @param holder: Holder id the lock was acquired with
+
+        @type lease_secs: int
+        @param lease_secs: Length of the lease in seconds
+
+        @type mdmgr_class: type
+        @param mdmgr_class: MetadataManager backend of the metadata database,
+        MetadataManager if not given
+
+        @rtype: None
+        @return: None
+        """
+        self.credentials = credentials
+        self.dataset_name = dataset_name
+        self.holder = holder
+        self.lease_secs = lease_secs
+        self.mdmgr_class = mdmgr_class or MetadataManager
+        self.lost = False
+        self.last_renewal = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name="lease-heartbeat-%s" % dataset_name)
+        self._thread.daemon = True
+
+    def _run(self):
+        """
+        Renews the lease until stop() is called or the lease is lost. Renewals that
+        fail because of the database are retried at the next interval, until the
+        lease has expired since the last successful renewal.
+
+        @rtype: None
+        @return: None
+        """
+        interval = max(1, self.lease_secs / 3)
+        mm = None
+        try:
+            while True:
+                self._stopped.wait(interval)
+                if self._stopped.is_set():
+                    break
+
+                try:
+                    if mm is None:
+                        mm = self.mdmgr_class(self.credentials)
+                    renewed = mm.renew_lock(self.dataset_name, self.holder,
+                                            self.lease_secs)
+                except MetadataManagerException as ex:
+                    logkv(logger, {"msg": "Could not renew lock lease",
+                                   "dataset": self.dataset_name}, "warning", ex)
+
+                    # Another load may take over the lock once the lease expired
+                    if time.time() > self.last_renewal + self.lease_secs:
+                        self.lost = True
+                        logkv(logger, {"msg": "Lock lease expired without renewal",
+                                       "dataset": self.dataset_name,
+                                       "holder": self.holder}, "error")
+                        break
+                    continue
+
+                if renewed:
+                    self.last_renewal = time.time()
+                else:
+                    self.lost = True
+                    logkv(logger, {"msg": "Lock lease taken over by another load",
+                                   "dataset": self.dataset_name,
+                                   "holder": self.holder}, "error")
+                    break
+        finally:
+            if mm is not None:
+                mm.close()
+
+    def start(self):
+        """
+        Starts renewing the lease, which is taken to have been acquired or last
+        renewed just before
+
+        @rtype: None
+        @return: None
+        """
+        self.last_renewal = time.time()
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops renewing the lease and waits for the renewal in progress, if any
+
+        @rtype: None
+        @return: None
+        """
+        self._stopped.set()
+        self._thread.join()
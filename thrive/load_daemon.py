@@ -0,0 +1,171 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import logging
+from datetime import datetime, timedelta
+from thrive.load_handler import LoadHandler
+from thrive.utils import init_logging, logkv, CAMUS_FOLDER_FREQ
+from thrive.exceptions import ThriveBaseException
+
+logger = logging.getLogger(__name__)
+
+# Shortest interval between two polls of a dataset
+MIN_POLL_INTERVAL = timedelta(0, 60)
+
+
+class LoadDaemon(object):
+    """
+    Runs the loads of one or more datasets from a single long-running process. Each
+    dataset keeps its LoadHandler, and so its parsed configs, metadata connection,
+    namenode and source dir index, from one load to the next.
+
+    A dataset is polled every CAMUS_FOLDER_FREQ after a load, since that is when
+    the next source directory is expected. Every poll which finds nothing to load
+    halves the interval, down to 'min_interval', so that a late directory is loaded
+    soon after it becomes eligible.
+    """
+    def __init__(self, datasets, min_interval=MIN_POLL_INTERVAL,
+                 max_interval=CAMUS_FOLDER_FREQ):
+        """
+        @type datasets: list
+        @param datasets: (data config file, env config file) of each dataset
+
+        @type min_interval: timedelta
+        @param min_interval: Shortest interval between two polls of a dataset
+
+        @type max_interval: timedelta
+        @param max_interval: Interval between polls after a load or a failure
+
+        @rtype: None
+        @return: None
+        """
+        self.datasets = list(datasets)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.handlers = dict()
+        self.intervals = dict((ds, max_interval) for ds in self.datasets)
+        self.next_poll = dict((ds, datetime.now()) for ds in self.datasets)
+        self.running = False
+
+    def get_handler(self, dataset):
+        """
+        @type dataset: tuple
+        @param dataset: (data config file, env config file)
+
+        @rtype: LoadHandler
+        @return: LoadHandler of 'dataset', ready for a new load
+        """
+        handler = self.handlers.get(dataset)
+        if handler is None:
+            datacfg_file, envcfg_file = dataset
+            handler = LoadHandler(datacfg_file=datacfg_file, envcfg_file=envcfg_file)
+            self.handlers[dataset] = handler
+        else:
+            handler.reset()
+        return handler
+
+    def discard_handler(self, dataset):
+        """
+        Drops the LoadHandler of 'dataset' after a failure, so that the next poll
+        starts from fresh configs and connections
+
+        @type dataset: tuple
+        @param dataset: (data config file, env config file)
+
+        @rtype: None
+        @return: None
+        """
+        handler = self.handlers.pop(dataset, None)
+        if handler is not None:
+            handler.close()
+
+    def poll(self, dataset):
+        """
+        Runs a load of 'dataset' and schedules its next poll
+
+        @type dataset: tuple
+        @param dataset: (data config file, env config file)
+
+        @rtype: bool
+        @return: True if new directories were loaded
+        """
+        # Each load is logged to a log file of its own dataset, next to which its
+        # command timings are written
+        init_logging(dataset[0])
+
+        loaded = False
+        try:
+            handler = self.get_handler(dataset)
+            loaded = handler.execute()
+            if loaded:
+                interval = self.max_interval
+            else:
+                interval = max(self.intervals[dataset] / 2, self.min_interval)
+        except Exception as ex:
+            # A failure of any kind is confined to its dataset, so that the daemon
+            # goes on polling the others
+            if isinstance(ex, ThriveBaseException):
+                logkv(logger, {"msg": "Load failed in daemon",
+                               "data_config": dataset[0]}, "error", ex)
+            else:
+                logkv(logger, {"msg": "Load failed in daemon",
+                               "data_config": dataset[0],
+                               "error": repr(ex)}, "error")
+            self.discard_handler(dataset)
+            interval = self.max_interval
+
+        self.intervals[dataset] = interval
+        self.next_poll[dataset] = datetime.now() + interval
+        logkv(logger, {"msg": "Scheduled next poll",
+                       "data_config": dataset[0],
+                       "next_poll": self.next_poll[dataset].isoformat()}, "info")
+        return loaded
+
+    def run(self, cycles=None):
+        """
+        Polls the datasets as they become due, sleeping in between, until stop()
+        is called or 'cycles' rounds have been made
+
+        @type cycles: int
+        @param cycles: Number of rounds to make, or None to run until stopped
+
+        @rtype: None
+        @return: None
+        """
+        self.running = True
+        logkv(logger, {"msg": "Starting load daemon",
+                       "datasets": len(self.datasets)}, "info")
+        while self.running and cycles != 0:
+            for dataset in self.datasets:
+                if self.running and self.next_poll[dataset] <= datetime.now():
+                    self.poll(dataset)
+
+            if cycles is not None:
+                cycles -= 1
+
+            if self.running and cycles != 0:
+                wait = min(self.next_poll.values()) - datetime.now()
+                time.sleep(max(wait.total_seconds(), 0))
+        logkv(logger, {"msg": "Stopped load daemon"}, "info")
+
+    def stop(self, *args):
+        """
+        Makes run() return after the load in progress, if any. Accepts and ignores
+        the arguments of a signal handler.
+
+        @rtype: None
+        @return: None
+        """
+        self.running = False
@@ -13,12 +13,25 @@
 # limitations under the License.
 
 import os
+import json
+import uuid
+import socket
 import logging
 from datetime import datetime
+from functools import partial
+from itertools import izip, chain
+from multiprocessing.pool import ThreadPool
 from thrive.utils import iso_format, logkv, materialize, percentdiff, \
-     dirname_to_dto, CAMUS_FOLDER_FREQ, chunk_dirs, parse_partition
+     dirname_to_dto, CAMUS_FOLDER_FREQ, chunk_dirs, parse_partition, get_logfile
+from thrive.shell_executor import command_stats, command_cache, ShellException
+from thrive.vertica_manager import VerticaManager
 from thrive.thrive_handler import ThriveHandler
 from thrive.oozie_manager import OozieManager
+from thrive.webhdfs_manager import WebHdfsManager
+from thrive.source_index import SourceDirIndex
+from thrive.lease_heartbeat import LeaseHeartbeat
+from thrive.metadata_manager import MetadataJournal
+from thrive.hdfs_manager import NamenodeCache, NAMENODE_CACHE_TTL
 from thrive.newrelic_manager import NewRelicManager, NewRelicManagerException
 from thrive.exceptions import LoadHandlerException, OozieManagerException, \
     VerticaManagerException, HdfsManagerException, HiveManagerException, \
@@ -58,18 +71,45 @@ class LoadHandler(ThriveHandler):
         self.propfile = None
         self.newdirs = None
         self.locked = False
+        self.lock_holder = None
+        self.heartbeat = None
         self.load_type = None
 
-        # Get primary HDFS namenode before proceeding with load
-        namenodes = self.get_config("webhdfs_root").split(",")
+        # Partition ancestors in target_root granted read/execute in this load
+        self.granted_paths = set()
+
+        # Load metadata is queued in a local journal and committed once per batch
+        # of partitions loaded
+        self.md_journal = MetadataJournal(
+            self.metadata_mgr,
+            self.get_config("metadata_journal_file",
+                            default=os.path.join(self.get_config("nfs_dataset_path"),
+                                                 "metadata.journal")))
+
+        # Index of the topic's source dirs, kept from one load to the next and read
+        # again from its file only by reset()
+        self.source_index_file = self.get_config(
+            "source_index_file",
+            default=os.path.join(self.get_config("nfs_dataset_path"), "source_dirs.idx"))
+        self.source_index = SourceDirIndex(self.source_index_file)
+
+        # Get primary HDFS namenode before proceeding with load. The namenode found
+        # is cached locally, so that subsequent loads need not probe the namenodes
         try:
-            self.primary_namenode = \
-                self.hdfs_mgr.get_primary_namenode(namenodes,
-                                                   self.get_config("hdfs_root"),
-                                                   self.get_config("hdfs_user"))
-        except HdfsManagerException as ex:
-            logkv(logger, {"msg": "Failed to get primary namenode"}, "error", ex)
+            nn_ttl = float(self.get_config("namenode_cache_ttl",
+                                           default=NAMENODE_CACHE_TTL))
+        except ValueError:
+            logkv(logger,
+                  {"msg": "Could not parse namenode_cache_ttl as a float"},
+                  "error")
             raise LoadHandlerException()
+        self.nn_cache = NamenodeCache(
+            self.get_config("namenode_cache_file",
+                            default=os.path.join(self.get_config("nfs_dataset_path"),
+                                                 "namenode.cache")),
+            ttl=nn_ttl)
+        self.primary_namenode = None
+        self.resolve_namenode()
 
         # Instantiate Oozie manager
         self.oozie_mgr = OozieManager()
@@ -93,12 +133,94 @@ class LoadHandler(ThriveHandler):
         #     logkv(logger, {"msg": "Failed to initialize NewRelic Manager"}, "error")
         #     raise LoadHandlerException()
 
+    def resolve_namenode(self):
+        """
+        Gets the primary namenode among the namenodes in webhdfs_root. If the
+        WebHDFS backend is requested, HDFS operations are served by the primary
+        namenode from then on.
+
+        @rtype: str
+        @return: Primary namenode or None if no namenode is active
+        """
+        namenodes = self.get_config("webhdfs_root").split(",")
+        try:
+            self.primary_namenode = \
+                self.hdfs_mgr.get_primary_namenode(namenodes,
+                                                   self.get_config("hdfs_root"),
+                                                   self.get_config("hdfs_user"),
+                                                   cache=self.nn_cache)
+        except HdfsManagerException as ex:
+            logkv(logger, {"msg": "Failed to get primary namenode"}, "error", ex)
+            raise LoadHandlerException()
+
+        # Serve HDFS operations through WebHDFS on the primary namenode if requested.
+        # The hadoop CLI backend remains the default and the fallback.
+        if self.get_config("hdfs_backend", default="cli") == "webhdfs" \
+                and self.primary_namenode:
+            if isinstance(self.hdfs_mgr, WebHdfsManager):
+                if self.hdfs_mgr.webhdfs_root == self.primary_namenode:
+                    return self.primary_namenode
+                self.hdfs_mgr.close()
+            self.hdfs_mgr = WebHdfsManager(self.primary_namenode,
+                                           self.get_config("hdfs_user"),
+                                           nn_cache=self.nn_cache)
+            logkv(logger, {"msg": "Using WebHDFS backend for HDFS operations",
+                           "namenode": self.primary_namenode}, "info")
+        return self.primary_namenode
+
+    def reset(self):
+        """
+        Prepares the handler for another load in the same process, as done by
+        LoadDaemon. Clears the state of the previous load, takes a new load id and
+        load timestamp, reads the source dir index again from its file and gets the
+        primary namenode again, which is served from the namenode cache unless the
+        previous load invalidated it. Configs and manager connections are kept.
+
+        @rtype: None
+        @return: None
+        """
+        self.load_id = str(uuid.uuid1())
+        self.loadts = datetime.now()
+        self.propfile = None
+        self.newdirs = None
+        self.locked = False
+        self.lock_holder = None
+        self.heartbeat = None
+        self.load_type = None
+        self.granted_paths = set()
+        self.source_index = SourceDirIndex(self.source_index_file)
+        command_stats.reset()
+        self.resolve_namenode()
+
+    def close(self):
+        """
+        Closes the connections held by the managers of the handler: the metadata
+        connection, the pooled WebHDFS connections and the pooled Vertica ODBC
+        sessions. A connection which cannot be closed is left to be dropped with
+        the handler.
+
+        @rtype: None
+        @return: None
+        """
+        # Only the WebHDFS and ODBC backends hold connections, hence have close()
+        managers = [self.metadata_mgr] + [mgr for mgr in (self.hdfs_mgr, self.vertica_mgr)
+                                          if hasattr(mgr, "close")]
+
+        for mgr in managers:
+            try:
+                mgr.close()
+            except Exception as ex:
+                # The connection may be what failed in the first place
+                logkv(logger, {"msg": "Could not close connection",
+                               "manager": type(mgr).__name__,
+                               "error": ex}, "warning")
+
     def get_newdirs(self):
         """
         Get new, unprocessed HDFS directories created in the topic since the last
         successful run of the load process. It gets the last successfully processed HDFS
-        directory from MySQL metadata and a list of all directories in the topic from
-        HDFS. It then slices this list to return only the new directories.
+        directory from MySQL metadata and the directories in the topic after it from
+        the topic's directory index, which is first refreshed from HDFS.
 
         @rtype: list
         @return: List of pending, unprocessed HDFS dirs since the last successful load
@@ -109,10 +231,12 @@ class LoadHandler(ThriveHandler):
                                                     self.get_config("hive_table"),
                                                     self.load_type)
 
-        # Get all folders in topic in HDFS
+        # Get folders in topic in HDFS created since old_lastdir. The persisted
+        # index of the topic's folders limits the listing to the latest days.
         newdirs = self.hdfs_mgr.get_newdirs(self.get_config("source_root"),
                                             old_lastdir, self.loadts,
-                                            self.process_delay)
+                                            self.process_delay,
+                                            index=self.source_index)
         return newdirs
 
     def make_tmproot(self):
@@ -196,6 +320,33 @@ class LoadHandler(ThriveHandler):
         logkv(logger, {"msg": "Generated properties file",
                        "properties_file": self.propfile}, "info")
 
+    def copy_mode(self, hiveptn=None):
+        """
+        Chooses the Vertica COPY mode for the data in Hive partition 'hiveptn' from
+        the extension of its part files. If 'hiveptn' is not given, or has no part
+        files, the mode is chosen for the dataset's 'mr_output_codec'.
+
+        @type hiveptn: str
+        @param hiveptn: Hive partition to be loaded into Vertica
+
+        @rtype: str
+        @return: Copy mode. See vload_copy.
+        """
+        partfiles = []
+        if hiveptn is not None:
+            srcdir = os.path.join(self.get_config("target_root"), hiveptn)
+            try:
+                partfiles = self.hdfs_mgr.partfiles(srcdir)
+            except (ShellException, HdfsManagerException):
+                logkv(logger, {"msg": "Could not list part files, using configured codec",
+                               "partition": hiveptn}, "warning")
+
+        mode = VerticaManager.copy_mode(codec=self.get_config("mr_output_codec", default=""),
+                                        partfiles=partfiles)
+        logkv(logger, {"msg": "Chose Vertica copy mode", "mode": mode,
+                       "partition": hiveptn}, "info")
+        return mode
+
     def vload_copy(self, _hiveptn, vschema=None, dtable=None, mode="direct"):
         """
         Loads data in Hive partition '_hiveptn' into Vertica table 'dtable' in Vertica
@@ -217,15 +368,16 @@ class LoadHandler(ThriveHandler):
         @param dtable: Vertica data table
 
         @type mode: str
-        @param mode: Copy mode. Possible values: 'direct' or 'decompress'. If mode is
-        'decompress', the data in Hive partition will be decompressed to a plain text
-        format using a single node to a temporary HDFS location. IF the mode='direct'
-        an attempt will be made to directly load compressed data to vertica using the
+        @param mode: Copy mode, as chosen by copy_mode. Possible values: 'direct'
+        (GZIP data), 'bzip' (BZip2 data), 'plain' (uncompressed data) or
+        'decompress'. If mode is 'decompress', the part files in Hive partition will
+        be decompressed concurrently to plain text files in a temporary HDFS
+        location. Otherwise the data is loaded directly to vertica using the
         appropriate filter.
 
         mode='decompress' is required if a the MapReduce job outputs data in a compression
-        format other than GZIP. For example BZip2. In this case, we'll decompress the
-        data before passing it to the COPY command
+        format not supported by a Vertica filter. For example Snappy. In this case,
+        we'll decompress the data before passing it to the COPY command
 
         @rtype: int
         @return: Number of rows loaded to Vertica
@@ -235,22 +387,22 @@ class LoadHandler(ThriveHandler):
                        "mode": mode}, "info")
 
         # Construct the location of source data
-        partfiles = os.path.join(self.get_config("target_root"), _hiveptn, "*")
+        srcdir = os.path.join(self.get_config("target_root"), _hiveptn)
+        partfiles = os.path.join(srcdir, "*")
 
         if mode == "decompress":
             # Construct HDFS tmp target location. This will be needed to decompress data
-            # from Hive partition into a plain text file in HDFS
+            # from Hive partition into plain text files in HDFS
             tmpdir = os.path.join(self.make_tmproot(), _hiveptn)
             self.hdfs_mgr.makedir(tmpdir)
             logkv(logger, {"msg": "Created directory", "directory": tmpdir}, "info")
-            tmpdatafile = os.path.join(tmpdir, "partition_data.txt")
 
-            # Decompress the data for the given Hive partition to plain-text and store it
-            # in tmpdatafile (in HDFS)
-            self.hdfs_mgr.decompress(partfiles, tmpdatafile)
+            # Decompress the part files of the given Hive partition concurrently, to
+            # one plain-text file each in tmpdir (in HDFS)
+            self.hdfs_mgr.decompress_parts(srcdir, tmpdir)
 
-            # In decompress mode, data_location is the decompressed temp file
-            data_location = tmpdatafile
+            # In decompress mode, data_location is the set of decompressed temp files
+            data_location = os.path.join(tmpdir, "*")
         else:
             # In "direct" mode, the data location is simply the partfiles location
             data_location = partfiles
@@ -265,69 +417,114 @@ class LoadHandler(ThriveHandler):
         # Get the name of rejected rows table
         rtable = self.get_config("vertica_rejected_data_table")
 
-        # Load the _datafile to Vertica table
-        rows_loaded = self.vertica_mgr.load(self.primary_namenode, data_location,
-                                            vschema, dtable, rtable, mode=mode)
+        # Load the _datafile to Vertica table. If the load fails, the namenode may
+        # have failed over, so the next load must not rely on the cached namenode.
+        try:
+            rows_loaded = self.vertica_mgr.load(self.primary_namenode, data_location,
+                                                vschema, dtable, rtable, mode=mode)
+        except VerticaManagerException:
+            self.nn_cache.invalidate()
+            raise
         return rows_loaded
 
     def lock(self):
         """
-        Lock the dataset
+        Acquires the lock on the dataset, or takes it over if the lease of its
+        holder has expired, and starts renewing the lease until unlock() is called.
+        The lease is 'lock_lease_secs' (dataset config, default 900) seconds long,
+        so the lock of a crashed load is free again after that time.
 
-        @rtype None
-        @return: None
+        @rtype: bool
+        @return: True if the lock was acquired, False if another load holds it
         """
         dataset_name = self.get_config("dataset_name")
+        lease_secs = int(self.get_config("lock_lease_secs", default="900"))
+        holder = "%s:%d:%s" % (socket.gethostname(), os.getpid(), self.load_id)
         try:
-            self.metadata_mgr.lock(dataset_name)
-            self.locked = True
-            logkv(logger, {"msg": "Acquired lock",
-                           "dataset": dataset_name}, "info")
+            if not self.metadata_mgr.acquire_lock(dataset_name, holder, lease_secs):
+                logkv(logger, {"msg": "Dataset locked by another load",
+                               "dataset": dataset_name,
+                               "lock_status": 1}, "info")
+                self.metadata_mgr.increment_release_attempt(dataset_name)
+                return False
         except MetadataManagerException as ex:
             logkv(logger, {"msg": "Error acquiring lock on dataset",
                            "dataset": dataset_name}, "error", ex)
             raise LoadHandlerException()
 
-    def proceed(self):
+        self.locked = True
+        self.lock_holder = holder
+        self.heartbeat = LeaseHeartbeat(self.metadata_mgr.credentials, dataset_name,
+                                        holder, lease_secs,
+                                        mdmgr_class=type(self.metadata_mgr))
+        self.heartbeat.start()
+        logkv(logger, {"msg": "Acquired lock",
+                       "dataset": dataset_name,
+                       "holder": holder,
+                       "lease_secs": lease_secs}, "info")
+        return True
+
+    def unlock(self):
         """
-        Checks if the current run should be allowed. The load process is not allowed
-        to run if:
-        (1) The output folder that it'd create already exists.
-        (2) There are no new HDFS directories to process since the last successful run.
-        This function has a side effect of assigning values to self.partition_path and
-        self.newdirs.
-        (3) HDFS has no active namenode
+        Stops renewing the lease and releases the lock on the dataset, unless it was
+        taken over by another load
 
-        @rtype: bool
-        @return: _proceed. Value indicating if the current run should proceed
+        @rtype: None
+        @return: None
+        """
+        if self.heartbeat is not None:
+            self.heartbeat.stop()
+            self.heartbeat = None
+        self.metadata_mgr.release(self.get_config("dataset_name"),
+                                  holder=self.lock_holder)
 
+    def check_lease(self):
         """
-        dataset_name = self.get_config("dataset_name")
+        Checks that the lock on the dataset is still held by this load
 
-        # If the dataset is locked, increment release attempt and return.
-        lock_status, release_attempts = self.metadata_mgr.get_lock_status(dataset_name)
-        logkv(logger, {"lock_status": lock_status,
-                       "release_attempts": release_attempts},
-              "info")
+        @rtype: None
+        @return: None
 
-        max_unlock_attempts = int(self.get_config("max_unlock_attempts", configtype="env"))
+        @raises: LoadHandlerException if the lease was taken over by another load
+        """
+        if self.heartbeat is not None and self.heartbeat.lost:
+            logkv(logger, {"msg": "Lost lock on dataset",
+                           "dataset": self.get_config("dataset_name")}, "error")
+            raise LoadHandlerException()
 
-        # Auto unlock dataset if number of release attempts too high
-        if (max_unlock_attempts != -1) and (release_attempts >= max_unlock_attempts):
-            self.metadata_mgr.release(dataset_name)
-            lock_status = 0
-            logkv(logger, {"msg": "Auto-unlocked dataset since # release attempts: %d >= # max_unlock_attempts: %d"
-                                  % (release_attempts, max_unlock_attempts), "dataset": dataset_name}, "warning")
+    def proceed(self):
+        """
+        Checks if the current run should be allowed and locks the dataset if so.
+        Metadata left uncommitted by a previous load is committed once the lock is
+        acquired. The load process is not allowed to run if:
+        (1) HDFS has no active namenode
+        (2) Another load holds the lock on the dataset
+        (3) There are no new HDFS directories to process since the last successful run.
+        This function has a side effect of assigning values to self.newdirs.
+
+        The lock is acquired before the new directories are listed, so that they
+        are not listed while another load is processing them. It is released again
+        if there is nothing to load.
+
+        @rtype: bool
+        @return: _proceed. Value indicating if the current run should proceed
 
-        if lock_status == 1:
-            logkv(logger, {"msg": "Dataset locked by another load",
-                           "dataset": dataset_name}, "info")
+        """
+        # Return if no active namenode is found
+        if not self.primary_namenode:
+            return False
 
-            self.metadata_mgr.increment_release_attempt(dataset_name)
+        if not self.lock():
             return False
-        else:
-            logkv(logger, {"msg": "Dataset unlocked and available for load",
-                           "dataset": dataset_name}, "info")
+
+        # Commit the metadata queued by a previous load that failed to commit it,
+        # before the last directory loaded is looked up
+        try:
+            if self.md_journal.replay():
+                logkv(logger, {"msg": "Committed metadata of previous load"}, "info")
+        except MetadataManagerException as ex:
+            logkv(logger, {"msg": "Error replaying metadata journal"}, "error", ex)
+            raise LoadHandlerException()
 
         # Get a list of new HDFS directories created since the last load and pending
         # for processing. # Return if no directories are pending processing.
@@ -335,37 +532,448 @@ class LoadHandler(ThriveHandler):
 
         if not self.newdirs:
             logkv(logger, {"msg": "No new HDFS directories to process."}, "info")
-            return False
-
-        # Return if no active namenode is found
-        if not self.primary_namenode:
+            self.unlock()
+            self.locked = False
             return False
 
         return True
 
+    def report_command_stats(self):
+        """
+        Logs the count, total, p50 and p95 wall time of the shell commands run so
+        far, per tool and operation. The summary is also written as JSON next to
+        the run log, if there is one.
+
+        @rtype: dict
+        @return: Summary as returned by CommandStats.summary()
+        """
+        summary = command_stats.summary()
+        for operation in sorted(summary.keys()):
+            stats = {"msg": "Command timing", "operation": operation}
+            stats.update(summary[operation])
+            logkv(logger, stats, "info")
+
+        logfile = get_logfile()
+        if logfile:
+            statsfile = "%s_cmdstats.json" % os.path.splitext(logfile)[0]
+            try:
+                with open(statsfile, "w") as sf:
+                    json.dump(summary, sf, indent=2, sort_keys=True)
+            except IOError as ex:
+                logkv(logger, {"msg": "Could not write command timings",
+                               "file": statsfile, "error": ex}, "warning")
+        return summary
+
+    def next_partition_path(self, ptn_label):
+        """
+        Returns the HDFS path of the next subpartition of hour partition
+        'ptn_label'. The next part number is read from the dataset state. The
+        parent partition is listed only if the state has none, or if the path it
+        leads to exists already, e.g. because a load failed before recording it.
+
+        @type ptn_label: str
+        @param ptn_label: Hour partition, e.g. "2016/08/19/14"
+
+        @rtype: str
+        @return: HDFS path of the subpartition
+        """
+        ptn_parent = os.path.join(self.get_config("target_root"), ptn_label)
+
+        part = self.metadata_mgr.get_next_part(self.get_config("dataset_name"),
+                                               self.get_config("hive_table"),
+                                               ptn_label)
+        if part is not None:
+            ptn_path = os.path.join(ptn_parent, str(part))
+            if not self.hdfs_mgr.path_exists(ptn_path):
+                return ptn_path
+
+        # If parent partition doesnt exist, create it with a
+        # subpartition 0, else increment the subpartition number
+        # and create it.
+        if self.hdfs_mgr.path_exists(ptn_parent):
+            subdirs = self.hdfs_mgr.get_subdirs(ptn_parent)
+            last_subdir = sorted(subdirs, key=int)[-1]
+            return os.path.join(ptn_parent, str(int(last_subdir) + 1))
+        return os.path.join(ptn_parent, "0")
+
+    def register_partitions(self, pending_ptns):
+        """
+        Creates the Hive partitions of the chunks in 'pending_ptns' in a single Hive
+        session and queues the Hive portion of the metadata of the partitions
+        created in the metadata journal. We choose to update metadata separately for
+        Hive and Vertica steps because of potential for situations in which Hive
+        loads succeed, but Vertica ones fail. The Vertica process in the next run
+        can then look for all instances of successful Hive loads where Vertica load
+        wasnt triggered and loop through them.
+
+        @type pending_ptns: list
+        @param pending_ptns: Dicts with the 'ptn_path', 'mr_input_dirs', Oozie
+        'counts' and 'hive_start_ts' of each chunk, in load order
+
+        @rtype: None
+        @return: None
+
+        @raises: LoadHandlerException if a partition could not be created. The
+        metadata of the partitions created before it is queued nonetheless.
+        """
+        ptn_paths = [ptn["ptn_path"] for ptn in pending_ptns]
+
+        # Create Hive partitions at ptn_paths
+        logkv(logger, {"msg": "Creating new Hive partitions",
+                       "partitions": len(ptn_paths)}, "info")
+        try:
+            created = self.hive_mgr.create_partitions(ptn_paths, hdfs_mgr=self.hdfs_mgr)
+        except (HiveManagerException, HdfsManagerException) as ex:
+            logkv(logger, {"msg": "Error creating Hive partitions"}, "error", ex)
+            raise LoadHandlerException()
+
+        # Save Hive end timestamp
+        hive_end_ts = iso_format(datetime.now())
+
+        hive_load_metadata = []
+        for ptn in pending_ptns[:len(created)]:
+            logkv(logger, {"msg": "Added Hive partition",
+                           "partition": ptn["ptn_path"]}, "info")
+            logkv(logger, {"msg": "Adding last processed directory to metadata",
+                           "last_processed_dir": ptn["mr_input_dirs"][-1]}, "info")
+            hive_load_metadata.append({
+                "load_id": self.load_id,
+                "load_type": self.load_type,
+                "dataset_name": self.get_config("dataset_name"),
+                "hive_db": self.get_config("hive_db"),
+                "hive_table": self.get_config("hive_table"),
+                "hive_start_ts": ptn["hive_start_ts"],
+                "hive_end_ts": hive_end_ts,
+                "last_load_folder": ptn["mr_input_dirs"][-1],
+                "hive_last_partition": "/".join(parse_partition(ptn["ptn_path"])),
+                "hadoop_records_processed": ptn["counts"]["map_input_records"],
+                "hive_rows_loaded": ptn["counts"]["map_output_records"]
+            })
+
+        # Queue the Hive metadata of all created partitions and the resulting
+        # dataset state
+        try:
+            self.md_journal.record_loads(hive_load_metadata)
+            logkv(logger, {"msg": "Queued Hive metadata",
+                           "partitions": len(hive_load_metadata)}, "info")
+        except MetadataManagerException as ex:
+            logkv(logger, {"msg": "Error updating Hive metadata"}, "error", ex)
+            raise LoadHandlerException()
+
+        if len(created) < len(ptn_paths):
+            logkv(logger, {"msg": "Error creating Hive partition",
+                           "partition": ptn_paths[len(created)]}, "error")
+            raise LoadHandlerException()
+
+    def vload_copy_many(self, hiveptns, vschema=None, dtable=None, mode="direct"):
+        """
+        Loads the data in Hive partitions 'hiveptns' into Vertica table 'dtable' in
+        Vertica schema 'vschema' with a single COPY command using the requested
+        'mode'. 'decompress' mode is not supported.
+
+        'vschema' and 'dtable', if not supplied, are taken from the config file.
+
+        @type hiveptns: list
+        @param hiveptns: Hive partitions to be loaded into Vertica
+
+        @type vschema: str
+        @param vschema: Vertica schema
+
+        @type dtable: str
+        @param dtable: Vertica data table
+
+        @type mode: str
+        @param mode: Copy mode. See vload_copy.
+
+        @rtype: list
+        @return: Number of rows loaded to Vertica from each of 'hiveptns'
+        """
+        logkv(logger, {"msg": "Performing Vertica copy",
+                       "method": "COPY command",
+                       "mode": mode,
+                       "partitions": len(hiveptns)}, "info")
+
+        srcdirs = [os.path.join(self.get_config("target_root"), hiveptn)
+                   for hiveptn in hiveptns]
+
+        if vschema is None:
+            vschema = self.get_config("vertica_schema")
+
+        if dtable is None:
+            dtable = self.get_config("vertica_table")
+
+        rtable = self.get_config("vertica_rejected_data_table")
+
+        # As in vload_copy, a failed load invalidates the cached namenode
+        try:
+            return self.vertica_mgr.load_many(self.primary_namenode, srcdirs,
+                                              vschema, dtable, rtable, mode=mode)
+        except VerticaManagerException:
+            self.nn_cache.invalidate()
+            raise
+
+    def vload_copy_batch(self, hiveptns, dtable=None, mode="direct"):
+        """
+        Loads the data in Hive partitions 'hiveptns' into Vertica table 'dtable' with
+        one COPY command using the requested 'mode'. In 'decompress' mode, each
+        partition is decompressed and loaded by a COPY of its own.
+
+        @type hiveptns: list
+        @param hiveptns: Hive partitions to be loaded into Vertica
+
+        @type dtable: str
+        @param dtable: Vertica data table. Taken from the config file if not supplied.
+
+        @type mode: str
+        @param mode: Copy mode. See vload_copy.
+
+        @rtype: list
+        @return: Number of rows loaded to Vertica from each of 'hiveptns'
+        """
+        if len(hiveptns) == 1 or mode == "decompress":
+            return [self.vload_copy(hiveptn, dtable=dtable, mode=mode)
+                    for hiveptn in hiveptns]
+        return self.vload_copy_many(hiveptns, dtable=dtable, mode=mode)
+
+    def vload_staged(self, hiveptns, mode="direct"):
+        """
+        Loads the data in Hive partitions 'hiveptns' into a staging table created
+        for them, then publishes the staging table to the Vertica table of the
+        dataset. The rows become visible all at once, and a failed load leaves the
+        Vertica table untouched.
+
+        @type hiveptns: list
+        @param hiveptns: Hive partitions to be loaded into Vertica
+
+        @type mode: str
+        @param mode: Copy mode. See vload_copy.
+
+        @rtype: list
+        @return: Number of rows loaded to Vertica from each of 'hiveptns'
+        """
+        vschema = self.get_config("vertica_schema")
+        vtable = self.get_config("vertica_table")
+
+        # Concurrent batches start at different partitions, hence use different
+        # staging tables
+        stagingtable = "%s__staging__%s" % (vtable, hiveptns[0].replace("/", "_"))
+
+        self.vertica_mgr.create_staging_table(vschema, vtable, stagingtable)
+        try:
+            rows = self.vload_copy_batch(hiveptns, dtable=stagingtable, mode=mode)
+        except BaseException:
+            self.drop_staging_table(vschema, stagingtable)
+            raise
+
+        # A staging table which could not be published is kept, since some of its
+        # rows may not have been moved to the Vertica table
+        self.vertica_mgr.publish(vschema, stagingtable, vtable,
+                                 partition_expr=self.get_config(
+                                     "vertica_partition_expr", default=""))
+        self.drop_staging_table(vschema, stagingtable)
+        return rows
+
+    def drop_staging_table(self, vschema, stagingtable):
+        """
+        Drops the staging table 'vschema'.'stagingtable'. A load must not fail
+        because its staging table is left behind; the next load of the same
+        partitions replaces it.
+
+        @type vschema: str
+        @param vschema: Vertica schema
+
+        @type stagingtable: str
+        @param stagingtable: Staging table created by vload_staged
+
+        @rtype: None
+        @return: None
+        """
+        try:
+            self.vertica_mgr.drop_table(vschema, stagingtable)
+        except VerticaManagerException:
+            logkv(logger, {"msg": "Failed to drop staging table",
+                           "staging_table": stagingtable}, "warning")
+
+    def vload_partition_batch(self, hiveptns, mode="direct"):
+        """
+        Loads Hive partitions 'hiveptns' into Vertica using the requested 'mode',
+        with one COPY command for all of them. If 'vertica_staging_load' (dataset config) is
+        true, the COPY goes to a staging table which is then published.
+        Runs on a worker thread of vload_partitions, so load failures are returned
+        rather than raised.
+
+        @type hiveptns: list
+        @param hiveptns: Hive partitions to be loaded into Vertica
+
+        @type mode: str
+        @param mode: Copy mode. See vload_copy.
+
+        @rtype: list
+        @return: (vertica_start_ts, vertica_end_ts, vertica_rows, error) for each of
+        'hiveptns', where error is the exception raised by the load, None if it
+        succeeded
+        """
+        vertica_start_ts = iso_format(datetime.now())
+        try:
+            if self.get_config("vertica_staging_load", default="false").lower() == "true":
+                rows = self.vload_staged(hiveptns, mode=mode)
+            else:
+                rows = self.vload_copy_batch(hiveptns, mode=mode)
+        except ThriveBaseException as ex:
+            return [(vertica_start_ts, None, None, ex)] * len(hiveptns)
+        vertica_end_ts = iso_format(datetime.now())
+        return [(vertica_start_ts, vertica_end_ts, vertica_rows, None)
+                for vertica_rows in rows]
+
+    def vload_partitions(self, pending_ptn_data, mr_processed_records):
+        """
+        Loads the Hive partitions in 'pending_ptn_data' into Vertica. Consecutive
+        partitions are loaded 'vertica_copy_batch_size' (dataset config, default 1)
+        at a time with a single COPY command, and up to 'vertica_load_workers'
+        (dataset config, default 1) COPY commands run at a time. The Vertica
+        metadata of each partition is queued in the metadata journal, in partition
+        order, as soon as its COPY is done. Partitions whose COPY failed are left
+        unprocessed, so that the next load retries them.
+
+        @type pending_ptn_data: list
+        @param pending_ptn_data: (load_id, hive partition, hive rows, MR input
+        records) tuples as returned by MetadataManager.get_unprocessed_partitions
+
+        @type mr_processed_records: int
+        @param mr_processed_records: Records processed by the MapReduce jobs of the
+        chunks in the current batch of partitions
+
+        @rtype: None
+        @return: None
+
+        @raises: LoadHandlerException if any partition failed to load or its
+        metadata could not be queued
+        """
+        if not pending_ptn_data:
+            return
+
+        pending_ptn_data = sorted(pending_ptn_data,
+                                  key=lambda p: [int(x) for x in p[1].split("/")])
+        workers = int(self.get_config("vertica_load_workers", default="1"))
+
+        # The partitions were written with the current codec, so the load mode is
+        # the same for all of them. Decompressed data is staged in a temporary
+        # directory shared by the loads, hence loaded one partition at a time.
+        mode = self.copy_mode()
+        if mode == "decompress":
+            workers = 1
+        copy_batch_size = max(1, int(self.get_config("vertica_copy_batch_size",
+                                                     default="1")))
+        hiveptns = [p[1] for p in pending_ptn_data]
+        copy_batches = [hiveptns[i:i + copy_batch_size]
+                        for i in range(0, len(hiveptns), copy_batch_size)]
+
+        failed = []
+        pool = ThreadPool(max(1, min(workers, len(copy_batches))))
+        try:
+            # imap returns the results in partition order as the COPYs finish
+            results = chain.from_iterable(pool.imap(partial(self.vload_partition_batch,
+                                                            mode=mode),
+                                                    copy_batches))
+            for (load_id, hiveptn, hive_rows, mr_input_records), \
+                    (vertica_start_ts, vertica_end_ts, vertica_rows, error) \
+                    in izip(pending_ptn_data, results):
+                if error is not None:
+                    logkv(logger, {"msg": "Vertica load failed",
+                                   "partition": hiveptn}, "error", error)
+                    failed.append(hiveptn)
+                    continue
+
+                logkv(logger, {"msg": "Loaded hive partition",
+                               "partition": hiveptn}, "info")
+
+                # Record each partition as soon as its COPY is done, so that a load
+                # killed while later COPYs run does not load it again
+                try:
+                    self.md_journal.update_loads([((load_id, hiveptn), {
+                        "vertica_db": self.get_config("vertica_db"),
+                        "vertica_schema": self.get_config("vertica_schema"),
+                        "vertica_table": self.get_config("vertica_table"),
+                        "vertica_start_ts": vertica_start_ts,
+                        "vertica_end_ts": vertica_end_ts,
+                        "vertica_last_partition": hiveptn,
+                        "vertica_rows_loaded": vertica_rows,
+                        "status": "SUCCESS"
+                    })])
+                except MetadataManagerException as ex:
+                    logkv(logger, {"msg": "Error updating Vertica metadata"}, "error", ex)
+                    raise LoadHandlerException()
+
+                # Log the load summary, will be consumed by Splunk
+                logkv(logger, {
+                    "msg": "load summary",
+                    "mr_input_records": mr_input_records,
+                    "mr_processed_records": mr_processed_records,
+                    "hive_rows_loaded": hive_rows,
+                    "vertica_rows_loaded": vertica_rows,
+                    "percent_loss_mr": percentdiff(mr_processed_records, mr_input_records),
+                    "percent_loss_hv": percentdiff(vertica_rows, hive_rows)
+                }, "info")
+            pool.close()
+        except BaseException:
+            # Do not start the COPYs still queued
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+        if failed:
+            logkv(logger, {"msg": "Vertica load failed for partitions",
+                           "partitions": failed}, "error")
+            raise LoadHandlerException()
+
+    def commit_metadata(self):
+        """
+        Commits the metadata queued in the metadata journal in a single transaction
+
+        @rtype: None
+        @return: None
+
+        @raises: LoadHandlerException if the metadata could not be committed. It is
+        committed by the next load then.
+        """
+        try:
+            self.md_journal.commit()
+        except MetadataManagerException as ex:
+            logkv(logger, {"msg": "Error committing metadata",
+                           "journal": self.md_journal.journalfile}, "error", ex)
+            raise LoadHandlerException()
+
     def execute(self, load_type="scheduled"):
         """
         Top level method for LoadHandler; manages the load workflow.
         The method (1) launches and monitors Oozie Hadoop streaming MapReduce job (2)
         creates a new Hive partition (3) Performs incremental Vertica load
 
+        @type load_type: str
+        @param load_type: Type of load recorded in the metadata, "scheduled" or
+        "replay"
+
         @rtype: bool
-        @return: None
+        @return: True if new directories were loaded, False if the load did not
+        proceed
         """
 
         dataset_name = self.get_config("dataset_name")
         self.load_type = load_type
+
+        # Reuse the results of repeated read-only HDFS and Hive commands during
+        # this load
+        command_cache.enable()
+        pending_ptns = []
         try:
             # End load process if conditions for proceeding are invalidated
             if not self.proceed():
                 logkv(logger, {"msg": "Ending load"}, "info")
-                return
+                return False
 
             logkv(logger, {"msg": "Proceeding with load"}, "info")
 
-            # Acquire lock on the dataset
-            self.lock()
-
             # Chunk the new directories for processing
             dirchunks = chunk_dirs(self.newdirs,
                                    groupby=self.get_config("mr_chunk_size"))
@@ -373,24 +981,19 @@ class LoadHandler(ThriveHandler):
             chunk_labels_asc = sorted(dirchunks.keys(),
                                       key=lambda x: int("".join(x.split("/"))))
 
+            # Hive partitions of the chunks processed so far are added together. A
+            # batch size of 0 adds all partitions of this load in one batch.
+            ptn_batch_size = int(self.get_config("hive_partition_batch_size", default="0"))
+
             for ptn_label in chunk_labels_asc:
+                # Stop if another load took over the lock on the dataset
+                self.check_lease()
+
                 # Save Hive end timestamp
                 hive_start_ts = iso_format(datetime.now())
 
                 mr_input_dirs = dirchunks.get(ptn_label)
-                ptn_parent = os.path.join(self.get_config("target_root"),
-                                          ptn_label)
-
-                # If parent partition doesnt exist, create it with a
-                # subpartition 0, else increment the subpartition number
-                # and create it.
-                if self.hdfs_mgr.path_exists(ptn_parent):
-                    subdirs = self.hdfs_mgr.get_subdirs(ptn_parent)
-                    last_subdir = sorted(subdirs, key=int)[-1]
-                    ptn_path = os.path.join(ptn_parent,
-                                            str(int(last_subdir) + 1))
-                else:
-                    ptn_path = os.path.join(ptn_parent, "0")
+                ptn_path = self.next_partition_path(ptn_label)
 
                 # Generate properties file for this load
                 logkv(logger, {"msg": "Generating properties file for load"}, "info")
@@ -408,6 +1011,9 @@ class LoadHandler(ThriveHandler):
                     # Poll job status every 10 seconds until the job finishes
                     self.oozie_mgr.poll(jobid, interval=10)
 
+                    # The workflow wrote its output outside of HdfsManager
+                    command_cache.invalidate(ptn_path)
+
                     # Extract Hadoop statistics
                     counts = self.oozie_mgr.get_counts(jobid)
 
@@ -420,158 +1026,88 @@ class LoadHandler(ThriveHandler):
                     logkv(logger, {"msg": "Oozie job failed"}, "error")
                     raise LoadHandlerException()
 
-                # Create a Hive partition at partition_path (computed earlier in this function)
-                logkv(logger, {"msg": "Creating new Hive partition"}, "info")
-                try:
-                    # Create new hive partition
-                    self.hive_mgr.create_partition(ptn_path)
-                    logkv(logger, {"msg": "Added Hive partition",
-                                   "partition": ptn_path}, "info")
-                except HiveManagerException as ex:
-                    logkv(logger, {"msg": "Error creating Hive partition"},
-                          "error", ex)
-                    raise LoadHandlerException()
-
                 # Grant read/execute permissions on the newly created partition
+                # and on those of its ancestors not yet granted in this load
                 logkv(logger, {"msg": "Granting read/execute permissions on partition"},
                       "info")
                 try:
-                    self.hdfs_mgr.grantall("rx", self.get_config("target_root"))
+                    self.hdfs_mgr.grant_partition("rx", ptn_path,
+                                                  self.get_config("target_root"),
+                                                  self.granted_paths)
                     logkv(logger, {"msg": "Granted read/execute permissions",
-                                   "path": self.get_config("target_root")}, "info")
+                                   "path": ptn_path}, "info")
                 except HdfsManagerException as ex:
                     logkv(logger,
                           {"msg": "Error granting permissions on HDFS path"},
                           "error", ex)
                     raise LoadHandlerException()
 
-                # Save Hive end timestamp
-                hive_end_ts = iso_format(datetime.now())
-
-                # Update the HIVE portion of the metadata. We choose to update metadata
-                # separately for Hive and Vertica steps because of potential for situations
-                # in which Hive loads succeed, but Vertica ones fail. The Vertica process in
-                # the next run can then look for all instances of successful Hive loads where
-                # Vertica load wasnt triggered and loop through them.
-                logkv(logger, {"msg": "Adding last processed directory to metadata",
-                               "last_processed_dir": mr_input_dirs[-1]}, "info")
+                pending_ptns.append({"ptn_path": ptn_path,
+                                     "mr_input_dirs": mr_input_dirs,
+                                     "counts": counts,
+                                     "mr_processed_records": mr_processed_records,
+                                     "hive_start_ts": hive_start_ts})
 
-                try:
-                    hive_load_metadata = {
-                        "load_id": self.load_id,
-                        "load_type": self.load_type,
-                        "dataset_name": dataset_name,
-                        "hive_db": self.get_config("hive_db"),
-                        "hive_table": self.get_config("hive_table"),
-                        "hive_start_ts": hive_start_ts,
-                        "hive_end_ts": hive_end_ts,
-                        "last_load_folder": mr_input_dirs[-1],
-                        "hive_last_partition": "/".join(parse_partition(ptn_path)),
-                        "hadoop_records_processed": counts["map_input_records"],
-                        "hive_rows_loaded": counts["map_output_records"]
-                    }
-
-                    self.metadata_mgr.insert(hive_load_metadata, mdtype="load")
-                    logkv(logger, {"msg": "Successfully updated metadata"}, "info")
-                except MetadataManagerException as ex:
-                    logkv(logger, {"msg": "Error updating Hive metadata"},
-                          "error", ex)
-                    raise LoadHandlerException()
+                # Add the Hive partitions once the batch is full or the last chunk
+                # is processed
+                if len(pending_ptns) != ptn_batch_size \
+                        and ptn_label != chunk_labels_asc[-1]:
+                    continue
+                batch, pending_ptns = pending_ptns, []
+                self.register_partitions(batch)
+                batch_processed_records = sum(ptn["mr_processed_records"]
+                                              for ptn in batch)
 
                 # Exit if vertica load is not requested
                 if self.get_config("vertica_load").lower() != "true":
                     logkv(logger, {"msg": "Vertica load not requested",
                                    "dataset": dataset_name}, "info")
+                    self.commit_metadata()
                     continue
 
-                # Get unprocessed Hive partitions
-                pending_ptn_data = self.metadata_mgr.get_unprocessed_partitions(
+                # Get unprocessed Hive partitions, committed or queued
+                pending_ptn_data = list(self.metadata_mgr.get_unprocessed_partitions(
                     self.get_config("hive_db"),
-                    self.get_config("hive_table"))
+                    self.get_config("hive_table"))) \
+                    + self.md_journal.unprocessed_partitions()
 
                 logkv(logger, {"msg": "Pending partition to be loaded to Vertica",
                                "partitions": [p[1] for p in pending_ptn_data]}, "info")
 
-                # Loop through Hive partitions that are currently not loaded in Vertica
-                for load_id, hiveptn, hive_rows, mr_input_records in pending_ptn_data:
-                    try:
-                        # Get vertica_start_ts for this partition
-                        vertica_start_ts = iso_format(datetime.now())
-
-                        # Load the data
-                        vertica_rows = self.vload_copy(hiveptn, mode="direct")
-
-                        # Get vertica_end_ts for this partition
-                        vertica_end_ts = iso_format(datetime.now())
-
-                        # Update Vertica metadata if requested
-                        try:
-                            # Compose Vertica metadata to update for load of this partition
-                            vertica_metadata = {
-                                "vertica_db": self.get_config("vertica_db"),
-                                "vertica_schema": self.get_config("vertica_schema"),
-                                "vertica_table": self.get_config("vertica_table"),
-                                "vertica_start_ts": vertica_start_ts,
-                                "vertica_end_ts": vertica_end_ts,
-                                "vertica_last_partition": hiveptn,
-                                "vertica_rows_loaded": vertica_rows,
-                                "status": "SUCCESS"
-                            }
-
-                            # Update metadata table with generated metadata above
-                            self.metadata_mgr.update((load_id, hiveptn),
-                                                     vertica_metadata,
-                                                     mdtype="load")
-                            logkv(logger, {"msg": "Loaded hive partition",
-                                           "partition": hiveptn}, "info")
-                        except MetadataManagerException as ex:
-                            logkv(logger,
-                                  {"msg": "Error updating Vertica metadata"},
-                                  "error", ex)
-                            raise LoadHandlerException()
-
-                        # try:
-                        #     # Get start and end times for load
-                        #     logkv(logger, {"msg": "Getting start and end times for newly loaded dirs"}, "info")
-                        #     source_start_ts = dirname_to_dto(mr_input_dirs[0])
-                        #     source_end_ts = dirname_to_dto(mr_input_dirs[-1]) + CAMUS_FOLDER_FREQ
-                        #
-                        #     # Get counts for Jetty and Kafka
-                        #     logkv(logger, {"msg": "Getting Jetty and Kafka counts"}, "info")
-                        #     jetty_events = self.newrelic_mgr.get_count("jetty", source_start_ts, source_end_ts)
-                        #     kafka_events = self.newrelic_mgr.get_count("kafka", source_start_ts, source_end_ts)
-                        # except NewRelicManagerException as ex:
-                        #     jetty_events = kafka_events = ""
-                        #     logkv(logger, {"msg": "Error querying NewRelic"},
-                        #           "warning", ex)
-
-                        # Log the load summary, will be consumed by Splunk
-                        logkv(logger, {
-                            "msg": "load summary",
-                            # "jetty_events": jetty_events,
-                            # "kafka_events": kafka_events,
-                            "mr_input_records": mr_input_records,
-                            "mr_processed_records": mr_processed_records,
-                            "hive_rows_loaded": hive_rows,
-                            "vertica_rows_loaded": vertica_rows,
-                            "percent_loss_mr": percentdiff(mr_processed_records, mr_input_records),
-                            "percent_loss_hv": percentdiff(vertica_rows, hive_rows)
-                        }, "info")
-
-                    except VerticaManagerException as ex:
-                        logkv(logger, {"msg": "Vertica load failed"},
-                              "error", ex)
-                        raise LoadHandlerException()
+                # Load the Hive partitions that are currently not loaded in Vertica
+                self.vload_partitions(pending_ptn_data, batch_processed_records)
+
+                # Commit the Hive and Vertica metadata of the batch at once
+                self.commit_metadata()
+            return True
         except ThriveBaseException as ex:
             logkv(logger, {"msg": "Thrive load failed"}, "error", ex)
+
+            # Keep the partitions of the chunks processed before the failure
+            if pending_ptns:
+                try:
+                    self.register_partitions(pending_ptns)
+                except LoadHandlerException:
+                    pass
             raise LoadHandlerException()
         except BaseException as bex:
             logkv(logger, {"msg": "Thrive load failed because of system exception",
                            "exception": bex}, "error")
             raise LoadHandlerException()
         finally:
+            # Commit the metadata of the partitions loaded before a failure while
+            # the dataset is still locked
+            if self.md_journal.pending():
+                try:
+                    self.commit_metadata()
+                except LoadHandlerException:
+                    pass
+
             if self.locked:
                 logkv(logger, {"msg": "Releasing lock"}, "info")
-                self.metadata_mgr.release(dataset_name)
+                self.unlock()
                 logkv(logger, {"msg": "Ending load", "dataset": dataset_name}, "info")
 
+            command_cache.disable()
+            self.report_command_stats()
+
@@ -12,13 +12,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import pyodbc
+import os
+import re
+import json
 import logging
 from thrive.utils import logkv
 from thrive.exceptions import MetadataManagerException
 
 logger = logging.getLogger(__name__)
 
+# Metadata table written for each metadata type
+MDTABLES = {
+    "setup": "thrive_setup",
+    "load": "thrive_load_metadata",
+    "lock": "thrive_dataset_lock",
+    "schema": "thrive_schema_version"
+}
+
+# Primary key columns matched by updates for each metadata type
+MDKEYS = {
+    "setup": ("dataset_id",),
+    "load": ("load_id", "hive_last_partition")
+}
+
+# Migration statements creating schema objects, checked for objects already created
+CREATE_INDEX = re.compile(r"create\s+index\s+(\w+)\s+on\s+(\w+)", re.IGNORECASE)
+CREATE_TABLE = re.compile(r"create\s+table\s+(\w+)", re.IGNORECASE)
+ADD_COLUMNS = re.compile(r"(alter\s+table\s+(\w+))\s+(add\s+column\s.*)$",
+                         re.IGNORECASE | re.DOTALL)
+ADD_COLUMN_SEP = re.compile(r",\s*(?=add\s+column\s)", re.IGNORECASE)
+
 
 class MetadataManager(object):
     """
@@ -44,6 +67,8 @@ class MetadataManager(object):
         self.credentials = credentials
 
         try:
+            # Imported here so that the SQLite backend does not need pyodbc
+            import pyodbc
             self.connection = pyodbc.connect(
                 "DRIVER={%s};SERVER=%s;PORT=%s;UID=%s;PWD=%s;DB=%s"
                 % (self.credentials["dbtype"],
@@ -58,41 +83,151 @@ class MetadataManager(object):
                            "credentials": credentials}, "error")
             raise MetadataManagerException()
 
-    def execute(self, qry):
+    def execute(self, qry, params=None):
         """
         Function for executing queries which dont return results.
         Sends SQL query "qry" to metadata database.
 
         @type qry: str
-        @param qry: SQL query string
+        @param qry: SQL query string, with a '?' marker for each of 'params'
 
-        @rtype: None
-        @return: None
+        @type params: list
+        @param params: Values bound to the markers in 'qry'
+
+        @rtype: int
+        @return: Number of rows affected by 'qry'
         """
         try:
             cursor = self.connection.cursor()
-            cursor.execute(qry)
+            if params is None:
+                cursor.execute(qry)
+            else:
+                cursor.execute(qry, params)
+            rows = cursor.rowcount
             self.connection.commit()
             cursor.close()
+            return rows
         except Exception:
             logkv(logger, {"msg": "SQL execution failed",
                            "query": qry}, "error")
             raise MetadataManagerException()
 
-    def execute_return(self, qry):
+    def executemany(self, qry, rows):
+        """
+        Runs the parameterized query "qry" once for each item of "rows" in a single
+        transaction. The statement is prepared once and reused for all rows. If any
+        of them fails, the transaction is rolled back.
+
+        @type qry: str
+        @param qry: SQL query string with '?' parameter markers
+
+        @type rows: list
+        @param rows: Sequences of values bound to the markers of 'qry'
+
+        @rtype: None
+        @return: None
+        """
+        self.execute_transaction([(qry, rows)])
+
+    def execute_transaction(self, batches):
+        """
+        Runs each (qry, rows) pair of 'batches' in order as executemany() does, all
+        in a single transaction
+
+        @type batches: list
+        @param batches: (SQL query string, sequences of values) pairs
+
+        @rtype: None
+        @return: None
+        """
+        batches = [(qry, rows) for qry, rows in batches if rows]
+        if not batches:
+            return
+
+        try:
+            cursor = self.connection.cursor()
+            try:
+                for qry, rows in batches:
+                    cursor.executemany(qry, rows)
+                self.connection.commit()
+            finally:
+                cursor.close()
+        except Exception as ex:
+            try:
+                self.connection.rollback()
+            except Exception:
+                pass
+            logkv(logger, {"msg": "SQL execution failed",
+                           "query": qry,
+                           "rows": len(rows),
+                           "error": ex}, "error")
+            raise MetadataManagerException()
+
+    @staticmethod
+    def _mdtable(mdtype, mdtypes):
+        """
+        Returns the metadata table for 'mdtype' if it is one of 'mdtypes'
+
+        @rtype: str
+        @return: Metadata table name
+        """
+        if mdtype not in mdtypes:
+            logkv(logger, {"msg": "Invalid metadata type",
+                           "mdtype": mdtype}, "error")
+            raise MetadataManagerException()
+        return MDTABLES[mdtype]
+
+    def _insert_qry(self, columns, mdtype):
+        """
+        Returns the parameterized insert statement setting 'columns' of the
+        'mdtype' metadata table
+
+        @rtype: str
+        @return: SQL query string
+        """
+        mdtable = self._mdtable(mdtype, MDTABLES)
+        return "insert into %s (%s) values (%s);" \
+               % (mdtable, ",".join(columns), ",".join("?" * len(columns)))
+
+    def _update_qry(self, columns, mdtype):
+        """
+        Returns the parameterized update statement setting 'columns' of the row of
+        the 'mdtype' metadata table with a given primary key. The primary key values
+        are bound after the column values.
+
+        @rtype: str
+        @return: SQL query string
+        """
+        mdtable = self._mdtable(mdtype, MDKEYS)
+        keys = MDKEYS[mdtype]
+        return '''update %s
+                  set %s
+                  where (%s) = (%s);
+               ''' % (mdtable,
+                      ",".join("%s=?" % col for col in columns),
+                      ", ".join(keys),
+                      ", ".join("?" * len(keys)))
+
+    def execute_return(self, qry, params=None):
         """
         Function for executing queries which return results.
         Sends SQL query "qry" to metadata database.
 
         @type qry: str
-        @param qry: SQL query string
+        @param qry: SQL query string, with a '?' marker for each of 'params'
+
+        @type params: list
+        @param params: Values bound to the markers in 'qry'
 
         @rtype: list
         @return: List of tuples
         """
         try:
             cursor = self.connection.cursor()
-            cursor.execute(qry)
+            if params is None:
+                cursor.execute(qry)
+            else:
+                cursor.execute(qry, params)
             self.connection.commit()
             results = cursor.fetchall()
             cursor.close()
@@ -107,7 +242,8 @@ class MetadataManager(object):
         Inserts data from key-value pairs in "data" into "table"
 
         @type mdtype: str
-        @param mdtype: Type of insert. Possible values "load" or "setup"
+        @param mdtype: Type of insert. Possible values "load", "setup", "lock" or
+        "schema"
 
         @type data: dict
         @param data: key-value pairs with keys = column name
@@ -115,37 +251,40 @@ class MetadataManager(object):
         @rtype: None
         @return: None
         """
-
-        if mdtype == "setup":
-            mdtable = "thrive_setup"
-        elif mdtype == "load":
-            mdtable = "thrive_load_metadata"
-        elif mdtype == "lock":
-            mdtable = "thrive_dataset_lock"
-        else:
-            logkv(logger, {"msg": "Invalid metadata type",
-                           "mdtype": mdtype}, "error")
-            raise MetadataManagerException()
-
-        columns = ",".join(data.keys())
-        values = ",".join("'%s'" % v for v in data.values())
-
-        insert_qry = "insert into %s (%s) values (%s);" \
-                     % (mdtable, columns, values)
+        columns = data.keys()
+        insert_qry = self._insert_qry(columns, mdtype)
 
         try:
-            self.execute(insert_qry)
-        except pyodbc.IntegrityError, ie:
-            logkv(logger, {"msg": "Duplicate primary key insertion",
-                           "query": insert_qry,
-                           "error": ie}, "error")
-            raise MetadataManagerException()
-        except pyodbc.Error, poe:
+            self.execute(insert_qry, [data[col] for col in columns])
+        except Exception as ex:
+            # Duplicate primary keys end up here as well
             logkv(logger, {"msg": "Could not insert data",
                            "query": insert_qry,
-                           "error": poe}, "error")
+                           "error": ex}, "error")
             raise MetadataManagerException()
 
+    def insert_many(self, rows, mdtype=None):
+        """
+        Inserts each dict of "rows" into the "mdtype" metadata table in a single
+        transaction. All dicts must have the same keys.
+
+        @type rows: list
+        @param rows: Dicts of key-value pairs with keys = column name
+
+        @type mdtype: str
+        @param mdtype: Type of insert. Possible values "load", "setup", "lock" or
+        "schema"
+
+        @rtype: None
+        @return: None
+        """
+        if not rows:
+            return
+
+        columns = rows[0].keys()
+        insert_qry = self._insert_qry(columns, mdtype)
+        self.executemany(insert_qry, [[row[col] for col in columns] for row in rows])
+
     def update(self, pk, data, mdtype=None):
         """
         Updates a row with id 'id' with 'data'. If mdtype='setup', thrive_setup
@@ -163,34 +302,169 @@ class MetadataManager(object):
         @rtype: None
         @return: None
         """
+        self.update_many([(pk, data)], mdtype=mdtype)
 
-        if mdtype == "setup":
-            mdtable = "thrive_setup"
-            filter_condition = "dataset_id = '%s'" % pk[0]
-        elif mdtype == "load":
-            mdtable = "thrive_load_metadata"
-            filter_condition = "(load_id, hive_last_partition) = ('%s', '%s')" % pk
-        else:
-            logkv(logger, {"msg": "Invalid metadata type",
-                           "mdtype": mdtype}, "error")
-            raise MetadataManagerException()
+    def update_many(self, updates, mdtype=None):
+        """
+        Applies each (pk, data) pair of 'updates' as in update(), in a single
+        transaction. All 'data' dicts must have the same keys.
+
+        @type updates: list
+        @param updates: (primary key tuple, dict of column values) pairs
+
+        @type mdtype: str
+        @param mdtype: 'load' or 'setup'
+
+        @rtype: None
+        @return: None
+        """
+        if not updates:
+            return
 
-        updates = ",".join('%s="%s"' % (key, val) for key, val in data.items())
-        update_qry = '''update %s
-                        set %s
-                        where %s;
-                     ''' % (mdtable, updates, filter_condition)
+        update_qry, rows = self.update_batch(updates, mdtype)
         try:
-            self.execute(update_qry)
+            self.executemany(update_qry, rows)
         except Exception as ex:
             logkv(logger, {"msg": "Could not update data",
                            "query": update_qry,
                            "error": ex}, "error")
             raise MetadataManagerException()
 
+    def update_batch(self, updates, mdtype=None):
+        """
+        Returns the statement and the rows of values that apply the (pk, data)
+        pairs of 'updates' as in update_many()
+
+        @type updates: list
+        @param updates: (primary key tuple, dict of column values) pairs
+
+        @type mdtype: str
+        @param mdtype: 'load' or 'setup'
+
+        @rtype: tuple
+        @return: (SQL query string, sequences of values) pair
+        """
+        columns = updates[0][1].keys()
+        update_qry = self._update_qry(columns, mdtype)
+        nkeys = len(MDKEYS[mdtype])
+        return update_qry, [[data[col] for col in columns] + list(pk[:nkeys])
+                            for pk, data in updates]
+
+    def load_batches(self, rows):
+        """
+        Returns the statements and the rows of values that record the load metadata
+        rows in 'rows' as in record_loads(). Recording the same rows again leaves
+        the metadata unchanged, so that the statements can be replayed.
+
+        @type rows: list
+        @param rows: Dicts of 'thrive_load_metadata' columns, in load order
+
+        @rtype: list
+        @return: (SQL query string, sequences of values) pairs
+        """
+        if not rows:
+            return []
+
+        columns = rows[0].keys()
+        lastdirs, next_parts = [], []
+        for row in rows:
+            key = (row["dataset_name"], row["hive_table"])
+            lastdirs.append(key + ("lastdir:%s" % row["load_type"],
+                                   row["last_load_folder"]))
+            hour, part = row["hive_last_partition"].rsplit("/", 1)
+            next_parts.append(key + ("part:%s" % hour, str(int(part) + 1)))
+
+        insert_qry = "%s on duplicate key update %s;" \
+                     % (self._insert_qry(columns, "load").rstrip(";"),
+                        ",".join("%s=values(%s)" % (col, col) for col in columns))
+        state_qry = '''
+                       insert into thrive_dataset_state
+                       (dataset_name, hive_table, state_key, state_value)
+                       values (?, ?, ?, ?)
+                       on duplicate key update state_value = %s;
+                    '''
+        return [
+            (insert_qry, [[row[col] for col in columns] for row in rows]),
+            (state_qry % "values(state_value)", lastdirs),
+            (state_qry % "cast(greatest(cast(state_value as unsigned), "
+                         "cast(values(state_value) as unsigned)) as char)", next_parts)
+        ]
+
+    def record_loads(self, rows):
+        """
+        Inserts the load metadata rows in 'rows', in load order, and updates the
+        state of their datasets in the same transaction: the last Camus directory
+        loaded per load type, and the next part number of each hour partition.
+
+        @type rows: list
+        @param rows: Dicts of 'thrive_load_metadata' columns, as for insert_many
+        with mdtype 'load'
+
+        @rtype: None
+        @return: None
+        """
+        self.execute_transaction(self.load_batches(rows))
+
+    def get_state(self, dataset_name, hive_table, state_key):
+        """
+        Returns the value of 'state_key' in the state of a dataset, as recorded by
+        record_loads
+
+        @type dataset_name: str
+        @param dataset_name: Dataset name
+
+        @type hive_table: str
+        @param hive_table: Hive table of the dataset
+
+        @type state_key: str
+        @param state_key: 'lastdir:<load type>' or 'part:<YYYY/MM/DD/HH>'
+
+        @rtype: str
+        @return: Value of 'state_key', None if it was never recorded
+        """
+        qry = '''
+                 select state_value
+                 from thrive_dataset_state
+                 where dataset_name = ?
+                 and hive_table = ?
+                 and state_key = ?;
+              '''
+        try:
+            rows = self.execute_return(qry, [dataset_name, hive_table, state_key])
+        except Exception as ex:
+            logkv(logger, {"msg": "Failed to get dataset state",
+                           "dataset": dataset_name,
+                           "table": hive_table,
+                           "key": state_key,
+                           "error": ex}, "error")
+            raise MetadataManagerException()
+        return rows[0][0] if rows else None
+
+    def get_next_part(self, dataset_name, hive_table, hour):
+        """
+        Returns the next part number of hour partition 'hour' of a dataset
+
+        @type dataset_name: str
+        @param dataset_name: Dataset name
+
+        @type hive_table: str
+        @param hive_table: Hive table of the dataset
+
+        @type hour: str
+        @param hour: Hour partition, e.g. "2016/08/19/14"
+
+        @rtype: int
+        @return: Part number following the last part loaded into 'hour', None if no
+        part of 'hour' was recorded
+        """
+        part = self.get_state(dataset_name, hive_table, "part:%s" % hour)
+        return int(part) if part is not None else None
+
     def get_lastdir(self, dataset_name, hive_table, load_type):
         """
-        Returns the last directory processed for "topic" by querying "table"
+        Returns the last directory processed for "topic". It is read from the
+        dataset state, or from the load history if the state has none, e.g. after
+        a rollback.
 
         @type dataset_name: str
         @param dataset_name: dataset being loaded
@@ -198,19 +472,22 @@ class MetadataManager(object):
         @rtype: str
         @return: Last Camus directory loaded
         """
+        lastdir = self.get_state(dataset_name, hive_table, "lastdir:%s" % load_type)
+        if lastdir is not None:
+            return lastdir
 
         qry = '''
                  select last_load_folder
                  from thrive_load_metadata
-                 where dataset_name = '%s'
-                 and hive_table = '%s'
-                 and load_type = '%s'
+                 where dataset_name = ?
+                 and hive_table = ?
+                 and load_type = ?
                  order by hive_end_ts desc
                  limit 1;
-              ''' % (dataset_name, hive_table, load_type)
+              '''
 
         try:
-            return self.execute_return(qry)[0][0]
+            return self.execute_return(qry, [dataset_name, hive_table, load_type])[0][0]
         except Exception as ex:
             logkv(logger, {"msg": "Failed to get last dir for dataset",
                            "dataset": dataset_name,
@@ -232,12 +509,12 @@ class MetadataManager(object):
         """
         thrive_tables = ("thrive_setup",
                          "thrive_load_metadata",
-                         "thrive_dataset_lock")
+                         "thrive_dataset_lock",
+                         "thrive_dataset_state")
         try:
             for md_table in thrive_tables:
-                purge_setup_qry = "delete from %s where dataset_name = '%s';" \
-                                  % (md_table, dataset_name)
-                self.execute(purge_setup_qry)
+                purge_setup_qry = "delete from %s where dataset_name = ?;" % md_table
+                self.execute(purge_setup_qry, [dataset_name])
         except Exception as ex:
             logkv(logger, {"msg": "Purge failed for dataset",
                            "dataset": dataset_name,
@@ -263,13 +540,13 @@ class MetadataManager(object):
                          hive_rows_loaded,
                          hadoop_records_processed
                   from thrive_load_metadata
-                  where hive_db = '%s'
-                  and hive_table = '%s'
+                  where hive_db = ?
+                  and hive_table = ?
                   and hive_last_partition <> ''
                   and vertica_last_partition is NULL;
-              ''' % (hive_db, hive_table)
+              '''
         try:
-            return self.execute_return(qry)
+            return self.execute_return(qry, [hive_db, hive_table])
         except Exception as ex:
             logkv(logger, {"msg": "Failed to get unprocessed partitions of table",
                            "db": hive_db,
@@ -292,10 +569,10 @@ class MetadataManager(object):
         lock_qry = '''
                       update thrive_dataset_lock
                       set locked = TRUE, release_attempts = 0
-                      where  dataset_name = '%s';
-                   ''' % dataset_name
+                      where  dataset_name = ?;
+                   '''
         try:
-            self.execute(lock_qry)
+            self.execute(lock_qry, [dataset_name])
         except Exception as ex:
             logkv(logger, {"msg": "Failed to set dataset lock",
                            "dataset": dataset_name,
@@ -303,23 +580,129 @@ class MetadataManager(object):
                            "error": ex}, "error")
             raise MetadataManagerException()
 
-    def release(self, dataset_name):
+    def _holds_lock(self, dataset_name, holder):
         """
-        Releases lock on a dataset.
+        Checks if 'holder' holds the lock on the dataset. Used when a lock update
+        reports no affected row: MySQL counts only the rows actually changed, so
+        that a holder updating its lock within the same second sees 0 rows.
+
+        @type dataset_name: str
+        @param dataset_name: Name of the dataset
+
+        @type holder: str
+        @param holder: Id of the load
+
+        @rtype: bool
+        @return: True if 'holder' holds the lock
+        """
+        holder_qry = '''
+                        select holder
+                        from thrive_dataset_lock
+                        where dataset_name = ? and locked = TRUE;
+                     '''
+        rows = self.execute_return(holder_qry, [dataset_name])
+        return bool(rows) and rows[0][0] == holder
+
+    def acquire_lock(self, dataset_name, holder, lease_secs):
+        """
+        Locks the dataset for 'holder' with a single compare-and-set update. The lock
+        is acquired if the dataset is unlocked, if the lease of the current holder
+        has expired, or if 'holder' already holds it. The lease expires 'lease_secs'
+        seconds after it was acquired or last renewed.
+
+        @type dataset_name: str
+        @param dataset_name: Name of the dataset to be locked
+
+        @type holder: str
+        @param holder: Id of the load acquiring the lock
+
+        @type lease_secs: int
+        @param lease_secs: Length of the lease in seconds
+
+        @rtype: bool
+        @return: True if the lock was acquired
+        """
+        acquire_qry = '''
+                         update thrive_dataset_lock
+                         set locked = TRUE, release_attempts = 0, holder = ?,
+                             lease_expiry = timestampadd(second, ?, now())
+                         where dataset_name = ?
+                         and (locked = FALSE or lease_expiry < now() or holder = ?);
+                      '''
+        try:
+            if self.execute(acquire_qry, [holder, lease_secs, dataset_name,
+                                          holder]) == 1:
+                return True
+            return self._holds_lock(dataset_name, holder)
+        except Exception as ex:
+            logkv(logger, {"msg": "Failed to acquire dataset lock",
+                           "dataset": dataset_name,
+                           "holder": holder,
+                           "query": acquire_qry,
+                           "error": ex}, "error")
+            raise MetadataManagerException()
+
+    def renew_lock(self, dataset_name, holder, lease_secs):
+        """
+        Extends the lease of the lock held by 'holder' on the dataset to 'lease_secs'
+        seconds from now
+
+        @type dataset_name: str
+        @param dataset_name: Name of the locked dataset
+
+        @type holder: str
+        @param holder: Id of the load holding the lock
+
+        @type lease_secs: int
+        @param lease_secs: Length of the lease in seconds
+
+        @rtype: bool
+        @return: False if 'holder' does not hold the lock anymore
+        """
+        renew_qry = '''
+                       update thrive_dataset_lock
+                       set lease_expiry = timestampadd(second, ?, now())
+                       where dataset_name = ?
+                       and locked = TRUE and holder = ?;
+                    '''
+        try:
+            if self.execute(renew_qry, [lease_secs, dataset_name, holder]) == 1:
+                return True
+            return self._holds_lock(dataset_name, holder)
+        except Exception as ex:
+            logkv(logger, {"msg": "Failed to renew dataset lock",
+                           "dataset": dataset_name,
+                           "holder": holder,
+                           "query": renew_qry,
+                           "error": ex}, "error")
+            raise MetadataManagerException()
+
+    def release(self, dataset_name, holder=None):
+        """
+        Releases lock on a dataset. If 'holder' is given, the lock is released only
+        if 'holder' still holds it, so that a load whose lease was taken over does
+        not release the lock of the load that took it over.
 
         @type dataset_name: str
         @param dataset_name:
 
+        @type holder: str
+        @param holder: Id of the load holding the lock
+
         @rtype: None
         @return: None
         """
         release_qry = '''
                          update thrive_dataset_lock
-                         set locked = FALSE
-                         where dataset_name='%s';
-                      ''' % dataset_name
+                         set locked = FALSE, holder = NULL, lease_expiry = NULL
+                         where dataset_name = ?
+                      '''
+        params = [dataset_name]
+        if holder is not None:
+            release_qry += "and holder = ?"
+            params.append(holder)
         try:
-            self.execute(release_qry)
+            self.execute(release_qry, params)
         except Exception as ex:
             logkv(logger, {"msg": "Failed to release dataset lock",
                            "dataset": dataset_name,
@@ -340,10 +723,10 @@ class MetadataManager(object):
         qry = '''
                   select locked, release_attempts
                   from thrive_dataset_lock
-                  where dataset_name = '%s';
-              ''' % dataset_name
+                  where dataset_name = ?;
+              '''
         try:
-            obj = self.execute_return(qry)
+            obj = self.execute_return(qry, [dataset_name])
             return obj[0][0], obj[0][1]
         except IndexError as ie:
             logkv(logger, {"msg": "Query yielded zero results. Check if the dataset is setup.",
@@ -371,11 +754,11 @@ class MetadataManager(object):
         qry = '''
                  update thrive_dataset_lock
                  set release_attempts = release_attempts + 1
-                 where dataset_name = '%s';
-              ''' % dataset_name
+                 where dataset_name = ?;
+              '''
 
         try:
-            self.execute(qry)
+            self.execute(qry, [dataset_name])
         except Exception as ex:
             logkv(logger, {"msg": "Failed to increment release attempts",
                            "dataset": dataset_name,
@@ -399,24 +782,347 @@ class MetadataManager(object):
         @rtype: None
         @return: None
         """
+        self.delete_many(dataset, mdcolname, [mdcolvalue])
+
+    def delete_many(self, dataset, mdcolname=None, mdcolvalues=None):
+        """
+        Deletes the rows in 'thrive_load_metadata' where 'mdcolname' has any of the
+        values in 'mdcolvalues', and the last directories loaded from the dataset
+        state, in a single transaction
+
+        @type dataset: str
+        @param dataset: Dataset for which the metadata rows are to be deleted
+
+        @type mdcolname: str
+        @param mdcolname: Name of the column which to be matched
+
+        @type mdcolvalues: list
+        @param mdcolvalues: Values of the column that are matched
+
+        @rtype: None
+        @return: None
+        """
+        if not mdcolvalues:
+            return
+
         delqry = '''
                     delete from thrive_load_metadata
-                    where dataset_name = '%s'
-                    and %s = '%s';
-                 ''' % (dataset, mdcolname, mdcolvalue)
+                    where dataset_name = ?
+                    and %s = ?;
+                 ''' % mdcolname
+
+        # The last directories loaded may be among the rows deleted. They are
+        # looked up in the load history again until the next load records them.
+        state_qry = '''
+                       delete from thrive_dataset_state
+                       where dataset_name = ?
+                       and state_key like 'lastdir:%';
+                    '''
         try:
-            self.execute(delqry)
+            self.execute_transaction([
+                (delqry, [(dataset, value) for value in mdcolvalues]),
+                (state_qry, [(dataset,)])
+            ])
             logkv(logger, {"msg": "Removed partition information from metadata",
                            "dataset_name": dataset,
                            "colname": mdcolname,
-                           "colvalue": mdcolvalue}, "info")
+                           "colvalues": mdcolvalues}, "info")
         except Exception:
             logkv(logger, {"msg": "Error removing partition information from metadata",
                            "dataset_name": dataset,
                            "colname": mdcolname,
-                           "colvalue": mdcolvalue,
+                           "colvalues": mdcolvalues,
                            "query": delqry}, "error")
             raise MetadataManagerException()
 
+    def get_schema_version(self):
+        """
+        Returns the version of the metadata schema, i.e. the highest version of the
+        migrations applied to it. The version table is created if it is absent, as
+        in databases set up before migrations were introduced.
+
+        @rtype: int
+        @return: Schema version, 0 if no migration was applied
+        """
+        ddl = '''
+                 create table if not exists thrive_schema_version (
+                   version int primary key,
+                   description varchar(500),
+                   applied_ts timestamp default current_timestamp
+                 );
+              '''
+        qry = "select max(version) from thrive_schema_version;"
+        try:
+            self.execute(ddl)
+            return self.execute_return(qry)[0][0] or 0
+        except Exception as ex:
+            logkv(logger, {"msg": "Failed to get metadata schema version",
+                           "query": qry,
+                           "error": ex}, "error")
+            raise MetadataManagerException()
+
+    def migrate(self, migrations):
+        """
+        Applies the migrations in 'migrations' newer than the current schema version,
+        in version order. Each migration is recorded in the version table once all
+        of its statements have run, so that a failed migration is retried by the
+        next call. MySQL commits each DDL statement implicitly, hence the indexes,
+        tables and columns created before a migration failed are skipped when it is
+        retried.
+
+        @type migrations: list
+        @param migrations: (version, description, statements) tuples as returned
+        by thrive.utils.read_migrations
+
+        @rtype: list
+        @return: Versions of the migrations applied
+        """
+        current = self.get_schema_version()
+        applied = []
+        for version, description, stmts in sorted(migrations):
+            if version <= current:
+                continue
+
+            logkv(logger, {"msg": "Applying metadata migration",
+                           "version": version,
+                           "description": description}, "info")
+            for stmt in stmts:
+                stmt = self.unapplied(stmt)
+                if stmt:
+                    self.execute(stmt)
+            self.insert({"version": version, "description": description},
+                        mdtype="schema")
+            applied.append(version)
+        return applied
+
+    def unapplied(self, stmt):
+        """
+        Returns the part of migration statement 'stmt' which has yet to be applied
+
+        @type stmt: str
+        @param stmt: SQL statement
+
+        @rtype: str
+        @return: 'stmt' without the columns it adds that exist already. None if the
+        index, table or all the columns it creates exist.
+        """
+        m = CREATE_INDEX.match(stmt)
+        if m:
+            return None if self.index_exists(m.group(2), m.group(1)) else stmt
+
+        m = CREATE_TABLE.match(stmt)
+        if m:
+            return None if self.table_exists(m.group(1)) else stmt
+
+        m = ADD_COLUMNS.match(stmt)
+        if m:
+            clauses = [clause.strip() for clause in ADD_COLUMN_SEP.split(m.group(3))]
+            missing = [clause for clause in clauses
+                       if not self.column_exists(m.group(2), clause.split()[2])]
+            return "%s %s" % (m.group(1), ", ".join(missing)) if missing else None
+        return stmt
+
+    def index_exists(self, table, index):
+        """
+        @rtype: bool
+        @return: True if 'table' has an index named 'index'
+        """
+        qry = "select 1 from information_schema.statistics " \
+              "where table_schema = database() and table_name = ? and index_name = ?;"
+        return bool(self.execute_return(qry, [table, index]))
+
+    def table_exists(self, table):
+        """
+        @rtype: bool
+        @return: True if 'table' exists
+        """
+        qry = "select 1 from information_schema.tables " \
+              "where table_schema = database() and table_name = ?;"
+        return bool(self.execute_return(qry, [table]))
+
+    def column_exists(self, table, column):
+        """
+        @rtype: bool
+        @return: True if 'table' has a column named 'column'
+        """
+        qry = "select 1 from information_schema.columns " \
+              "where table_schema = database() and table_name = ? and column_name = ?;"
+        return bool(self.execute_return(qry, [table, column]))
+
     def close(self):
         self.connection.close()
+
+
+class MetadataJournal(object):
+    """
+    Unit of work for the load metadata written while a batch of chunks is loaded.
+    The metadata is queued rather than written, and commit() writes all of it in
+    a single transaction. Every queued write is also saved to a local journal
+    file first, so that metadata whose commit was interrupted, e.g. by a crash,
+    is written by replay() in the next load of the dataset.
+    """
+    def __init__(self, metadata_mgr, journalfile):
+        """
+        @type metadata_mgr: MetadataManager
+        @param metadata_mgr: Metadata manager committing the queued metadata
+
+        @type journalfile: str
+        @param journalfile: Path of the local journal file
+
+        @rtype: None
+        @return: None
+        """
+        self.metadata_mgr = metadata_mgr
+        self.journalfile = journalfile
+        self.loads = []
+        self.updates = []
+
+    def _batches(self):
+        """
+        @rtype: list
+        @return: (SQL query string, sequences of values) pairs writing the queued
+        metadata, in the order it was queued
+        """
+        batches = self.metadata_mgr.load_batches(self.loads)
+        if self.updates:
+            batches.append(self.metadata_mgr.update_batch(self.updates, mdtype="load"))
+        return batches
+
+    def _save(self):
+        """
+        Saves the statements writing the queued metadata to the journal file. The
+        file is synced to disk and then replaces the previous one, so that the
+        journal is never found partially written.
+
+        @rtype: None
+        @return: None
+        """
+        tmpfile = "%s.%d.tmp" % (self.journalfile, os.getpid())
+        try:
+            # Values without a JSON type, e.g. UUIDs, are bound by their string form
+            with open(tmpfile, "w") as jf:
+                json.dump(self._batches(), jf, default=str)
+                jf.flush()
+                os.fsync(jf.fileno())
+            os.rename(tmpfile, self.journalfile)
+        except (IOError, OSError, TypeError, ValueError) as ex:
+            logkv(logger, {"msg": "Could not write metadata journal",
+                           "file": self.journalfile,
+                           "error": str(ex)}, "error")
+            try:
+                os.remove(tmpfile)
+            except OSError:
+                pass
+            raise MetadataManagerException()
+
+    def record_loads(self, rows):
+        """
+        Queues the load metadata rows in 'rows' as for MetadataManager.record_loads
+
+        @type rows: list
+        @param rows: Dicts of 'thrive_load_metadata' columns, in load order
+
+        @rtype: None
+        @return: None
+        """
+        if rows:
+            self.loads.extend(rows)
+            self._save()
+
+    def update_loads(self, updates):
+        """
+        Queues the updates of load metadata rows in 'updates' as for
+        MetadataManager.update_many with mdtype 'load'. Rows queued by
+        record_loads() may be updated.
+
+        @type updates: list
+        @param updates: (primary key tuple, dict of column values) pairs
+
+        @rtype: None
+        @return: None
+        """
+        if updates:
+            self.updates.extend(updates)
+            self._save()
+
+    def unprocessed_partitions(self):
+        """
+        Returns the partitions queued by record_loads() that no queued update loads
+        into Vertica, as MetadataManager.get_unprocessed_partitions does for the
+        committed metadata
+
+        @rtype: list
+        @return: (load_id, hive partition, hive rows, MR input records) tuples
+        """
+        updated = set((pk[0], pk[1]) for pk, data in self.updates
+                      if data.get("vertica_last_partition"))
+        return [(row["load_id"], row["hive_last_partition"],
+                 row["hive_rows_loaded"], row["hadoop_records_processed"])
+                for row in self.loads
+                if (row["load_id"], row["hive_last_partition"]) not in updated]
+
+    def pending(self):
+        """
+        @rtype: bool
+        @return: True if there is queued metadata not yet committed
+        """
+        return bool(self.loads or self.updates)
+
+    def _clear(self):
+        """
+        Removes the journal file once its metadata is committed
+
+        @rtype: None
+        @return: None
+        """
+        try:
+            os.remove(self.journalfile)
+        except OSError as ex:
+            logkv(logger, {"msg": "Could not remove metadata journal",
+                           "file": self.journalfile,
+                           "error": str(ex)}, "warning")
+
+    def commit(self):
+        """
+        Writes the queued metadata in a single transaction. If the transaction
+        fails, the journal file is kept for replay() and the metadata stays queued.
+
+        @rtype: None
+        @return: None
+        """
+        if not self.pending():
+            return
+
+        self.metadata_mgr.execute_transaction(self._batches())
+        logkv(logger, {"msg": "Committed metadata journal",
+                       "loads": len(self.loads),
+                       "updates": len(self.updates)}, "info")
+        self.loads, self.updates = [], []
+        self._clear()
+
+    def replay(self):
+        """
+        Writes the metadata saved in the journal file by a previous load whose
+        commit did not complete. The statements are idempotent, so metadata that
+        was committed before the journal file could be removed is left unchanged.
+
+        @rtype: bool
+        @return: True if a journal was replayed, False if there was none
+        """
+        if not os.path.exists(self.journalfile):
+            return False
+
+        try:
+            with open(self.journalfile) as jf:
+                batches = json.load(jf)
+        except (IOError, ValueError) as ex:
+            logkv(logger, {"msg": "Could not read metadata journal",
+                           "file": self.journalfile,
+                           "error": str(ex)}, "error")
+            raise MetadataManagerException()
+
+        logkv(logger, {"msg": "Replaying metadata journal",
+                       "file": self.journalfile}, "warning")
+        self.metadata_mgr.execute_transaction([(qry, rows) for qry, rows in batches])
+        self._clear()
+        return True
@@ -0,0 +1,62 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from thrive.thrive_handler import ThriveHandler
+from thrive.utils import logkv, read_migrations
+from thrive.exceptions import MetadataManagerException, MigrateHandlerException
+
+logger = logging.getLogger(__name__)
+
+
+class MigrateHandler(ThriveHandler):
+    """
+    Handler for upgrading the metadata database schema. Applies the migration
+    scripts not yet recorded in the schema version table of the metadata database.
+    The schema is shared by all datasets, so the phase is run once per environment.
+    """
+    def __init__(self, datacfg_file=None, envcfg_file=None, migrations_dir=None):
+        """
+        @type migrations_dir: str
+        @param migrations_dir: Directory of the migration scripts
+
+        @rtype: None
+        @return: None
+        """
+        super(MigrateHandler, self).__init__(datacfg_file=datacfg_file,
+                                             envcfg_file=envcfg_file)
+        self.migrations_dir = migrations_dir
+
+    def execute(self):
+        """
+        Applies the pending migrations in 'migrations_dir' in version order
+
+        @rtype: None
+        @return: None
+        """
+        try:
+            migrations = read_migrations(self.migrations_dir)
+        except (IOError, OSError) as ex:
+            logkv(logger, {"msg": "Could not read migrations",
+                           "migrations_dir": self.migrations_dir,
+                           "error": ex}, "error")
+            raise MigrateHandlerException()
+
+        try:
+            applied = self.metadata_mgr.migrate(migrations)
+            logkv(logger, {"msg": "Metadata schema up to date",
+                           "applied": applied}, "info")
+        except MetadataManagerException as ex:
+            logkv(logger, {"msg": "Metadata migration failed"}, "error", ex)
+            raise MigrateHandlerException()
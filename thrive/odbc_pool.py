@@ -0,0 +1,109 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pyodbc
+import threading
+from contextlib import contextmanager
+
+# Number of idle connections kept per connection string
+POOL_MAX_IDLE = 2
+
+# Errors after which a connection cannot be used anymore
+BROKEN_CONNECTION_ERRORS = (pyodbc.OperationalError, pyodbc.InterfaceError)
+
+
+class OdbcPool(object):
+    """
+    Process-wide pool of ODBC connections, keyed by connection string. Each
+    connection is used by one thread at a time: session() checks out an idle
+    connection, or opens a new one, and returns it to the pool afterwards. A
+    connection which failed with one of BROKEN_CONNECTION_ERRORS is closed
+    instead of being returned.
+    """
+    def __init__(self, max_idle=POOL_MAX_IDLE):
+        """
+        @type max_idle: int
+        @param max_idle: Number of idle connections kept per connection string
+
+        @rtype: None
+        @return: None
+        """
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = dict()
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except pyodbc.Error:
+            pass
+
+    @contextmanager
+    def session(self, connstr):
+        """
+        Context manager yielding a connection for 'connstr'. Connections are opened
+        with autocommit set, since the statements run through the pool manage their
+        own transactions, if any.
+
+        @type connstr: str
+        @param connstr: ODBC connection string
+
+        @raises: pyodbc.Error if a new connection cannot be opened
+        """
+        with self._lock:
+            idle = self._idle.get(connstr)
+            connection = idle.pop() if idle else None
+        if connection is None:
+            connection = pyodbc.connect(connstr, autocommit=True)
+
+        try:
+            yield connection
+        except BROKEN_CONNECTION_ERRORS:
+            self._close(connection)
+            raise
+        except BaseException:
+            self._checkin(connstr, connection)
+            raise
+        self._checkin(connstr, connection)
+
+    def _checkin(self, connstr, connection):
+        with self._lock:
+            idle = self._idle.setdefault(connstr, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        self._close(connection)
+
+    def close(self, connstr=None):
+        """
+        Closes all idle connections, or those for 'connstr' if given
+
+        @type connstr: str
+        @param connstr: ODBC connection string
+
+        @rtype: None
+        @return: None
+        """
+        with self._lock:
+            if connstr is None:
+                idle, self._idle = self._idle, dict()
+            else:
+                idle = {connstr: self._idle.pop(connstr, [])}
+        for connections in idle.values():
+            for connection in connections:
+                self._close(connection)
+
+
+odbc_pool = OdbcPool()
@@ -16,12 +16,16 @@ import logging
 import time
 import re
 import json
+from collections import deque
 from thrive.shell_executor import ShellExecutor, ShellException
 from thrive.utils import logkv
 from thrive.exceptions import OozieManagerException
 
 logger = logging.getLogger(__name__)
 
+# Number of trailing lines of an Oozie log trace that are retained for logging
+LOGTRACE_MAXLINES = 500
+
 
 class OozieManager(object):
     """
@@ -100,20 +104,23 @@ class OozieManager(object):
             logkv(logger, {"msg": "Failed to get status of workflow steps"}, "error")
             raise OozieManagerException()
 
-    def get_logtrace(self, jobid):
+    def get_logtrace(self, jobid, maxlines=LOGTRACE_MAXLINES):
         """
-        Gets log trace of the oozie job of given jobid
+        Gets log trace of the oozie job of given jobid. The trace is streamed and
+        only its last 'maxlines' lines, where the failure is reported, are kept.
 
         @type jobid: str
         @param jobid: Oozie jobid whose status is desired
 
+        @type maxlines: int
+        @param maxlines: Number of trailing lines of the log trace to return
+
         @rtype: str
         @return: log trace as a string
         """
         try:
             logcmd = "oozie job -log %s" % jobid
-            result = self.shell_exec.safe_execute(logcmd)
-            return result.output
+            return "\n".join(deque(self.shell_exec.stream(logcmd), maxlines))
         except ShellException:
             logkv(logger, {"msg": "Failed to get logtrace"}, "error")
             raise OozieManagerException()
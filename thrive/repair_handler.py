@@ -0,0 +1,45 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+from thrive.thrive_handler import ThriveHandler
+from thrive.utils import logkv
+from thrive.exceptions import HdfsManagerException, RepairHandlerException
+
+logger = logging.getLogger(__name__)
+
+
+class RepairHandler(ThriveHandler):
+    """
+    Handler for one-time repair of the HDFS permissions of a dataset. Loads only
+    grant read/execute permissions on the partitions they write, so tables created
+    before that may have partitions unreadable to users. The repair phase grants
+    the permissions recursively on the whole table.
+    """
+    def execute(self):
+        """
+        Grants read/execute permissions to all on target_root and everything below it
+
+        @rtype: None
+        @return: None
+        """
+        target_root = self.get_config("target_root")
+        logkv(logger, {"msg": "Repairing permissions", "path": target_root}, "info")
+        try:
+            self.hdfs_mgr.grantall("rx", target_root)
+            logkv(logger, {"msg": "Repaired permissions", "path": target_root}, "info")
+        except HdfsManagerException as ex:
+            logkv(logger, {"msg": "Permission repair failed",
+                           "path": target_root}, "error", ex)
+            raise RepairHandlerException()
@@ -62,7 +62,7 @@ class ReplayHandler(LoadHandler):
         @param kwargs: Not actually used in execute() function. Added to match
         signature to super.execute()
 
-        @rtype: None
-        @return: None
+        @rtype: bool
+        @return: True if new directories were loaded
         """
-        super(ReplayHandler, self).execute(load_type="replay")
\ No newline at end of file
+        return super(ReplayHandler, self).execute(load_type="replay")
\ No newline at end of file
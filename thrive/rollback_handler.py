@@ -59,38 +59,49 @@ class RollbackHandler(LoadHandler):
             self.vertica_mgr.clone_schema(srcschema, srctable, rollbackschema, rollbacktable)
 
             with open(self.partitions_file) as pf:
-                for line in pf:
-                    ptn_path = line.strip()
+                ptn_paths = [line.strip() for line in pf]
+
+            # Construct HDFS paths to the data and check their existence up front;
+            # the checks are independent of each other and of the rollback steps
+            hdfspaths = [os.path.join(self.get_config("target_root"), ptn_path)
+                         for ptn_path in ptn_paths]
+            hdfspaths_exist = self.hdfs_mgr.paths_exist(hdfspaths)
+
+            # The metadata rows of the partitions rolled back are deleted in one
+            # transaction, also if a later partition fails
+            rolled_back = []
+            try:
+                for ptn_path, hdfspath in zip(ptn_paths, hdfspaths):
                     logkv(logger, {"msg": "Rolling back partition",
                                    "partition": ptn_path}, "info")
 
-                    # Construct HDFS path to the data
-                    hdfspath = os.path.join(self.get_config("target_root"), ptn_path)
-
                     # If the hdfspath exists, perform rollback operation in Vertica
-                    if self.hdfs_mgr.path_exists(hdfspath):
+                    if hdfspaths_exist[hdfspath]:
 
                         logkv(logger, {"msg": "Proceeding with vertica rollback",
                                        "partition": hdfspath}, "info")
 
-                        # Load data in current partition to Vertica
-                        try:
-                            logkv(logger,
-                                  {"msg": "Trying Vertica COPY via 'direct'"},
-                                  "info")
-                            self.vload_copy(ptn_path, rollbackschema,
-                                            rollbacktable, mode="direct")
-                        except Exception:
-                            logkv(logger,
-                                  {"msg": "Trying Vertica COPY via 'decompress'"},
-                                  "info")
-                            self.vload_copy(ptn_path, rollbackschema,
-                                            rollbacktable, mode="decompress")
+                        # Load data in current partition to Vertica, in the mode
+                        # matching the compression of its part files
+                        self.vload_copy(ptn_path, rollbackschema, rollbacktable,
+                                        mode=self.copy_mode(ptn_path))
+
+                        # Drop the Vertica partitions holding only rolled back rows. Rows
+                        # in partitions shared with other data are deleted one by one.
+                        rkey = self.get_config("vertica_rollback_key")
+                        partition_expr = self.get_config("vertica_partition_expr", default="")
+                        if partition_expr:
+                            remaining = self.vertica_mgr.drop_rollback_partitions(
+                                srcschema, srctable, rollbackschema, rollbacktable,
+                                partition_expr, rkey=rkey)
+                        else:
+                            remaining = True
 
                         # Delete rows in Vertica main table contained in __rollback__ table
-                        self.vertica_mgr.rollback(srcschema, srctable,
-                                                  rollbackschema, rollbacktable,
-                                                  rkey=self.get_config("vertica_rollback_key"))
+                        if remaining:
+                            self.vertica_mgr.rollback(srcschema, srctable,
+                                                      rollbackschema, rollbacktable,
+                                                      rkey=rkey)
 
                         # Truncate the __rollback__ table
                         self.vertica_mgr.truncate(rollbackschema, rollbacktable)
@@ -103,10 +114,11 @@ class RollbackHandler(LoadHandler):
                               % tuple(ptn_path.split("/"))
                     self.hive_mgr.drop_partition(ptn_str)
 
-                    # Delete row in Metadata tables
-                    self.metadata_mgr.delete(self.get_config("dataset_name"),
-                                             mdcolname="hive_last_partition",
-                                             mdcolvalue=ptn_path)
+                    rolled_back.append(ptn_path)
+            finally:
+                self.metadata_mgr.delete_many(self.get_config("dataset_name"),
+                                              mdcolname="hive_last_partition",
+                                              mdcolvalues=rolled_back)
         except Exception:
             logkv(logger, {"msg": "Rollback error"}, "error")
             raise RollbackHandlerException()
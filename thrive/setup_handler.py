@@ -254,12 +254,13 @@ class SetupHandler(ThriveHandler):
         self.make_oozie_workflow()
 
         # Grant read permissions to all files in resources folder and grant execute
-        # permissions to all python files
-        for rf in glob.glob("%s/*" % nfs_dataset_path):
-            self.shell_exec.safe_execute("chmod a+r %s" % rf)
+        # permissions to all python files. The per-file commands are independent,
+        # so they are run concurrently.
+        self.shell_exec.safe_execute_batch(
+            ["chmod a+r %s" % rf for rf in glob.glob("%s/*" % nfs_dataset_path)])
 
-        for pf in glob.glob("%s/*py" % nfs_dataset_path):
-            self.shell_exec.safe_execute("chmod a+x %s" % pf)
+        self.shell_exec.safe_execute_batch(
+            ["chmod a+x %s" % pf for pf in glob.glob("%s/*py" % nfs_dataset_path)])
 
     def setup_hive(self):
         """
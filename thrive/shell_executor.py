@@ -13,16 +13,307 @@
 # limitations under the License.
 
 import subprocess as sp
+import os
+import re
+import time
+import tempfile
 import logging
-from thrive.utils import logkv
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+from multiprocessing.pool import ThreadPool
+from thrive.utils import logkv, percentile
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of bytes of stderr retained by ShellExecutor.stream
+STREAM_MAX_ERROR_BYTES = 64 * 1024
+
+# Default number of commands run concurrently by the batch methods of ShellExecutor
+BATCH_WORKERS = 8
+
+# External tools whose commands are timed under their own tag by CommandStats
+TAGGED_TOOLS = ("hadoop", "hive", "oozie", "vsql", "curl")
+
+# Quoted SQL passed to 'hive -e' or 'vsql -c'
+SQL_ARG_PATTERN = re.compile('-[ec]\\s+"(.*)"', re.S)
+
 
 class ShellException(Exception):
     pass
 
 
+def sql_operation(sql):
+    """
+    Names the operation performed by the last statement of a SQL string, ignoring
+    'use' statements. E.g. "use db; alter table t add partition (...)" is
+    "add_partition"
+    """
+    stmts = [st.split() for st in sql.split(";") if st.strip()]
+    stmts = [words for words in stmts if words[0].lower() != "use"]
+    if not stmts:
+        return "query"
+
+    words = [w.lower() for w in stmts[-1]]
+    if words[0] == "alter" and len(words) > 3:
+        return "%s_partition" % words[3]
+    if words[0] in ("create", "drop", "show") and len(words) > 1:
+        return "%s_%s" % (words[0], words[1])
+    return words[0]
+
+
+def command_tag(cmd_string):
+    """
+    Tags a command string by tool and operation, e.g. "hdfs.ls", "hive.add_partition",
+    "vertica.copy" or "oozie.info". Commands of other tools are tagged as "shell.<tool>"
+
+    @type cmd_string: str
+    @param cmd_string: Command string as passed to ShellExecutor.execute
+
+    @rtype: str
+    @return: tag of the form <tool>.<operation>
+    """
+    tokens = cmd_string.split()
+    tools = [i for i, tok in enumerate(tokens) if os.path.basename(tok) in TAGGED_TOOLS]
+    if not tools:
+        return "shell.%s" % (os.path.basename(tokens[0]) if tokens else "none")
+
+    start = tools[0]
+    tool, args = os.path.basename(tokens[start]), tokens[start + 1:]
+
+    if tool == "hadoop":
+        if len(args) > 1 and args[0] == "fs":
+            return "hdfs.%s" % args[1].lstrip("-")
+        return "hadoop.%s" % (args[0] if args else "none")
+
+    if tool in ("hive", "vsql"):
+        tool = "vertica" if tool == "vsql" else tool
+        m = SQL_ARG_PATTERN.search(cmd_string)
+        if m:
+            return "%s.%s" % (tool, sql_operation(m.group(1)))
+        return "%s.script" % tool
+
+    if tool == "oozie":
+        flags = [a.lstrip("-") for a in args if a.startswith("-") and a != "-config"]
+        return "oozie.%s" % (flags[0] if flags else "none")
+
+    # curl. WebHDFS requests are tagged by their operation, others by HTTP method
+    m = re.search("[?&]op=([A-Za-z]+)", cmd_string)
+    if m:
+        return "webhdfs.%s" % m.group(1).lower()
+    if "--request" in args and args.index("--request") + 1 < len(args):
+        return "curl.%s" % args[args.index("--request") + 1].lower()
+    return "curl.%s" % ("post" if "-d" in args else "get")
+
+
+class CommandStats(object):
+    """
+    Thread-safe, process-wide record of the wall time, exit code and output size
+    of every command run through ShellExecutor, grouped by command tag. Operations
+    served in-process instead of by a command (e.g. over a pooled session) are
+    recorded under the tag of the command they replace.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Discards all recorded commands
+
+        @rtype: None
+        @return: None
+        """
+        with self._lock:
+            self._runs = defaultdict(list)
+
+    def record(self, cmd_string, elapsed, retcode, output_bytes):
+        """
+        Records one command execution
+
+        @type cmd_string: str
+        @param cmd_string: Command string that was executed
+
+        @type elapsed: float
+        @param elapsed: Wall time of the command in seconds
+
+        @type retcode: int
+        @param retcode: Exit code of the command, None if it could not be started
+
+        @type output_bytes: int
+        @param output_bytes: Number of bytes written by the command to stdout
+
+        @rtype: None
+        @return: None
+        """
+        with self._lock:
+            self._runs[command_tag(cmd_string)].append((elapsed, retcode, output_bytes))
+
+    @contextmanager
+    def timed(self, tag):
+        """
+        Context manager recording the wall time of the operation run in its block
+        under 'tag'. The operation is recorded as failed (exit code 1) if the block
+        raises.
+
+        @type tag: str
+        @param tag: Tag of the form <tool>.<operation>, e.g. "vertica.copy"
+        """
+        start = time.time()
+        try:
+            yield
+        except BaseException:
+            with self._lock:
+                self._runs[tag].append((time.time() - start, 1, 0))
+            raise
+        with self._lock:
+            self._runs[tag].append((time.time() - start, 0, 0))
+
+    def summary(self):
+        """
+        Summarizes the recorded commands per tag
+
+        @rtype: dict
+        @return: Dictionary mapping each tag to its count, number of failures,
+        total output bytes and total, p50 and p95 of wall time in seconds
+        """
+        with self._lock:
+            runs = dict(self._runs)
+
+        summary = dict()
+        for tag, records in runs.items():
+            times = [elapsed for elapsed, _, _ in records]
+            summary[tag] = {
+                "count": len(records),
+                "failures": len([rc for _, rc, _ in records if rc != 0]),
+                "output_bytes": sum(nbytes for _, _, nbytes in records),
+                "total_secs": sum(times),
+                "p50_secs": percentile(times, 50),
+                "p95_secs": percentile(times, 95)
+            }
+        return summary
+
+
+# Timings of all commands executed by this process
+command_stats = CommandStats()
+
+
+class CommandCache(object):
+    """
+    Run-scoped memo of the results of read-only commands, keyed by the normalized
+    command string. Each entry is associated with the paths (or other resource
+    names) it reads, and writes to a path invalidate every entry on that path,
+    its ancestors or its descendants. The cache is disabled, and commands are
+    always executed, unless a handler enables it for the duration of a run.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = dict()
+        self.enabled = False
+
+    @staticmethod
+    def _normalize(cmd_string):
+        return " ".join(cmd_string.split())
+
+    @staticmethod
+    def _related(path1, path2):
+        path1, path2 = path1.rstrip("/"), path2.rstrip("/")
+        return path1 == path2 or path1.startswith(path2 + "/") \
+            or path2.startswith(path1 + "/")
+
+    def enable(self):
+        """
+        Starts caching. Called at the start of a run
+
+        @rtype: None
+        @return: None
+        """
+        with self._lock:
+            self._entries = dict()
+            self.enabled = True
+
+    def disable(self):
+        """
+        Stops caching and discards all entries. Called at the end of a run
+
+        @rtype: None
+        @return: None
+        """
+        with self._lock:
+            self._entries = dict()
+            self.enabled = False
+
+    def get(self, cmd_string, paths, compute):
+        """
+        Returns the cached outcome of 'cmd_string', calling compute() to obtain it
+        on a miss. A ShellException raised by compute() is cached and re-raised
+        like a result.
+
+        @type cmd_string: str
+        @param cmd_string: Read-only command string
+
+        @type paths: list
+        @param paths: Paths read by the command
+
+        @type compute: function
+        @param compute: Function without arguments that executes the command
+
+        @return: Value returned by compute()
+        """
+        if not self.enabled:
+            return compute()
+
+        key = CommandCache._normalize(cmd_string)
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is None:
+            try:
+                entry = (compute(), None)
+            except ShellException as ex:
+                entry = (None, ex)
+            with self._lock:
+                if self.enabled:
+                    self._entries[key] = (entry, list(paths))
+        else:
+            entry = entry[0]
+
+        result, error = entry
+        if error is not None:
+            raise error
+        return result
+
+    def invalidate(self, path):
+        """
+        Discards the entries of commands that read 'path', any of its ancestors or
+        any of its descendants
+
+        @type path: str
+        @param path: Path that was, or is about to be, modified
+
+        @rtype: None
+        @return: None
+        """
+        with self._lock:
+            for key in [k for k, (_, paths) in self._entries.items()
+                        if any(CommandCache._related(p, path) for p in paths)]:
+                del self._entries[key]
+
+
+# Results of read-only commands of the current run
+command_cache = CommandCache()
+
+
+class ShellBatchException(ShellException):
+    """
+    Raised when one or more commands of a batch fail. 'failed' lists the failed
+    command strings in the order in which they were submitted.
+    """
+    def __init__(self, failed):
+        super(ShellBatchException, self).__init__("%d command(s) failed" % len(failed))
+        self.failed = failed
+
+
 class ShellResult(object):
     def __init__(self, retcode, output_iterator, error_iterator):
         self.retcode = retcode
@@ -40,8 +331,9 @@ class ShellResult(object):
 class ShellExecutor(object):
     """
     An abstraction over bash shell command layer. This class facilitates executing
-    Shell commands needed by all classes in thrive core. There can be no logging in
-    this class because this class is used to set up the logger itself.
+    Shell commands needed by all classes in thrive core. Commands are logged through
+    the module logger, so this class must not be used before logging is initialized;
+    utils.init_logging runs its own commands for that reason.
     """
 
     @staticmethod
@@ -74,14 +366,110 @@ class ShellExecutor(object):
         if verbose:
             logkv(logger, {"cmd": cmd}, "info")
 
+        start = time.time()
         try:
             result = sp.Popen(cmd, stdout=sp.PIPE, stderr=sp.PIPE, shell=as_shell)
             output, error = result.communicate()
             retcode = result.returncode
+            command_stats.record(cmd_string, time.time() - start, retcode, len(output))
             return ShellResult(retcode, output, error)
         except OSError:
+            command_stats.record(cmd_string, time.time() - start, None, 0)
             raise ShellException
 
+    @staticmethod
+    def stream(cmd_string, verbose=False, splitcmd=True, as_shell=False,
+               max_error_bytes=STREAM_MAX_ERROR_BYTES):
+        """
+        Executes command string and yields its output one line at a time, as the
+        command produces it, instead of buffering the entire output in memory.
+        Stderr is spooled to a temporary file and only its first 'max_error_bytes'
+        are read back. Raises ShellException, after the output is exhausted, if
+        the return code is not 0. If the caller stops iterating early, the command
+        is killed.
+
+        @type cmd_string: string
+        @param cmd_string: Command string with arguments separated by spaces
+
+        @type verbose: bool
+        @param verbose: Echoes the command being executed
+
+        @type splitcmd: bool
+        @param splitcmd: If true, command is split into a list of arguments before
+        being passed to Popen
+
+        @type as_shell: bool
+        @param as_shell: Sets the "shell" option of Popen
+
+        @type max_error_bytes: int
+        @param max_error_bytes: Maximum number of bytes of stderr to log on failure
+
+        @rtype: generator
+        @return: Lines of output, without the trailing newline
+        """
+
+        if splitcmd:
+            cmd = cmd_string.split(" ")
+        else:
+            cmd = cmd_string
+
+        if verbose:
+            logkv(logger, {"cmd": cmd}, "info")
+
+        errfile = tempfile.TemporaryFile()
+        start = time.time()
+        try:
+            try:
+                proc = sp.Popen(cmd, stdout=sp.PIPE, stderr=errfile, shell=as_shell)
+            except OSError:
+                command_stats.record(cmd_string, time.time() - start, None, 0)
+                raise ShellException
+
+            finished = False
+            output_bytes = 0
+            try:
+                for line in iter(proc.stdout.readline, ""):
+                    output_bytes += len(line)
+                    yield line.rstrip("\n")
+                finished = True
+            finally:
+                proc.stdout.close()
+                if not finished and proc.poll() is None:
+                    proc.kill()
+                retcode = proc.wait()
+                command_stats.record(cmd_string, time.time() - start, retcode,
+                                     output_bytes)
+
+            if retcode != 0:
+                errfile.seek(0)
+                logkv(logger, {"msg": "Error in execution of shell command",
+                               "cmd": cmd_string,
+                               "retcode": retcode,
+                               "error": errfile.read(max_error_bytes)}, "warning")
+                raise ShellException
+        finally:
+            errfile.close()
+
+    @staticmethod
+    def cached_safe_execute(cmd_string, paths, **kwargs):
+        """
+        Executes a read-only command string through safe_execute, reusing the
+        outcome of an identical earlier command of the current run if the cache
+        is enabled and no write to 'paths' has occurred since
+
+        @type cmd_string: string
+        @param cmd_string: Read-only command string
+
+        @type paths: list
+        @param paths: Paths read by the command
+
+        @rtype: ShellResult
+        @return: ShellResult instance containing return code, output, and error messages
+        """
+        return command_cache.get(
+            cmd_string, paths,
+            lambda: ShellExecutor.safe_execute(cmd_string, **kwargs))
+
     @staticmethod
     def safe_execute(cmd_string, **kwargs):
         """
@@ -113,3 +501,87 @@ class ShellExecutor(object):
             raise ShellException
         else:
             return result
+
+    @staticmethod
+    def submit_batch(func, cmd_strings, workers=BATCH_WORKERS, **kwargs):
+        """
+        Runs 'func' (ShellExecutor.execute or ShellExecutor.safe_execute) on each
+        command string on a pool of at most 'workers' threads. Each command is
+        still a separate process; the pool only overlaps their startup and run
+        times.
+
+        @type func: function
+        @param func: Function called as func(cmd_string, **kwargs)
+
+        @type cmd_strings: list
+        @param cmd_strings: Command strings to execute
+
+        @type workers: int
+        @param workers: Maximum number of commands running at a time
+
+        @rtype: list
+        @return: List of (command string, AsyncResult) tuples in submission order.
+        All commands have completed when this method returns.
+        """
+        if not cmd_strings:
+            return []
+
+        pool = ThreadPool(min(workers, len(cmd_strings)))
+        try:
+            futures = [(cmd, pool.apply_async(func, (cmd,), kwargs))
+                       for cmd in cmd_strings]
+        finally:
+            pool.close()
+            pool.join()
+        return futures
+
+    @staticmethod
+    def execute_batch(cmd_strings, workers=BATCH_WORKERS, **kwargs):
+        """
+        Executes independent command strings concurrently
+
+        @type cmd_strings: list
+        @param cmd_strings: Command strings to execute
+
+        @type workers: int
+        @param workers: Maximum number of commands running at a time
+
+        @rtype: list
+        @return: ShellResult instances in the order of 'cmd_strings'
+
+        @raises: ShellException if any of the commands could not be started
+        """
+        futures = ShellExecutor.submit_batch(ShellExecutor.execute, cmd_strings,
+                                             workers, **kwargs)
+        return [future.get() for _, future in futures]
+
+    @staticmethod
+    def safe_execute_batch(cmd_strings, workers=BATCH_WORKERS, **kwargs):
+        """
+        Executes independent command strings concurrently and raises exception
+        if any of them fails. All commands are run to completion before the
+        failures are reported together.
+
+        @type cmd_strings: list
+        @param cmd_strings: Command strings to execute
+
+        @type workers: int
+        @param workers: Maximum number of commands running at a time
+
+        @rtype: list
+        @return: ShellResult instances in the order of 'cmd_strings'
+
+        @raises: ShellBatchException listing the failed commands
+        """
+        futures = ShellExecutor.submit_batch(ShellExecutor.safe_execute, cmd_strings,
+                                             workers, **kwargs)
+        results, failed = [], []
+        for cmd, future in futures:
+            try:
+                results.append(future.get())
+            except ShellException:
+                failed.append(cmd)
+
+        if failed:
+            raise ShellBatchException(failed)
+        return results
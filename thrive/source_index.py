@@ -0,0 +1,126 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import bisect
+import logging
+from thrive.utils import logkv, is_camus_dir
+
+logger = logging.getLogger(__name__)
+
+
+def dirkey(dirname):
+    """
+    Sort key of a Camus dir, obtained by retaining only the numeric parts of the
+    name (e.g. 'd_20150311-1610' -> '201503111610'). The keys are fixed-width, so
+    they sort in time order as strings.
+
+    @type dirname: str
+    @param dirname: Camus dir name
+
+    @rtype: str
+    @return: Sort key
+    """
+    return re.sub("[^0-9]", "", dirname)
+
+
+class SourceDirIndex(object):
+    """
+    Sorted index of the Camus source directories discovered in a topic, persisted
+    to a local file with one dir name per line. The index lets the load find the
+    directories created after the last processed one by binary search, and tells
+    HdfsManager how far back the topic needs to be listed to bring it up to date.
+    """
+    def __init__(self, indexfile):
+        """
+        Loads the index from 'indexfile'. A missing file yields an empty index.
+
+        @type indexfile: str
+        @param indexfile: Path of the local file persisting the index
+
+        @rtype: None
+        @return: None
+        """
+        self.indexfile = indexfile
+        self.dirs = []
+        self.keys = []
+        if os.path.exists(indexfile):
+            with open(indexfile) as idx:
+                self.add(line.strip() for line in idx)
+
+    def __len__(self):
+        return len(self.dirs)
+
+    def latest(self):
+        """
+        @rtype: str
+        @return: Most recent dir in the index or None if the index is empty
+        """
+        return self.dirs[-1] if self.dirs else None
+
+    def add(self, dirnames):
+        """
+        Adds dirs to the index. Names that are not Camus dirs or are already
+        indexed are ignored.
+
+        @type dirnames: iterable
+        @param dirnames: Dir names
+
+        @rtype: int
+        @return: Number of dirs added
+        """
+        added = 0
+        for d in dirnames:
+            if not is_camus_dir(d):
+                continue
+            key = dirkey(d)
+            pos = bisect.bisect_left(self.keys, key)
+            if pos < len(self.keys) and self.keys[pos] == key:
+                continue
+            self.keys.insert(pos, key)
+            self.dirs.insert(pos, d)
+            added += 1
+        return added
+
+    def after(self, lastdir):
+        """
+        Returns the indexed dirs more recent than 'lastdir'. 'lastdir' need not be
+        in the index itself.
+
+        @type lastdir: str
+        @param lastdir: Last processed dir, or None to get all dirs
+
+        @rtype: list
+        @return: Dirs after 'lastdir', in time order
+        """
+        if lastdir is None:
+            return list(self.dirs)
+        return self.dirs[bisect.bisect_right(self.keys, dirkey(lastdir)):]
+
+    def save(self):
+        """
+        Writes the index to its file. The file is replaced atomically so that an
+        interrupted run cannot leave a truncated index behind.
+
+        @rtype: None
+        @return: None
+        """
+        tmpfile = "%s.tmp" % self.indexfile
+        with open(tmpfile, "w") as idx:
+            idx.write("".join("%s\n" % d for d in self.dirs))
+        os.rename(tmpfile, self.indexfile)
+        logkv(logger, {"msg": "Saved source dir index",
+                       "file": self.indexfile,
+                       "dirs": len(self.dirs)}, "info")
@@ -0,0 +1,207 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import re
+import sqlite3
+import logging
+from thrive.metadata_manager import MetadataManager
+from thrive.utils import logkv, read_sql_script, read_migrations
+from thrive.exceptions import MetadataManagerException
+
+logger = logging.getLogger(__name__)
+
+# Directory of md_schema.sql and of the migrations applied to it
+MD_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      "utils", "metadata")
+
+# MySQL constructs of the metadata statements and their SQLite equivalents, applied
+# in order
+DIALECT = [(re.compile(pattern, re.IGNORECASE), repl) for pattern, repl in [
+    (r"\bauto_increment\b", "autoincrement"),
+    (r"\benum\s*\([^)]*\)", "text"),
+    (r"\)\s*default\s+charset\s*=\s*\w+", ")"),
+    (r"\btimestampadd\(\s*(\w+)\s*,\s*([^,]+?)\s*,\s*now\(\)\s*\)",
+     r"datetime('now', (\2) || ' \1s')"),
+    (r"\bnow\(\)", "datetime('now')"),
+    (r"\bgreatest\(", "max("),
+    (r"\bas\s+unsigned\b", "as integer"),
+    (r"\bas\s+char\b", "as text"),
+    (r"\bvalues\((\w+)\)", r"excluded.\1")
+]]
+
+
+class SqliteMetadataManager(MetadataManager):
+    """
+    MetadataManager backend which keeps the metadata in an embedded SQLite database
+    instead of MySQL, for local runs, tests and benchmarks. The statements of
+    MetadataManager are translated to the SQLite dialect before they are run, so
+    locking, load state and purge behave as with MySQL. A new database is created
+    from md_schema.sql and the migrations.
+    """
+    def __init__(self, credentials, md_dir=MD_DIR):
+        """
+        Opens the SQLite database, and creates the metadata tables if it has none
+
+        @type credentials: dict
+        @param credentials: 'dbname' is the path of the database file. Other
+        credentials are not used.
+
+        @type md_dir: str
+        @param md_dir: Directory of md_schema.sql and of the 'migrations' directory
+
+        @rtype: None
+        @return: None
+        """
+        self.credentials = credentials
+        self.md_dir = md_dir
+        self._pkeys = dict()
+
+        try:
+            self.connection = sqlite3.connect(self.credentials["dbname"])
+        except Exception as ex:
+            logkv(logger, {"msg": "Could not open SQLite database",
+                           "database": credentials.get("dbname"),
+                           "error": ex}, "error")
+            raise MetadataManagerException()
+
+        if not self.table_exists("thrive_setup"):
+            self.create_schema()
+
+    def create_schema(self):
+        """
+        Creates the metadata tables from md_schema.sql and applies the migrations
+
+        @rtype: None
+        @return: None
+        """
+        logkv(logger, {"msg": "Creating metadata tables",
+                       "database": self.credentials["dbname"]}, "info")
+        for stmt in read_sql_script(os.path.join(self.md_dir, "md_schema.sql")):
+            self.execute(stmt)
+        self.migrate(read_migrations(os.path.join(self.md_dir, "migrations")))
+
+    def _primary_key(self, table):
+        """
+        @rtype: list
+        @return: Primary key columns of 'table'
+        """
+        if table not in self._pkeys:
+            cursor = self.connection.cursor()
+            try:
+                cursor.execute("pragma table_info(%s)" % table)
+                columns = [(row[5], row[1]) for row in cursor.fetchall() if row[5]]
+            finally:
+                cursor.close()
+            self._pkeys[table] = [name for _, name in sorted(columns)]
+        return self._pkeys[table]
+
+    def index_exists(self, table, index):
+        """
+        @rtype: bool
+        @return: True if 'table' has an index named 'index'
+        """
+        return bool(self.execute_return("select 1 from sqlite_master where type = 'index' "
+                                        "and tbl_name = ? and name = ?;", [table, index]))
+
+    def table_exists(self, table):
+        """
+        @rtype: bool
+        @return: True if 'table' exists
+        """
+        return bool(self.execute_return("select 1 from sqlite_master "
+                                        "where type = 'table' and name = ?;", [table]))
+
+    def column_exists(self, table, column):
+        """
+        @rtype: bool
+        @return: True if 'table' has a column named 'column'
+        """
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute("pragma table_info(%s)" % table)
+            return column in [row[1] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def translate(self, qry):
+        """
+        Translates the MySQL statement 'qry' to the SQLite dialect
+
+        @type qry: str
+        @param qry: SQL query string
+
+        @rtype: list
+        @return: SQLite statements equivalent to 'qry', to be run in order
+        """
+        stmt = qry.strip().rstrip(";")
+        for pattern, repl in DIALECT:
+            stmt = pattern.sub(repl, stmt)
+
+        # Indexes cover whole columns rather than prefixes
+        if re.match(r"create\s+index\b", stmt, re.IGNORECASE):
+            stmt = re.sub(r"(\w+)\s*\(\d+\)", r"\1", stmt)
+
+        # Upserts name the primary key they conflict on
+        m = re.match(r"insert\s+into\s+(\w+)(.*)\son\s+duplicate\s+key\s+update\s(.*)$",
+                     stmt, re.IGNORECASE | re.DOTALL)
+        if m:
+            stmt = "insert into %s%s on conflict (%s) do update set %s" \
+                   % (m.group(1), m.group(2), ", ".join(self._primary_key(m.group(1))),
+                      m.group(3))
+
+        # A table is altered one column at a time
+        m = re.match(r"(alter\s+table\s+\w+)\s+(add\s+column\s.*)$", stmt,
+                     re.IGNORECASE | re.DOTALL)
+        if m:
+            return ["%s %s" % (m.group(1), clause.strip())
+                    for clause in re.split(r"(?i),\s*(?=add\s+column\s)", m.group(2))]
+        return [stmt]
+
+    def execute(self, qry, params=None):
+        """
+        Runs 'qry' as MetadataManager.execute does, translated to the SQLite dialect
+
+        @rtype: int
+        @return: Number of rows affected by the last statement 'qry' translates to
+        """
+        rows = 0
+        for stmt in self.translate(qry):
+            rows = super(SqliteMetadataManager, self).execute(stmt, params)
+        return rows
+
+    def execute_return(self, qry, params=None):
+        """
+        Runs 'qry' as MetadataManager.execute_return does, translated to the SQLite
+        dialect
+
+        @rtype: list
+        @return: List of tuples
+        """
+        stmt, = self.translate(qry)
+        return super(SqliteMetadataManager, self).execute_return(stmt, params)
+
+    def execute_transaction(self, batches):
+        """
+        Runs 'batches' as MetadataManager.execute_transaction does, translated to
+        the SQLite dialect
+
+        @rtype: None
+        @return: None
+        """
+        translated = []
+        for qry, rows in batches:
+            stmt, = self.translate(qry)
+            translated.append((stmt, rows))
+        super(SqliteMetadataManager, self).execute_transaction(translated)
@@ -18,6 +18,7 @@ import logging
 from datetime import datetime
 from thrive.hive_manager import HiveManager
 from thrive.metadata_manager import MetadataManager
+from thrive.sqlite_metadata_manager import SqliteMetadataManager
 from thrive.config_loader import ConfigLoader
 from thrive.hdfs_manager import HdfsManager
 from thrive.shell_executor import ShellExecutor
@@ -69,11 +70,18 @@ class ThriveHandler(object):
                                "resource_file": self.resources}, "info")
                 raise ThriveHandlerException
 
-        credtypes = ["dbtype", "dbhost", "dbport", "dbuser", "dbpass", "dbname"]
+        # Metadata is kept in an embedded SQLite database file named by 'dbname' if
+        # 'dbtype' is sqlite, e.g. for local runs, in MySQL otherwise
+        if self.get_config("dbtype", configtype="env").lower() == "sqlite":
+            credtypes = ["dbtype", "dbname"]
+            mdmgr_class = SqliteMetadataManager
+        else:
+            credtypes = ["dbtype", "dbhost", "dbport", "dbuser", "dbpass", "dbname"]
+            mdmgr_class = MetadataManager
         md_credentials = dict([(cred, self.get_config(cred, configtype="env"))
                                for cred in credtypes])
 
-        self.metadata_mgr = MetadataManager(credentials=md_credentials)
+        self.metadata_mgr = mdmgr_class(credentials=md_credentials)
 
         # Get the timestamp at which the present load started
         self.loadts = datetime.now()
@@ -94,16 +102,33 @@ class ThriveHandler(object):
         # dictionary comprehension and have to resort to passing tupes to the dict
         # constructor
         vconnection_info = dict((key, self.get_config(key)) for key in vconfigs)
-        self.vertica_mgr = VerticaManager(vconnection_info)
 
-        # Instantiate a HiveManager for Hive-related tasks
-        self.hive_mgr = HiveManager(db=self.get_config("hive_db"),
-                                    table=self.get_config("hive_table"))
+        # Statements go through a pooled ODBC session if requested, vsql otherwise
+        # The ODBC backends are imported only when selected, since they need pyodbc
+        if self.get_config("vertica_backend", default="vsql") == "odbc":
+            from thrive.vertica_odbc_manager import VerticaOdbcManager
+            self.vertica_mgr = VerticaOdbcManager(
+                vconnection_info, driver=self.get_config("vertica_odbc_driver",
+                                                         default="Vertica"))
+        else:
+            self.vertica_mgr = VerticaManager(vconnection_info)
+
+        # Instantiate a HiveManager for Hive-related tasks. Statements go through a
+        # pooled HiveServer2 session if requested, the hive CLI otherwise.
+        if self.get_config("hive_backend", default="cli") == "hiveserver2":
+            from thrive.hiveserver2_manager import HiveServer2Manager
+            self.hive_mgr = HiveServer2Manager(db=self.get_config("hive_db"),
+                                               table=self.get_config("hive_table"),
+                                               connstr=self.get_config("hiveserver2_connection"))
+        else:
+            self.hive_mgr = HiveManager(db=self.get_config("hive_db"),
+                                        table=self.get_config("hive_table"))
 
-        # Create a load_id for this load. Used by 'setup' and 'load' phases
-        self.load_id = uuid.uuid1()
+        # Create a load_id for this load. Used by 'setup' and 'load' phases. It is
+        # bound as a metadata statement parameter, hence kept as a string.
+        self.load_id = str(uuid.uuid1())
 
-    def get_config(self, config, configtype="data"):
+    def get_config(self, config, configtype="data", default=None):
         """
         Returns value of requested "config" of type "configtype". "data" configs are
         specific to dataset being processed. "env" are global configs apply to the
@@ -116,15 +141,24 @@ class ThriveHandler(object):
         @type config: str
         @param config: Key of the config whose value is desired
 
+        @type default: str
+        @param default: Value returned if "config" is absent. Used for optional
+        configs; if None, the config is required.
+
         @type return: str
         @return: value of configuration parameter "config"
         """
 
         if configtype == "data":
-            return self.datacfg.get_config("main", config).strip()
+            cfgloader = self.datacfg
         elif configtype == "env":
-            return self.envcfg.get_config("main", config).strip()
+            cfgloader = self.envcfg
         else:
             logkv(logger, {"msg": "Unknown configuration type",
                            "configtype": configtype}, "error")
-            raise ThriveHandlerException()
\ No newline at end of file
+            raise ThriveHandlerException()
+
+        if default is not None and not cfgloader.has_config("main", config):
+            return default
+
+        return cfgloader.get_config("main", config).strip()
\ No newline at end of file
@@ -37,8 +37,9 @@ CAMUS_FOLDER_FREQ = timedelta(0, 600)
 def init_logging(config_file):
     """
     Initializes the root logger. This function is called from the top level run script
-    'runthrive.py'. This function does not have access to any Handlers or Managers and
-    so must parse config file on its own.
+    'runthrive.py', and by LoadDaemon before each load of a dataset. This function
+    does not have access to any Handlers or Managers and so must parse config file
+    on its own.
 
     @type config_file: str
     @param config_file: Configuraiton file, used to locate log directory
@@ -70,6 +71,13 @@ def init_logging(config_file):
     # *without* any name. I.e. without any argument to the getLogger() method
     logger = logging.getLogger()
 
+    # The handlers of a previous call, e.g. for another dataset of the load daemon,
+    # are replaced
+    for handler in list(logger.handlers):
+        if any(isinstance(f, ContextFilter) for f in handler.filters):
+            logger.removeHandler(handler)
+            handler.close()
+
     logger.setLevel(logging.INFO)
     # logfmt = "%(asctime)s [%(name)-0.50s.%(funcName)s] [lvl=%(levelname)-5.5s] [dataset=%(dataset)-0.25s] %(message)s"
     # clogfmt = "%(log_color)s%(asctime)s [%(name)-0.50s.%(funcName)s] [lvl=%(levelname)-5.5s] [dataset=%(dataset)-0.25s] %(message)s"
@@ -346,6 +354,39 @@ def percentdiff(target_rows, source_rows):
         return 0.0
 
 
+def percentile(values, pct):
+    """
+    Returns the 'pct'-th percentile of 'values' using the nearest-rank method
+
+    @type values: list
+    @param values: List of numbers
+
+    @type pct: int
+    @param pct: Percentile between 0 and 100
+
+    @rtype: number
+    @return: Value at the requested percentile or None if 'values' is empty
+    """
+    if not values:
+        return None
+    ranked = sorted(values)
+    rank = (len(ranked) * pct + 99) // 100
+    return ranked[max(rank - 1, 0)]
+
+
+def get_logfile():
+    """
+    Returns the path of the run log file set up by init_logging
+
+    @rtype: str
+    @return: Path of the file the root logger writes to, None if there is none
+    """
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.FileHandler):
+            return handler.baseFilename
+    return None
+
+
 def chunk_dirs(dir_list, groupby="day"):
     """
     Given a list of directory names, *dir_list* in the CAMUS naming format,
@@ -382,3 +423,40 @@ def chunk_dirs(dir_list, groupby="day"):
         chunks[label].append(dirname)
 
     return dict(chunks)
+
+
+def read_sql_script(path):
+    """
+    Returns the SQL statements in script file 'path'. Lines starting with '--' are
+    comments; statements are separated by ';'.
+
+    @type path: str
+    @param path: Path of the SQL script
+
+    @rtype: list
+    @return: Statements in the order they appear in the script
+    """
+    with open(path) as sf:
+        sql = "".join(line for line in sf if not line.strip().startswith("--"))
+    return [stmt.strip() for stmt in sql.split(";") if stmt.strip()]
+
+
+def read_migrations(migrations_dir):
+    """
+    Returns the metadata schema migrations in 'migrations_dir'. Each migration is a
+    SQL script named '<version>_<description>.sql', e.g.
+    '001_load_metadata_indexes.sql'. Other files are ignored.
+
+    @type migrations_dir: str
+    @param migrations_dir: Directory of the migration scripts
+
+    @rtype: list
+    @return: (version, description, statements) tuples in version order
+    """
+    migrations = []
+    for fname in os.listdir(migrations_dir):
+        m = re.match(r"^(\d+)_(\w+)\.sql$", fname)
+        if m:
+            migrations.append((int(m.group(1)), m.group(2),
+                               read_sql_script(os.path.join(migrations_dir, fname))))
+    return sorted(migrations)
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import os
+import uuid
 import logging
 import re
 from thrive.shell_executor import ShellExecutor, ShellException
@@ -22,6 +23,29 @@ from thrive.exceptions import VerticaManagerException
 
 logger = logging.getLogger(__name__)
 
+# COPY filter of each load mode. In 'decompress' mode the files are decompressed
+# to plain text before the COPY.
+COPY_FILTERS = {
+    "direct": "FILTER GZIP()",
+    "bzip": "FILTER BZIP()",
+    "plain": "",
+    "decompress": ""
+}
+
+# Load mode for data written with each Hadoop compression codec, and for part files
+# with each extension. Data in any other format is decompressed before the COPY.
+CODEC_MODES = {
+    "org.apache.hadoop.io.compress.GzipCodec": "direct",
+    "org.apache.hadoop.io.compress.BZip2Codec": "bzip",
+    "": "plain"
+}
+
+EXTENSION_MODES = {
+    ".gz": "direct",
+    ".bz2": "bzip",
+    "": "plain"
+}
+
 
 class VerticaManager(object):
     """
@@ -82,8 +106,8 @@ class VerticaManager(object):
         """
         Execute sql stmt 'stmt' or sql script file 'scriptfile'
 
-        @type stmt: str
-        @param stmt: SQL query string
+        @type stmt: str or list
+        @param stmt: SQL query string, or list of them run by a single vsql command
 
         @type scriptfile: str
         @param scriptfile: Location of scriptfile containing commands to execute
@@ -91,6 +115,8 @@ class VerticaManager(object):
         @rtype: str
         @return: Output of the shell command enclosing Vertica sql command
         """
+        if isinstance(stmt, list):
+            stmt = "%s;" % "; ".join(stmt)
 
         # Get the execution mode and the argument (statement or filename)
         if stmt and not scriptfile:
@@ -112,6 +138,40 @@ class VerticaManager(object):
                            "cmd": vsql_cmd}, "error")
             raise VerticaManagerException()
 
+    def execute_count(self, stmt):
+        """
+        Executes sql stmt 'stmt' and returns the row count it reports, i.e. the rows
+        loaded by a COPY or the rows deleted by a DELETE
+
+        @type stmt: str or list
+        @param stmt: SQL query string, or list of them
+
+        @rtype: str
+        @return: Row count reported by the last statement of 'stmt'
+        """
+        vresult = self.execute(stmt=stmt)
+        return VerticaManager.getrows(vresult.output)
+
+    def query(self, stmt):
+        """
+        Executes the single sql query 'stmt' and returns its result set
+
+        @type stmt: str
+        @param stmt: SQL query string
+
+        @rtype: list
+        @return: Rows of the result as tuples of strings
+        """
+        vsql_cmd = '%s -A -t -F "|" -c "%s" ' % (self.vsql, stmt)
+        try:
+            vresult = self.shell_exec.safe_execute(vsql_cmd, verbose=False,
+                                                   as_shell=True, splitcmd=False)
+        except ShellException:
+            logkv(logger, {"msg": "VSQL command failed",
+                           "cmd": vsql_cmd}, "error")
+            raise VerticaManagerException()
+        return [tuple(line.split("|")) for line in vresult.output.splitlines() if line]
+
     def create_table(self, ddlfile):
         """
         Creates Vertica schema from the schema file
@@ -151,8 +211,9 @@ class VerticaManager(object):
         @return: None
         """
         try:
-            vsql_stmt = "drop table if exists %s.%s; create table %s.%s as select * from %s.%s where false;" \
-                        % (dstschema, dsttable,dstschema, dsttable, srcschema, srctable)
+            vsql_stmt = ["drop table if exists %s.%s" % (dstschema, dsttable),
+                         "create table %s.%s as select * from %s.%s where false"
+                         % (dstschema, dsttable, srcschema, srctable)]
             self.execute(stmt=vsql_stmt)
             logkv(logger, {"msg": "Cloned schema",
                            "source": "%s.%s" % (srcschema, srctable),
@@ -164,6 +225,98 @@ class VerticaManager(object):
                   "error", ex)
             raise
 
+    def create_staging_table(self, vschema, vtable, stagingtable):
+        """
+        Creates 'vschema'.'stagingtable' with the columns, partitioning and
+        projections of 'vschema'.'vtable', so that its partitions can be moved to
+        'vtable'. If 'stagingtable' exists already, it'll be deleted.
+
+        @type vschema: str
+        @param vschema: Vertica schema
+
+        @type vtable: str
+        @param vtable: Table the staging table is created for
+
+        @type stagingtable: str
+        @param stagingtable: Staging table
+
+        @rtype: None
+        @return: None
+        """
+        try:
+            vsql_stmt = ["drop table if exists %s.%s" % (vschema, stagingtable),
+                         "create table %s.%s like %s.%s including projections"
+                         % (vschema, stagingtable, vschema, vtable)]
+            self.execute(stmt=vsql_stmt)
+            logkv(logger, {"msg": "Created staging table",
+                           "table": "%s.%s" % (vschema, vtable),
+                           "staging_table": stagingtable}, "info")
+        except VerticaManagerException as ex:
+            logkv(logger, {"msg": "Failed to create staging table",
+                           "table": "%s.%s" % (vschema, vtable),
+                           "staging_table": stagingtable}, "error", ex)
+            raise
+
+    def publish(self, vschema, stagingtable, vtable, partition_expr=None):
+        """
+        Makes the rows of 'vschema'.'stagingtable' visible in 'vschema'.'vtable' in
+        one step. If 'partition_expr' is given, the partitions of the staging table
+        are moved to 'vtable'; otherwise the rows are copied with a single
+        INSERT ... SELECT.
+
+        @type vschema: str
+        @param vschema: Vertica schema
+
+        @type stagingtable: str
+        @param stagingtable: Staging table created by create_staging_table
+
+        @type vtable: str
+        @param vtable: Target table
+
+        @type partition_expr: str
+        @param partition_expr: Partitioning expression of 'vtable'
+
+        @rtype: None
+        @return: None
+
+        @raises: VerticaManagerException if the publish fails, or if rows are left
+        in the staging table after its partitions were moved
+        """
+        try:
+            if partition_expr:
+                # The range is taken on the values of the expression rather than
+                # on their text, which does not order numeric keys by value
+                ptn_range = self.query("select min(%s), max(%s) from %s.%s"
+                                       % (partition_expr, partition_expr,
+                                          vschema, stagingtable))
+                min_key, max_key = ptn_range[0] if ptn_range else (None, None)
+                if min_key not in (None, ""):
+                    self.execute(stmt="select move_partitions_to_table('%s.%s', '%s', "
+                                      "'%s', '%s.%s')"
+                                      % (vschema, stagingtable, min_key, max_key,
+                                         vschema, vtable))
+
+                    # Rows left in the staging table would be lost when it is dropped
+                    left = self.query("select count(*) from %s.%s"
+                                      % (vschema, stagingtable))
+                    if left and int(left[0][0]):
+                        logkv(logger, {"msg": "Staging table partitions not moved",
+                                       "staging_table": stagingtable,
+                                       "rows": left[0][0]}, "error")
+                        raise VerticaManagerException()
+            else:
+                self.execute(stmt=["insert /*+ direct */ into %s.%s select * from %s.%s"
+                                   % (vschema, vtable, vschema, stagingtable),
+                                   "commit"])
+            logkv(logger, {"msg": "Published staging table",
+                           "table": "%s.%s" % (vschema, vtable),
+                           "staging_table": stagingtable}, "info")
+        except VerticaManagerException as ex:
+            logkv(logger, {"msg": "Failed to publish staging table",
+                           "table": "%s.%s" % (vschema, vtable),
+                           "staging_table": stagingtable}, "error", ex)
+            raise
+
     def drop_table(self, vschema, vtable):
         """
         Drops table 'table' in schema 'schema'
@@ -185,74 +338,138 @@ class VerticaManager(object):
             logkv(logger, {"msg": "VSQL table drop failed"}, "error", ex)
             raise
 
-    def load(self, webhdfs_root, hdfs_path, vschema,
-             dtable, rtable, mode="direct"):
+    @staticmethod
+    def copy_mode(codec="", partfiles=None):
         """
-        Loads data from HDFS into Vertica table 'dtable
+        Chooses the load mode for data compressed with 'codec'. If the names of the
+        part files holding the data are given, the mode is chosen from their
+        extension instead, since the data may predate the current codec.
 
-        @type webhdfs_root: str
-        @param hdfs_path: WebHdfs prefix. Same as hadoop name node
+        @type codec: str
+        @param codec: Hadoop compression codec class, empty if not compressed
 
-        @type hdfs_path: str
-        @param hdfs_path: HDFS path to dataset
+        @type partfiles: list
+        @param partfiles: Part files holding the data
 
-        @type vschema: str
-        @param vschema: Vertica schema
-
-        @type dtable: str
-        @param dtable: Vertica table for data
+        @rtype: str
+        @return: Load mode. One of the keys of COPY_FILTERS
+        """
+        extensions = set(os.path.splitext(pf)[1] for pf in partfiles or [])
+        if len(extensions) == 1:
+            return EXTENSION_MODES.get(extensions.pop(), "decompress")
+        elif extensions:
+            return "decompress"
+        return CODEC_MODES.get(codec, "decompress")
 
-        @type rtable: str
-        @param rtable: Vertica table for rejected rows
+    @staticmethod
+    def copy_filter(mode):
+        """
+        Returns the COPY filter clause for load mode 'mode'. See load.
 
         @type mode: str
-        @param mode: Copy mode. Possible values: 'direct' or 'decompress'. If mode is
-        'decompress', the data in Hive partition will be decompressed to a plain text
-        format using a single node to a temporary HDFS location. IF the mode='direct'
-        an attempt will be made to directly load compressed data to vertica using the
-        appropriate filter.
-
-        mode='decompress' is required if a the MapReduce job outputs data in a compression
-        format not supported by Vertica filter function. For example BZip2. In this
-        case, we'll decompress the data before passing it to the COPY command
+        @param mode: Copy mode. One of the keys of COPY_FILTERS
 
         @rtype: str
-        @return: Number of rows loaded
+        @return: Filter clause of the COPY command
         """
-
-        if mode == "direct":
-            _filter = "FILTER GZIP()"
-        elif mode == "decompress":
-            _filter = ""
-        else:
+        try:
+            return COPY_FILTERS[mode]
+        except KeyError:
             logkv(logger, {"msg": "Invalid load mode supplied to Vertica COPY command",
                            "mode": mode}, "error")
             raise VerticaManagerException()
 
+    @staticmethod
+    def webhdfs_url(webhdfs_root, hdfs_path):
+        """
+        Returns the WebHdfs URL of 'hdfs_path'
+
+        @type webhdfs_root: str
+        @param webhdfs_root: WebHdfs prefix. Same as hadoop name node
+
+        @type hdfs_path: str
+        @param hdfs_path: HDFS path
+
+        @rtype: str
+        @return: WebHdfs URL
+        """
         # Discard the leading "/" in HDFS path. We're going to be pre-pending it with
         # webhdfs base URL
         if hdfs_path.startswith("/"):
             hdfs_path = hdfs_path[1:]
 
-        webhdfs_url = os.path.join(webhdfs_root, hdfs_path)
+        return os.path.join(webhdfs_root, hdfs_path)
+
+    def copy_stmt(self, urls, vschema, dtable, rtable, _filter, stream=None):
+        """
+        Returns the COPY command loading the WebHdfs URLs 'urls' into
+        'vschema'.'dtable'
+
+        @type urls: list
+        @param urls: WebHdfs URLs, possibly containing globs
+
+        @type stream: str
+        @param stream: Name identifying the load in Vertica's load monitoring tables
 
-        copy_cmd = '''COPY %s.%s
+        @rtype: str
+        @return: COPY command
+        """
+        stream_clause = "STREAM NAME \'%s\'" % stream if stream else ""
+        return '''COPY %s.%s
                       SOURCE Hdfs(url=\'%s\', username=\'%s\', low_speed_limit=1048576)
                       %s
                       DELIMITER E\'\\001\'
                       REJECTMAX 0
                       REJECTED DATA AS TABLE %s.%s
+                      %s
                       DIRECT
                       COMMIT
                     ''' % (vschema,
                            dtable,
-                           webhdfs_url,
+                           ",".join(urls),
                            self.connection_info["vertica_user"],
-                           _filter, vschema, rtable)
+                           _filter, vschema, rtable, stream_clause)
+
+    def load(self, webhdfs_root, hdfs_path, vschema,
+             dtable, rtable, mode="direct"):
+        """
+        Loads data from HDFS into Vertica table 'dtable
+
+        @type webhdfs_root: str
+        @param hdfs_path: WebHdfs prefix. Same as hadoop name node
+
+        @type hdfs_path: str
+        @param hdfs_path: HDFS path to dataset
+
+        @type vschema: str
+        @param vschema: Vertica schema
+
+        @type dtable: str
+        @param dtable: Vertica table for data
+
+        @type rtable: str
+        @param rtable: Vertica table for rejected rows
+
+        @type mode: str
+        @param mode: Copy mode. Possible values: 'direct' (GZIP data), 'bzip' (BZip2
+        data), 'plain' (uncompressed data) or 'decompress'. If mode is 'decompress',
+        the part files in Hive partition will have been decompressed to plain text
+        files in a temporary HDFS location. Otherwise the data is loaded as is, with
+        the filter of the mode (see copy_mode).
+
+        mode='decompress' is required if a the MapReduce job outputs data in a compression
+        format not supported by Vertica filter function. For example Snappy. In this
+        case, we'll decompress the data before passing it to the COPY command
+
+        @rtype: str
+        @return: Number of rows loaded
+        """
+        _filter = VerticaManager.copy_filter(mode)
+        webhdfs_url = VerticaManager.webhdfs_url(webhdfs_root, hdfs_path)
+        copy_cmd = self.copy_stmt([webhdfs_url], vschema, dtable, rtable, _filter)
 
         try:
-            vresult = self.execute(stmt=copy_cmd)
-            rows_loaded = VerticaManager.getrows(vresult.output)
+            rows_loaded = self.execute_count(copy_cmd)
 
             logkv(logger, {"msg": "Loaded data in HDFS path to Vertica table",
                            "hdfs_path": hdfs_path, "vschema": vschema,
@@ -263,6 +480,106 @@ class VerticaManager(object):
                   "error", ex)
             raise
 
+    def load_many(self, webhdfs_root, hdfs_dirs, vschema,
+                  dtable, rtable, mode="direct"):
+        """
+        Loads the files in each of the HDFS directories 'hdfs_dirs' into Vertica table
+        'dtable' with a single COPY command. The rows loaded from each directory are
+        looked up in v_monitor.load_sources by the stream name of the COPY. The rows
+        reported by the COPY which cannot be attributed to a directory this way are
+        counted against the last one.
+
+        @type webhdfs_root: str
+        @param webhdfs_root: WebHdfs prefix. Same as hadoop name node
+
+        @type hdfs_dirs: list
+        @param hdfs_dirs: HDFS directories whose files are to be loaded
+
+        @type vschema: str
+        @param vschema: Vertica schema
+
+        @type dtable: str
+        @param dtable: Vertica table for data
+
+        @type rtable: str
+        @param rtable: Vertica table for rejected rows
+
+        @type mode: str
+        @param mode: Copy mode. See load.
+
+        @rtype: list
+        @return: Number of rows loaded from each of 'hdfs_dirs', in the same order
+
+        @raises: VerticaManagerException if the COPY fails
+        """
+        _filter = VerticaManager.copy_filter(mode)
+        dir_urls = [VerticaManager.webhdfs_url(webhdfs_root, hdfs_dir).rstrip("/") + "/"
+                    for hdfs_dir in hdfs_dirs]
+        stream = "thrive_%s_%s" % (dtable, uuid.uuid4().hex)
+        copy_cmd = self.copy_stmt([url + "*" for url in dir_urls], vschema, dtable,
+                                  rtable, _filter, stream=stream)
+        sources_qry = "select source_name, accepted_row_count " \
+                      "from v_monitor.load_sources " \
+                      "where stream_name = \'%s\'" % stream
+
+        try:
+            total = self.execute_count(copy_cmd)
+        except VerticaManagerException as ex:
+            logkv(logger, {"msg": "Load to Vertica via WebHdfs failed",
+                           "hdfs_dirs": len(hdfs_dirs)}, "error", ex)
+            raise
+
+        # The rows of the COPY are committed at this point, hence a failure to
+        # attribute them must not fail the load: the partitions would be loaded
+        # again by the next run. Rows which cannot be attributed are counted
+        # against the last directory.
+        try:
+            sources = self.query(sources_qry)
+        except VerticaManagerException:
+            logkv(logger, {"msg": "Could not read load sources of COPY",
+                           "stream": stream}, "warning")
+            sources = []
+
+        # Attribute the rows of each source file to the directory containing it
+        rows_loaded = [0] * len(dir_urls)
+        for source_name, accepted in sources:
+            for i, url in enumerate(dir_urls):
+                if url in source_name:
+                    rows_loaded[i] += int(accepted)
+                    break
+            else:
+                logkv(logger, {"msg": "Loaded source outside of requested directories",
+                               "source": source_name, "stream": stream}, "warning")
+
+        try:
+            total = int(total)
+        except ValueError:
+            logkv(logger, {"msg": "COPY did not report the rows loaded, using the "
+                                  "rows of its load sources",
+                           "stream": stream,
+                           "rows_loaded": total}, "warning")
+            total = sum(rows_loaded)
+
+        # load_sources is not populated for every COPY, e.g. one finishing faster
+        # than the monitoring interval
+        unattributed = total - sum(rows_loaded)
+        if unattributed:
+            logkv(logger, {"msg": "Rows loaded per source do not add up to the "
+                                  "rows loaded by COPY",
+                           "stream": stream,
+                           "rows_loaded": total,
+                           "source_rows": sum(rows_loaded),
+                           "hdfs_dir": hdfs_dirs[-1]}, "warning")
+            if unattributed > 0:
+                rows_loaded[-1] += unattributed
+            else:
+                rows_loaded = [0] * (len(dir_urls) - 1) + [total]
+
+        logkv(logger, {"msg": "Loaded data in HDFS paths to Vertica table",
+                       "hdfs_dirs": len(hdfs_dirs), "vschema": vschema,
+                       "dtable": dtable, "rows_loaded": sum(rows_loaded)}, "info")
+        return rows_loaded
+
     def grant(self, privilege, level, vschema, vtable=None, to=None):
         """
         Grants 'privilege' on 'vschema'.'vtable' to 'entity'. An 'entity' can be a
@@ -329,19 +646,16 @@ class VerticaManager(object):
         @return: Count of rows deleted
         """
         try:
-            rbk_stmt = '''
-                       set session autocommit to on;
-
-                       delete from %s.%s
-                       where %s in (
-                           select %s
-                           from %s.%s
-                       );''' % (srcschema, srctable,
-                                rkey, rkey,
-                                rollbackschema, rollbacktable)
+            rbk_stmt = ["set session autocommit to on",
+                        '''delete from %s.%s
+                           where %s in (
+                               select %s
+                               from %s.%s
+                           )''' % (srcschema, srctable,
+                                    rkey, rkey,
+                                    rollbackschema, rollbacktable)]
 
-            vresult = self.execute(stmt=rbk_stmt)
-            rows = VerticaManager.getrows(vresult.output)
+            rows = self.execute_count(rbk_stmt)
 
             logkv(logger, {"msg": "rollback successful",
                            "source_schema": srcschema,
@@ -352,6 +666,70 @@ class VerticaManager(object):
             logkv(logger, {"msg": "VSQL table drop failed"}, "error", ex)
             raise VerticaManagerException()
 
+    def drop_rollback_partitions(self, srcschema, srctable,
+                                 rollbackschema, rollbacktable,
+                                 partition_expr, rkey=None):
+        """
+        Drops the partitions of srctable holding only rows that are present in
+        rollbacktable. The partitions are identified by evaluating the partitioning
+        expression of srctable on the rows of rollbacktable. A partition is dropped
+        only if the 'rkey' of each of its rows is in rollbacktable.
+
+        @type srcschema: str
+        @param srcschema: Schema of the souce table
+
+        @type srctable: str
+        @param srctable: Source table
+
+        @type rollbackschema: str
+        @param rollbackschema: Schema of the table containing rollback data
+
+        @type rollbacktable: str
+        @param rollbacktable: Table containing the rollback data
+
+        @type partition_expr: str
+        @param partition_expr: Partitioning expression of srctable
+
+        @type rkey: str
+        @param rkey: Column identifying the rows to be rolled back
+
+        @rtype: list
+        @return: Partition keys of the rows in rollbacktable whose partitions also
+        hold other rows and were left in place. These rows have to be deleted with
+        rollback().
+        """
+        ptn_qry = '''select (%(expr)s)::varchar as ptn_key,
+                             count(*) as src_rows,
+                             count(rb.rkey) as rollback_rows
+                      from %(src)s
+                      left join (select distinct %(rkey)s as rkey from %(rb)s) rb
+                      on %(src)s.%(rkey)s = rb.rkey
+                      where (%(expr)s) in (select distinct %(expr)s from %(rb)s)
+                      group by 1''' % {"expr": partition_expr,
+                                        "rkey": rkey,
+                                        "src": "%s.%s" % (srcschema, srctable),
+                                        "rb": "%s.%s" % (rollbackschema, rollbacktable)}
+        try:
+            ptn_counts = self.query(ptn_qry)
+            dropped = [ptn_key for ptn_key, src_rows, rollback_rows in ptn_counts
+                       if ptn_key and int(src_rows) == int(rollback_rows)]
+            if dropped:
+                drop_stmt = ["select drop_partition('%s.%s', '%s')"
+                             % (srcschema, srctable, ptn_key) for ptn_key in dropped]
+                self.execute(stmt=drop_stmt)
+            logkv(logger, {"msg": "Dropped rolled back partitions",
+                           "source_schema": srcschema,
+                           "source_table": srctable,
+                           "partitions": dropped}, "info")
+        except VerticaManagerException as ex:
+            logkv(logger, {"msg": "Failed to drop rolled back partitions",
+                           "source_schema": srcschema,
+                           "source_table": srctable}, "error", ex)
+            raise
+
+        return [ptn_key for ptn_key, src_rows, rollback_rows in ptn_counts
+                if ptn_key not in dropped]
+
     def truncate(self, vschema, vtable):
         """
         Truncates 'vschema.vtable'.
@@ -0,0 +1,168 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pyodbc
+import logging
+from thrive.vertica_manager import VerticaManager
+from thrive.odbc_pool import odbc_pool
+from thrive.shell_executor import command_stats, sql_operation
+from thrive.utils import logkv
+from thrive.exceptions import VerticaManagerException
+
+logger = logging.getLogger(__name__)
+
+
+class VerticaOdbcManager(VerticaManager):
+    """
+    VerticaManager backend which runs SQL statements over Vertica sessions kept in
+    the process-wide ODBC pool instead of starting a vsql client, and hence a new
+    Kerberos-authenticated session, for each of them. Script files are still run
+    through vsql.
+    """
+    def __init__(self, connection_info, driver="Vertica"):
+        """
+        @type connection_info: dict
+        @param connection_info: Same as for VerticaManager
+
+        @type driver: str
+        @param driver: Name of the Vertica ODBC driver as registered in odbcinst.ini
+
+        @rtype: None
+        @return: None
+        """
+        super(VerticaOdbcManager, self).__init__(connection_info)
+        self.connstr = "DRIVER={%s};SERVERNAME=%s;PORT=%s;DATABASE=%s;UID=%s;" \
+                       "KerberosServiceName=%s;KerberosHostName=%s" \
+                       % (driver,
+                          self.connection_info["vertica_host"],
+                          self.connection_info["vertica_port"],
+                          self.connection_info["vertica_db"],
+                          self.connection_info["vertica_user"],
+                          self.connection_info["vertica_krb_svcname"],
+                          self.connection_info["vertica_krb_host"])
+
+    def _run(self, stmt, result=None):
+        """
+        Runs 'stmt' on a single pooled session. The statements of a list are run in
+        order in one transaction, which is rolled back if any of them fails. Failed
+        statements are not retried, since a COPY may have committed rows before the
+        session broke.
+
+        @type stmt: str or list
+        @param stmt: SQL statement, run as is, or list of SQL statements
+
+        @type result: str
+        @param result: What to return of the last statement in 'stmt'. 'count' for
+        the row count it reports, 'rows' for its result set, None for nothing.
+
+        @rtype: int or list or None
+        @return: If 'result' is 'count', the value of the single-row result of the
+        last statement if it returns one (e.g. COPY), the number of affected rows
+        otherwise. If 'result' is 'rows', the rows of the result of the last
+        statement as tuples.
+
+        @raises: VerticaManagerException if a statement fails, or if the row count
+        of the last statement is not a number
+        """
+        stmts = stmt if isinstance(stmt, list) else [stmt]
+        value = None
+        with command_stats.timed("vertica.%s" % sql_operation(stmts[-1])):
+            try:
+                with odbc_pool.session(self.connstr) as connection:
+                    transaction = len(stmts) > 1
+                    if transaction:
+                        connection.autocommit = False
+                    cursor = connection.cursor()
+                    try:
+                        for sql in stmts:
+                            cursor.execute(sql)
+                            if result == "rows":
+                                value = [tuple(row) for row in cursor.fetchall()]
+                            elif result == "count":
+                                value = int(cursor.fetchone()[0]) if cursor.description \
+                                    else cursor.rowcount
+                        if transaction:
+                            connection.commit()
+                    except BaseException:
+                        if transaction:
+                            connection.rollback()
+                        raise
+                    finally:
+                        cursor.close()
+                        # Pooled sessions are handed out with autocommit set
+                        if transaction:
+                            connection.autocommit = True
+            except pyodbc.Error as ex:
+                logkv(logger, {"msg": "Vertica statement failed",
+                               "stmt": stmt,
+                               "error": str(ex)}, "error")
+                raise VerticaManagerException()
+            except (TypeError, ValueError) as ex:
+                logkv(logger, {"msg": "Vertica statement did not report a row count",
+                               "stmt": stmt,
+                               "error": str(ex)}, "error")
+                raise VerticaManagerException()
+        return value
+
+    def execute(self, stmt=None, scriptfile=None):
+        """
+        Execute sql stmt 'stmt' or sql script file 'scriptfile'
+
+        @type stmt: str or list
+        @param stmt: SQL query string, or list of them to be run in one transaction
+
+        @type scriptfile: str
+        @param scriptfile: Location of scriptfile containing commands to execute
+
+        @rtype: None or ShellResult
+        @return: None if 'stmt' is run, the result of the vsql command running
+        'scriptfile' otherwise. Results returned by 'stmt' are discarded.
+        """
+        if stmt and not scriptfile:
+            return self._run(stmt)
+        return super(VerticaOdbcManager, self).execute(stmt=stmt, scriptfile=scriptfile)
+
+    def execute_count(self, stmt):
+        """
+        Executes sql stmt 'stmt' and returns the row count it reports, i.e. the rows
+        loaded by a COPY or the rows deleted by a DELETE
+
+        @type stmt: str or list
+        @param stmt: SQL query string, or list of them to be run in one transaction
+
+        @rtype: int
+        @return: Row count reported by the last statement of 'stmt'
+        """
+        return self._run(stmt, result="count")
+
+    def query(self, stmt):
+        """
+        Executes the single sql query 'stmt' and returns its result set
+
+        @type stmt: str
+        @param stmt: SQL query string
+
+        @rtype: list
+        @return: Rows of the result as tuples
+        """
+        return self._run(stmt, result="rows")
+
+    def close(self):
+        """
+        Closes the idle pooled sessions of the Vertica connection
+
+        @rtype: None
+        @return: None
+        """
+        odbc_pool.close(self.connstr)
@@ -0,0 +1,487 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import socket
+import httplib
+import urllib
+import urlparse
+import logging
+import threading
+from thrive.hdfs_manager import HdfsManager
+from thrive.shell_executor import command_cache, command_stats
+from thrive.utils import logkv, pathjoin
+from thrive.exceptions import HdfsManagerException, WebHdfsManagerException
+
+logger = logging.getLogger(__name__)
+
+
+class WebHdfsSession(object):
+    """
+    Keep-alive HTTP session against the WebHDFS REST endpoint of a namenode.
+    Connections are pooled per host, so that consecutive requests (including
+    the datanode redirects of file uploads) reuse open sockets instead of paying
+    for a new TCP handshake every time.
+    """
+    def __init__(self, webhdfs_root, hdfs_user, timeout=30, pool_size=4):
+        """
+        @type webhdfs_root: str
+        @param webhdfs_root: WebHDFS url of the namenode. E.g.
+        "http://namenode:50070/webhdfs/v1"
+
+        @type hdfs_user: str
+        @param hdfs_user: User on whose behalf the requests are made
+
+        @type timeout: int
+        @param timeout: Socket timeout in seconds
+
+        @type pool_size: int
+        @param pool_size: Maximum number of idle connections kept per host
+
+        @rtype: None
+        @return: None
+        """
+        parsed = urlparse.urlparse(webhdfs_root)
+        self.scheme = parsed.scheme
+        self.netloc = parsed.netloc
+        self.prefix = parsed.path.rstrip("/")
+        self.hdfs_user = hdfs_user
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._idle = dict()
+        self._lock = threading.Lock()
+
+    def _acquire(self, scheme, netloc):
+        """
+        Returns an idle connection to 'netloc' or opens a new one
+
+        @rtype: tuple
+        @return: (connection, reused) where reused is True for pooled connections
+        """
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+
+        if scheme == "https":
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout), False
+        return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def _release(self, scheme, netloc, conn):
+        """
+        Returns a connection to the pool, closing it if the pool is full
+
+        @rtype: None
+        @return: None
+        """
+        with self._lock:
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def url(self, hdfspath, op, params=None):
+        """
+        Composes the WebHDFS request path for operation 'op' on 'hdfspath'
+
+        @rtype: str
+        @return: Request path (including the query string) relative to the namenode
+        """
+        query = [("op", op), ("user.name", self.hdfs_user)]
+        if params:
+            query.extend(sorted(params.items()))
+        return "%s%s?%s" % (self.prefix,
+                            urllib.quote(pathjoin("/", hdfspath)),
+                            urllib.urlencode(query))
+
+    def request(self, method, path, body=None, scheme=None, netloc=None):
+        """
+        Sends a request over a pooled connection. A request failing on a reused
+        connection is retried once on a fresh one, because the server may have
+        closed the idle socket in the meantime.
+
+        @type method: str
+        @param method: HTTP method
+
+        @type path: str
+        @param path: Request path, including the query string
+
+        @type body: str
+        @param body: Request body
+
+        @rtype: tuple
+        @return: (status, headers, body) of the response
+
+        @raises: WebHdfsManagerException on transport failures
+        """
+        scheme = scheme or self.scheme
+        netloc = netloc or self.netloc
+
+        while True:
+            conn, reused = self._acquire(scheme, netloc)
+            try:
+                conn.request(method, path, body)
+                response = conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error) as ex:
+                conn.close()
+                if reused:
+                    continue
+                logkv(logger, {"msg": "WebHDFS request failed",
+                               "method": method,
+                               "host": netloc,
+                               "path": path,
+                               "error": ex}, "warning")
+                raise WebHdfsManagerException()
+
+            if response.getheader("connection", "").lower() == "close":
+                conn.close()
+            else:
+                self._release(scheme, netloc, conn)
+            return response.status, dict(response.getheaders()), data
+
+    def close(self):
+        """
+        Closes all pooled connections
+
+        @rtype: None
+        @return: None
+        """
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = dict()
+
+
+class WebHdfsManager(HdfsManager):
+    """
+    HdfsManager backend which performs HDFS operations through the WebHDFS REST API
+    of the active namenode instead of forking a 'hadoop fs' JVM for each of them.
+    Operations without a WebHDFS counterpart (e.g. decompress) or needing one
+    request per file (recursive grants) are inherited from the command-line backend.
+    If the namenode cannot be reached and 'fallback' is set, the command-line
+    backend also serves the failed operation.
+
+    Requests authenticate as 'hdfs_user' with the 'user.name' parameter only. A
+    Kerberized namenode rejects them, after which all operations are served by the
+    command-line backend, which authenticates with the Kerberos ticket of the
+    process.
+    """
+    def __init__(self, webhdfs_root, hdfs_user, fallback=True, timeout=30, pool_size=4,
+                 nn_cache=None):
+        """
+        @type webhdfs_root: str
+        @param webhdfs_root: WebHDFS url of the active namenode
+
+        @type hdfs_user: str
+        @param hdfs_user: User on whose behalf the HDFS operations are made
+
+        @type fallback: bool
+        @param fallback: Use the command-line backend if WebHDFS is unreachable
+
+        @type nn_cache: NamenodeCache
+        @param nn_cache: Cache holding 'webhdfs_root', invalidated if the namenode
+        turns out to be unreachable or standby
+
+        @rtype: None
+        @return: None
+        """
+        super(WebHdfsManager, self).__init__()
+        self.webhdfs_root = webhdfs_root
+        self.fallback = fallback
+        self.nn_cache = nn_cache
+        self.authorized = True
+        self.session = WebHdfsSession(webhdfs_root, hdfs_user,
+                                      timeout=timeout, pool_size=pool_size)
+
+    def _call(self, method, hdfspath, op, params=None, body=None, allowed=(200,)):
+        """
+        Performs WebHDFS operation 'op' on 'hdfspath'. Namenode redirects (issued
+        for operations that move data) are followed to the indicated datanode.
+
+        @rtype: tuple
+        @return: (status, decoded JSON response or None)
+
+        @raises: WebHdfsManagerException if the namenode cannot be reached or
+        rejects the authentication of the requests, HdfsManagerException if the
+        response status is not in 'allowed'
+        """
+        # Once the authentication is rejected, so is every further request
+        if not self.authorized:
+            raise WebHdfsManagerException()
+
+        with command_stats.timed("hdfs.%s" % op.lower()):
+            status, headers, data = self.session.request(method,
+                                                         self.session.url(hdfspath, op, params))
+
+            if status == 307:
+                location = urlparse.urlparse(headers.get("location", ""))
+                path = location.path
+                if location.query:
+                    path = "%s?%s" % (path, location.query)
+                status, headers, data = self.session.request(method, path, body,
+                                                             scheme=location.scheme,
+                                                             netloc=location.netloc)
+
+            # A 403 for a denied HDFS permission is a failure of the operation itself
+            if status == 401 or (status == 403 and "AccessControlException" not in (data or "")):
+                self.authorized = False
+                logkv(logger, {"msg": "WebHDFS authentication rejected",
+                               "op": op,
+                               "namenode": self.webhdfs_root,
+                               "status": status}, "warning")
+                raise WebHdfsManagerException()
+
+            if status not in allowed:
+                # A standby namenode rejects all operations. It must not be served from
+                # the cache to the next load either.
+                if self.nn_cache is not None and "StandbyException" in (data or ""):
+                    self.nn_cache.invalidate()
+                logkv(logger, {"msg": "WebHDFS operation failed",
+                               "op": op,
+                               "path": hdfspath,
+                               "status": status,
+                               "response": data}, "warning")
+                raise HdfsManagerException()
+
+            try:
+                return status, json.loads(data) if data else None
+            except ValueError:
+                return status, None
+
+    def _fallback(self, operation, *args):
+        """
+        Serves 'operation' through the command-line backend after a WebHDFS
+        transport or authentication failure, or re-raises the failure if fallback
+        is disabled.
+
+        @rtype: object
+        @return: Return value of the command-line implementation of 'operation'
+        """
+        # A namenode which rejected the authentication is still the active one
+        if self.nn_cache is not None and self.authorized:
+            self.nn_cache.invalidate()
+
+        if not self.fallback:
+            raise HdfsManagerException()
+
+        logkv(logger, {"msg": "WebHDFS unavailable, falling back to hadoop CLI",
+                       "operation": operation,
+                       "namenode": self.webhdfs_root}, "warning")
+        return getattr(super(WebHdfsManager, self), operation)(*args)
+
+    def _status(self, hdfspath):
+        """
+        @rtype: dict
+        @return: FileStatus of 'hdfspath' or None if the path does not exist
+        """
+        status, response = self._call("GET", hdfspath, "GETFILESTATUS", allowed=(200, 404))
+        if status == 404:
+            return None
+        return response["FileStatus"]
+
+    def _liststatus(self, hdfspath):
+        """
+        @rtype: list
+        @return: FileStatus of each entry in directory 'hdfspath'
+        """
+        _, response = self._call("GET", hdfspath, "LISTSTATUS")
+        return response["FileStatuses"]["FileStatus"]
+
+    def makedir(self, dirpath):
+        """
+        Makes an HDFS directory at dirpath
+
+        @type dirpath: str
+        @param dirpath: HDFS path
+
+        @rtype: None
+        @return: None
+        """
+        command_cache.invalidate(dirpath)
+        try:
+            _, response = self._call("PUT", dirpath, "MKDIRS")
+            if not (response or dict()).get("boolean"):
+                raise HdfsManagerException()
+            logkv(logger, {"msg": "Created %s" % dirpath})
+        except WebHdfsManagerException:
+            self._fallback("makedir", dirpath)
+        except HdfsManagerException:
+            logkv(logger, {"msg": "HDFS makedir failed. %s" % dirpath}, "error")
+            raise
+
+    def rmdir(self, dirpath):
+        """
+        Removes HDFS directory at dirpath
+
+        @type dirpath: str
+        @param dirpath: HDFS path
+
+        @rtype: None
+        @return: None
+        """
+        command_cache.invalidate(dirpath)
+        try:
+            _, response = self._call("DELETE", dirpath, "DELETE", {"recursive": "true"})
+            if not (response or dict()).get("boolean"):
+                raise HdfsManagerException()
+            logkv(logger, {"msg": "Deleted %s" % dirpath})
+        except WebHdfsManagerException:
+            self._fallback("rmdir", dirpath)
+        except HdfsManagerException:
+            logkv(logger, {"msg": "HDFS rmdir failed. %s" % dirpath}, "warning")
+            raise
+
+    def putfile(self, localpath, hdfspath):
+        """
+        Copies a resource from local path to HDFS path. As with 'hadoop fs -put', if
+        hdfspath is a directory the resource is placed inside it.
+
+        @type localpath: str
+        @param localpath: Path to resource on local fileystem
+
+        @type hdfspath: str
+        @param hdfspath: HDFS destination path
+
+        @rtype: None
+        @return: None
+        """
+        command_cache.invalidate(hdfspath)
+        try:
+            status = self._status(hdfspath)
+            target = hdfspath
+            if status is not None and status["type"] == "DIRECTORY":
+                target = os.path.join(hdfspath, os.path.basename(localpath))
+
+            with open(localpath, "rb") as lf:
+                self._call("PUT", target, "CREATE", {"overwrite": "false"},
+                           body=lf.read(), allowed=(201,))
+            logkv(logger, {"msg": "Put %s to HDFS path %s" % (localpath, hdfspath)}, "info")
+        except WebHdfsManagerException:
+            self._fallback("putfile", localpath, hdfspath)
+        except (HdfsManagerException, IOError):
+            logkv(logger, {"msg": "HDFS putfile failed. %s %s" % (localpath, hdfspath)}, "error")
+            raise HdfsManagerException()
+
+    def path_exists(self, hdfspath):
+        """
+        Checks if the specified HDFS path exists.
+
+        @type hdfspath: str
+        @param hdfspath: HDFS path to check
+
+        @rtype: bool
+        @return: True if the hdfspath exists, False otherwise
+
+        @raises: HdfsManagerException if the status of 'hdfspath' cannot be read
+        """
+        try:
+            if self._status(hdfspath) is not None:
+                return True
+        except WebHdfsManagerException:
+            return self._fallback("path_exists", hdfspath)
+        except HdfsManagerException:
+            logkv(logger, {"msg": "Could not check if path exists",
+                           "path": hdfspath}, "error")
+            raise
+
+        logkv(logger, {"msg": "Path does not exist",
+                       "path": hdfspath}, "info")
+        return False
+
+    def paths_exist(self, hdfspaths):
+        """
+        Checks which of the specified HDFS paths exist. Status requests are cheap
+        over the pooled connections, so the paths are checked one after another.
+
+        @type hdfspaths: list
+        @param hdfspaths: HDFS paths to check
+
+        @rtype: dict
+        @return: Dictionary mapping each of 'hdfspaths' to True if it exists and
+        False otherwise
+        """
+        return dict((hp, self.path_exists(hp)) for hp in hdfspaths)
+
+    def grant(self, permissions, hdfspaths):
+        """
+        Grants 'permissions' to all on each of 'hdfspaths', but not on their contents
+
+        @type permissions: str
+        @param permissions: Permission string. E.g: "rx"
+
+        @type hdfspaths: list
+        @param hdfspaths: HDFS paths to grant permissions on
+
+        @rtype: None
+        @return: None
+        """
+        bits = {"r": 4, "w": 2, "x": 1}
+        mask = 0111 * sum(bits.get(p, 0) for p in set(permissions))
+
+        try:
+            for path in hdfspaths:
+                status = self._status(path)
+                if status is None:
+                    raise HdfsManagerException()
+
+                current = int(status["permission"], 8)
+                if current | mask != current:
+                    self._call("PUT", path, "SETPERMISSION",
+                               {"permission": "%o" % (current | mask)})
+
+            logkv(logger,
+                  {"msg": "Granted permissions",
+                   "permissions": permissions,
+                   "paths": ",".join(hdfspaths)}, "info")
+        except WebHdfsManagerException:
+            self._fallback("grant", permissions, hdfspaths)
+        except HdfsManagerException:
+            logkv(logger,
+                  {"msg": "Error granting permissions",
+                   "permissions": permissions,
+                   "paths": ",".join(hdfspaths)}, "warning")
+            raise
+
+    def ls(self, hdfspath, cached=False):
+        """
+        Lists the contents of 'hdfspath' as full paths, one per entry. WebHDFS
+        listings are not cached; 'cached' only applies to the CLI fallback.
+
+        @type hdfspath: str
+        @param hdfspath: HDFS path to list
+
+        @type cached: bool
+        @param cached: Passed on to HdfsManager.ls on fallback
+
+        @rtype: list
+        @return: Full paths of the entries in 'hdfspath'
+        """
+        try:
+            return [os.path.join(hdfspath, status["pathSuffix"])
+                    for status in self._liststatus(hdfspath)]
+        except WebHdfsManagerException:
+            return self._fallback("ls", hdfspath, cached)
+
+    def close(self):
+        """
+        Closes the pooled WebHDFS connections
+
+        @rtype: None
+        @return: None
+        """
+        self.session.close()
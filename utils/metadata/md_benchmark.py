@@ -0,0 +1,159 @@
+# Copyright 2016 Intuit
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Benchmark of the metadata lookups made by every load against a growing load
+history. Run from the Thrive root directory as
+
+    python utils/metadata/md_benchmark.py -f <env-config-file> -d <scratch-db>
+
+The metadata tables are recreated from md_schema.sql in the scratch database
+<scratch-db>, which must differ from the database in the config file, and the
+migrations are applied unless --no-migrations is given. thrive_load_metadata is
+then grown to each of the sizes in --sizes, and the median and 95th percentile
+times of each lookup are reported. With the indexes of the migrations in place,
+the times stay flat as the history grows; without them, they grow with it.
+
+With 'dbtype=sqlite' in the config file, <scratch-db> is the path of a SQLite
+database file, so that the benchmark runs without a MySQL server.
+"""
+
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from optparse import OptionParser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, ROOT)
+
+from thrive.config_loader import ConfigLoader
+from thrive.metadata_manager import MetadataManager
+from thrive.sqlite_metadata_manager import SqliteMetadataManager
+from thrive.utils import iso_format, percentile, read_sql_script, read_migrations
+
+MD_DIR = os.path.join(ROOT, "utils", "metadata")
+
+# Datasets the history is spread over
+DATASETS = 100
+
+# Rows inserted per transaction while growing the history
+INSERT_BATCH = 10000
+
+
+def history_row(i):
+    """
+    Returns the i-th row of a synthetic load history: one hourly partition of one
+    of DATASETS datasets, loaded into Hive and Vertica
+    """
+    dataset = "dataset_%03d" % (i % DATASETS)
+    ptn_ts = datetime(2016, 1, 1) + timedelta(hours=i // DATASETS)
+    ptn = "%s/0" % ptn_ts.strftime("%Y/%m/%d/%H")
+    ts = iso_format(ptn_ts)
+    return {
+        "load_id": str(uuid.uuid1()),
+        "load_type": "scheduled",
+        "dataset_name": dataset,
+        "hive_db": "hive_db",
+        "hive_table": dataset,
+        "hive_start_ts": ts,
+        "hive_end_ts": ts,
+        "last_load_folder": ptn_ts.strftime("d_%Y%m%d-%H10"),
+        "hive_last_partition": ptn,
+        "vertica_last_partition": ptn,
+        "status": "SUCCESS"
+    }
+
+
+def timed(fn, repeat):
+    """
+    Returns the run times of 'repeat' calls to 'fn' in milliseconds
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        times.append(1000.0 * (time.time() - start))
+    return times
+
+
+def main():
+    parser = OptionParser("python utils/metadata/md_benchmark.py -f <env-config-file> "
+                          "-d <scratch-db> [--sizes=10000,100000,1000000] "
+                          "[--repeat=50] [--no-migrations]")
+    parser.add_option("-f", dest="envcfg_file", action="store",
+                      help="Environment config file with the metadata database configs")
+    parser.add_option("-d", dest="database", action="store",
+                      help="Scratch database in which the metadata tables are recreated")
+    parser.add_option("--sizes", dest="sizes", action="store",
+                      default="10000,100000,1000000",
+                      help="Comma-separated history sizes at which the lookups are timed")
+    parser.add_option("--repeat", dest="repeat", action="store", type="int", default=50,
+                      help="Number of times each lookup is run per size")
+    parser.add_option("--no-migrations", dest="migrations", action="store_false",
+                      default=True, help="Benchmark the schema without migrations")
+    (options, args) = parser.parse_args()
+
+    if not options.envcfg_file or not options.database:
+        parser.error("Options -f and -d are required")
+
+    envcfg = ConfigLoader(options.envcfg_file)
+    if envcfg.get_config("main", "dbtype").strip().lower() == "sqlite":
+        credtypes = ["dbtype", "dbname"]
+        mdmgr_class = SqliteMetadataManager
+    else:
+        credtypes = ["dbtype", "dbhost", "dbport", "dbuser", "dbpass", "dbname"]
+        mdmgr_class = MetadataManager
+    credentials = dict((cred, envcfg.get_config("main", cred).strip())
+                       for cred in credtypes)
+    if options.database == credentials["dbname"]:
+        parser.error("The scratch database must differ from the metadata database")
+    credentials["dbname"] = options.database
+
+    mm = mdmgr_class(credentials)
+    for stmt in read_sql_script(os.path.join(MD_DIR, "md_schema.sql")):
+        mm.execute(stmt)
+    if options.migrations:
+        mm.migrate(read_migrations(os.path.join(MD_DIR, "migrations")))
+
+    mm.insert_many([{"dataset_name": "dataset_%03d" % d, "locked": 0,
+                     "release_attempts": 0} for d in range(DATASETS)], mdtype="lock")
+
+    lookups = [
+        ("get_lastdir", lambda: mm.get_lastdir("dataset_042", "dataset_042", "scheduled")),
+        ("get_unprocessed_partitions",
+         lambda: mm.get_unprocessed_partitions("hive_db", "dataset_042")),
+        ("get_lock_status", lambda: mm.get_lock_status("dataset_042"))
+    ]
+
+    rows = 0
+    for size in sorted(int(s) for s in options.sizes.split(",")):
+        while rows < size:
+            batch = min(INSERT_BATCH, size - rows)
+            mm.insert_many([history_row(i) for i in range(rows, rows + batch)],
+                           mdtype="load")
+            rows += batch
+
+        for name, lookup in lookups:
+            times = timed(lookup, options.repeat)
+            print "%10d rows  %-28s p50 %8.2f ms  p95 %8.2f ms" \
+                  % (rows, name, percentile(times, 50), percentile(times, 95))
+
+    mm.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -64,3 +64,15 @@ locked bool default FALSE,
 release_attempts int default 0
 );
 
+-- Migrations applied to the tables above, see migrations/. Apply them with
+-- "python runthrive.py --phase=migrate" after running this file. Tables created
+-- by migrations are dropped too, so that the migrations can be applied again.
+drop table if exists thrive_dataset_state;
+
+drop table if exists thrive_schema_version;
+
+create table thrive_schema_version (
+  version int primary key,
+  description varchar(500),
+  applied_ts timestamp default current_timestamp
+);
@@ -0,0 +1,32 @@
+-- # Copyright 2016 Intuit
+-- #
+-- # Licensed under the Apache License, Version 2.0 (the "License");
+-- # you may not use this file except in compliance with the License.
+-- # You may obtain a copy of the License at
+-- #
+-- #     http://www.apache.org/licenses/LICENSE-2.0
+-- #
+-- # Unless required by applicable law or agreed to in writing, software
+-- # distributed under the License is distributed on an "AS IS" BASIS,
+-- # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- # See the License for the specific language governing permissions and
+-- # limitations under the License.
+
+-- Indexes for the metadata lookups made by every load of every dataset. Text
+-- columns are indexed by prefix to stay within the InnoDB key length limit.
+
+-- MetadataManager.get_lastdir: latest load of a dataset and table
+create index thrive_load_metadata_lastdir
+  on thrive_load_metadata (dataset_name(100), hive_table(100), load_type, hive_end_ts);
+
+-- MetadataManager.get_unprocessed_partitions: partitions not loaded into Vertica
+create index thrive_load_metadata_unprocessed
+  on thrive_load_metadata (hive_db(100), hive_table(100), vertica_last_partition(100));
+
+-- MetadataManager.delete and purge: rows of a dataset and partition
+create index thrive_load_metadata_partition
+  on thrive_load_metadata (dataset_name(100), hive_last_partition(100));
+
+-- Lock status lookups and updates
+create index thrive_dataset_lock_dataset
+  on thrive_dataset_lock (dataset_name(100));
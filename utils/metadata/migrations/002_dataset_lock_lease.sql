@@ -0,0 +1,27 @@
+-- # Copyright 2016 Intuit
+-- #
+-- # Licensed under the Apache License, Version 2.0 (the "License");
+-- # you may not use this file except in compliance with the License.
+-- # You may obtain a copy of the License at
+-- #
+-- #     http://www.apache.org/licenses/LICENSE-2.0
+-- #
+-- # Unless required by applicable law or agreed to in writing, software
+-- # distributed under the License is distributed on an "AS IS" BASIS,
+-- # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- # See the License for the specific language governing permissions and
+-- # limitations under the License.
+
+-- Lease-based dataset locks. A lock records the load holding it and the time
+-- its lease expires; loads renew the lease while they run and take over locks
+-- whose lease has expired.
+
+alter table thrive_dataset_lock
+  add column holder varchar(200) default null,
+  add column lease_expiry timestamp null default null;
+
+-- Locks held by loads of earlier versions, which do not renew their lease, can be
+-- taken over after two hours
+update thrive_dataset_lock
+  set lease_expiry = timestampadd(hour, 2, now())
+  where locked = TRUE;
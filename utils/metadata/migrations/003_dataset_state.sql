@@ -0,0 +1,27 @@
+-- # Copyright 2016 Intuit
+-- #
+-- # Licensed under the Apache License, Version 2.0 (the "License");
+-- # you may not use this file except in compliance with the License.
+-- # You may obtain a copy of the License at
+-- #
+-- #     http://www.apache.org/licenses/LICENSE-2.0
+-- #
+-- # Unless required by applicable law or agreed to in writing, software
+-- # distributed under the License is distributed on an "AS IS" BASIS,
+-- # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- # See the License for the specific language governing permissions and
+-- # limitations under the License.
+
+-- Load state of each dataset, updated in the transaction recording its loads:
+--   'lastdir:<load_type>': last Camus directory loaded
+--   'part:<YYYY/MM/DD/HH>': next part number of the hour partition
+-- Names and keys are ASCII, which keeps the primary key within the InnoDB key
+-- length limit.
+
+create table thrive_dataset_state (
+  dataset_name varchar(100) not null,
+  hive_table varchar(100) not null,
+  state_key varchar(40) not null,
+  state_value varchar(500) not null,
+  PRIMARY KEY (dataset_name, hive_table, state_key)
+) default charset = latin1;